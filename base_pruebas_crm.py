@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Base común para los tests del CRM: directorio de datos temporal por test,
+caché compartido vacío y un constructor de DataFrames de clientes.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+import crm
+from crm import COLUMNS
+
+
+class PruebaCRMBase(unittest.TestCase):
+    """TestCase que redirige los archivos del CRM a un directorio temporal"""
+
+    def setUp(self):
+        """Configuración inicial para cada test"""
+        # Crear directorio temporal para pruebas
+        self.test_dir = tempfile.mkdtemp()
+        self.original_data_dir = crm.DATA_DIR
+
+        # Redirigir DATA_DIR a directorio temporal
+        self._redirigir(Path(self.test_dir))
+
+        # Crear directorios necesarios
+        crm.DATA_DIR.mkdir(exist_ok=True)
+        crm.DOCS_DIR.mkdir(exist_ok=True)
+
+        print(f"🔧 Configurando test en directorio temporal: {self.test_dir}")
+
+    def tearDown(self):
+        """Limpieza después de cada test"""
+        # Limpiar directorio temporal
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+        # Restaurar DATA_DIR original
+        self._redirigir(self.original_data_dir)
+
+        print(f"🧹 Limpieza del test completada")
+
+    @staticmethod
+    def _redirigir(directorio: Path):
+        crm.DATA_DIR = directorio
+        crm.CLIENTES_CSV = crm.DATA_DIR / "clientes.csv"
+        crm.DOCS_DIR = crm.DATA_DIR / "docs"
+        crm.HISTORIAL_CSV = crm.DATA_DIR / "historial.csv"
+        crm.CLIENTES_DB = crm.DATA_DIR / "clientes.db"
+        crm.HISTORIAL_JOURNAL = crm.DATA_DIR / "historial.jsonl"
+        crm.HISTORIAL_SNAPSHOT = crm.DATA_DIR / "historial_compacto.parquet"
+
+        # El caché compartido vive a nivel proceso: vaciarlo para aislar cada test
+        crm._data_cache().clear()
+
+    def _df_clientes(self, **columnas) -> pd.DataFrame:
+        """Clientes con todas las COLUMNS vacías salvo las indicadas (listas del mismo largo)."""
+        n = len(next(iter(columnas.values()))) if columnas else 0
+        df = pd.DataFrame({c: [""] * n for c in COLUMNS})
+        for c, valores in columnas.items():
+            df[c] = valores
+        return df
@@ -502,7 +502,14 @@ import secrets
 import difflib
 import unicodedata
 import time
-
+import random
+import threading
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import atexit
+
+import numpy as np
 import pandas as pd
 import gspread
 from gspread_dataframe import get_as_dataframe, set_with_dataframe
@@ -637,29 +644,13 @@ def render_kpi_card(label: str, value: any, delta: str = None, icon: str = "📊
 
 def calcular_analisis_financiero(df: pd.DataFrame) -> dict:
     """Calcula métricas financieras del portfolio de clientes"""
-    import re
-    
-    def limpiar_monto(monto_str):
-        """Convierte string de monto a float, manejando diferentes formatos"""
-        if pd.isna(monto_str) or str(monto_str).strip() == "":
-            return 0.0
-        
-        # Convertir a string y limpiar
-        monto_clean = str(monto_str).strip()
-        
-        # Remover símbolos de moneda y espacios
-        monto_clean = re.sub(r'[,$\s]', '', monto_clean)
-        
-        # Intentar convertir a float
-        try:
-            return float(monto_clean)
-        except (ValueError, TypeError):
-            return 0.0
-    
-    # Limpiar y convertir montos
-    df_temp = df.copy()
-    df_temp['monto_propuesta_num'] = df_temp['monto_propuesta'].apply(limpiar_monto)
-    df_temp['monto_final_num'] = df_temp['monto_final'].apply(limpiar_monto)
+    # Montos ya convertidos a float en la instantánea tipada
+    snap = snapshot_clientes(df)
+    df_temp = pd.DataFrame({
+        'estatus': snap['estatus'].astype(str),
+        'monto_propuesta_num': snap['monto_propuesta'],
+        'monto_final_num': snap['monto_final'],
+    })
     
     # Calcular métricas
     total_propuesto = df_temp['monto_propuesta_num'].sum()
@@ -702,41 +693,754 @@ def formatear_monto(monto: float) -> str:
         return f"${monto:,.0f}"
 
 
-def generar_presentacion_dashboard(df_cli: pd.DataFrame) -> bytes:
-    """Genera una presentación PowerPoint completa del dashboard con gráficas"""
+# === INSTANTÁNEA TIPADA DE CLIENTES ===
+# cargar_clientes entrega todo como texto (así se guarda en SQLite y en Sheets). La instantánea
+# convierte una sola vez por carga: montos a float64, score a numérico, fechas a datetime64
+# (parse_dates_flexible) y los campos de pocas opciones a category. Se comparte entre
+# vistas y sesiones: es de sólo lectura (quien necesite modificarla debe copiarla).
+SNAPSHOT_MONTOS = ["monto_propuesta", "monto_final"]
+SNAPSHOT_NUMERICOS = ["score"]
+SNAPSHOT_FECHAS = ["fecha_ingreso", "fecha_dispersion"]
+SNAPSHOT_CATEGORIAS = ["estatus", "segundo_estatus", "sucursal", "asesor", "fuente", "analista"]
+
+def _montos_a_float(serie: pd.Series) -> pd.Series:
+    """'$12,500' -> 12500.0 (vacíos o inválidos -> 0.0), vectorizado."""
+    limpio = serie.fillna("").astype(str).str.replace(r"[,$\s]", "", regex=True)
+    return pd.to_numeric(limpio, errors="coerce").fillna(0.0)
+
+def construir_snapshot(df: pd.DataFrame) -> pd.DataFrame:
+    """Copia tipada de los clientes (mismo índice y columnas que `df`)."""
+    snap = df.copy()
+    for c in COLUMNS:
+        if c not in snap.columns:
+            snap[c] = ""
+    for c in SNAPSHOT_MONTOS:
+        snap[c] = _montos_a_float(snap[c]).astype("float64")
+    for c in SNAPSHOT_NUMERICOS:
+        snap[c] = pd.to_numeric(snap[c].fillna("").astype(str).str.strip(), errors="coerce")
+    for c in SNAPSHOT_FECHAS:
+        snap[c] = pd.to_datetime(parse_dates_flexible(snap[c].fillna("").astype(str)), errors="coerce")
+    for c in SNAPSHOT_CATEGORIAS:
+        snap[c] = snap[c].fillna("").astype(str).astype("category")
+    return snap
+
+def _clave_datos(df: pd.DataFrame | None) -> str:
+    """'carga:<versión>' para los clientes en caché (df=None); 'hash:<sha1>' para otro DataFrame."""
+    if df is None:
+        return f"carga:{_data_cache().version('clientes')}"
+    return f"hash:{hash_contenido_df(df)}"
+
+def snapshot_clientes(df: pd.DataFrame | None = None) -> pd.DataFrame:
+    """
+    Instantánea tipada memorizada. Sin argumentos corresponde a la última carga de
+    cargar_clientes (se reconstruye cuando cambia su versión); con `df`, por hash del contenido.
+    """
+    cache = _data_cache()
+    clave = _clave_datos(df)
+    snap = cache.get(f"snapshot:{clave}")
+    if snap is None:
+        if df is None:
+            base = cargar_clientes()
+            clave = _clave_datos(None)  # la carga pudo refrescar la versión
+        else:
+            base = df
+        snap = construir_snapshot(base)
+        # Sólo se conserva la instantánea más reciente de cada familia (carga / hash)
+        cache.invalidate(f"snapshot:{clave.split(':', 1)[0]}:")
+        cache.put(f"snapshot:{clave}", snap)
+    return snap
+
+def _fechas_alineadas(df: pd.DataFrame, snap: pd.DataFrame | None) -> pd.DataFrame | None:
+    """Fechas ya parseadas de la instantánea para las filas de `df` (None si no corresponden)."""
+    if snap is None or df.empty or "id" not in df.columns:
+        return None
+    try:
+        if not df.index.isin(snap.index).all():
+            return None
+        sub = snap.loc[df.index]
+        if not sub["id"].astype(str).equals(df["id"].astype(str)):
+            return None
+        return sub[[c for c in SNAPSHOT_FECHAS if c in df.columns]]
+    except Exception:
+        return None
+
+# === ÍNDICE DE FILTROS DEL SIDEBAR ===
+# Cada campo filtrable se guarda como códigos (factorize) con un bitmap empaquetado por valor.
+# Un filtro es el OR de los bitmaps de los valores elegidos y el resultado final el AND de
+# los campos: cambiar la selección no vuelve a recorrer el texto de los clientes.
+# El índice se reconstruye sólo cuando cambia la versión de los datos.
+FILTRO_CAMPOS = ["sucursal", "asesor", "estatus", "fuente"]
+
+def etiquetas_filtro(serie: pd.Series, campo: str) -> pd.Series:
+    """Etiqueta con la que cada cliente aparece en el filtro de `campo` (vacíos -> '(Sin ...)')."""
+    s = serie.astype(str).fillna("") if isinstance(serie.dtype, pd.CategoricalDtype) else serie.fillna("").astype(str)
+    if campo == "sucursal":
+        return s.replace({"": "(Sin sucursal)"})
+    if campo == "asesor":
+        s = s.str.strip()
+        return s.mask((s == "") | (s.str.casefold() == "(sin asesor)"), "(Sin asesor)")
+    if campo == "fuente":
+        s = s.str.strip()
+        return s.mask(s == "", "(Sin fuente)")
+    return s
+
+class _IndiceFiltros:
+    """Bitmaps por valor de cada campo de FILTRO_CAMPOS sobre un conjunto fijo de clientes."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.n = len(df)
+        self.clave = None   # versión de los datos (la asigna indice_filtros)
+        self.ids = df["id"].astype(str).to_numpy() if "id" in df.columns else np.array([], dtype=object)
+        self._bitmaps: dict = {}   # campo -> {valor: bits empaquetados (uint8)}
+        for campo in FILTRO_CAMPOS:
+            serie = df[campo] if campo in df.columns else pd.Series("", index=df.index)
+            codigos, valores = pd.factorize(etiquetas_filtro(serie, campo))
+            orden = np.argsort(codigos, kind="stable")
+            cortes = np.searchsorted(codigos[orden], np.arange(len(valores) + 1))
+            bitmaps = {}
+            for k, valor in enumerate(valores):
+                filas = np.zeros(self.n, dtype=bool)
+                filas[orden[cortes[k]:cortes[k + 1]]] = True
+                bitmaps[str(valor)] = np.packbits(filas)
+            self._bitmaps[campo] = bitmaps
+
+    def valores(self, campo: str) -> list:
+        return list(self._bitmaps.get(campo, {}))
+
+    def corresponde(self, df: pd.DataFrame) -> bool:
+        """True si el índice se construyó con las mismas filas (mismos ids en el mismo orden)."""
+        return len(df) == self.n and "id" in df.columns and np.array_equal(df["id"].astype(str).to_numpy(), self.ids)
+
+    def mascara(self, seleccion: dict) -> np.ndarray:
+        """Máscara booleana por fila; seleccion = {campo: valores} (None = no filtrar ese campo)."""
+        total = np.packbits(np.ones(self.n, dtype=bool))
+        for campo, valores in seleccion.items():
+            if valores is None:
+                continue
+            bitmaps = self._bitmaps.get(campo, {})
+            campo_bits = np.zeros_like(total)
+            for v in valores:
+                bits = bitmaps.get(v)
+                if bits is not None:
+                    campo_bits |= bits
+            total &= campo_bits
+        return np.unpackbits(total, count=self.n).astype(bool)
+
+def indice_filtros(df: pd.DataFrame | None = None) -> _IndiceFiltros:
+    """Índice memorizado: sin argumentos sobre la instantánea de la última carga; con `df`, por hash."""
+    cache = _data_cache()
+    base = snapshot_clientes() if df is None else df
+    clave = f"filtros:{_clave_datos(df)}"
+    indice = cache.get(clave)
+    if indice is None:
+        indice = _IndiceFiltros(base)
+        indice.clave = clave
+        cache.invalidate(f"filtros:{clave.split(':', 2)[1]}:")
+        cache.put(clave, indice)
+    return indice
+
+# Vistas filtradas: la mayoría de los reruns vienen de widgets ajenos a los filtros, así que
+# df_ver se memoriza por (versión de datos, selección de filtros) en un LRU pequeño.
+# Cada consulta entrega una copia superficial (sin copiar datos; con copy-on-write, escribir
+# en ella no altera la vista guardada).
+VISTAS_MAX = 8
+
+class _VistasFiltradas:
+    """LRU de resultados sobre clientes filtrados (vistas, exportaciones) con conteo de aciertos."""
+
+    def __init__(self, maximo: int = VISTAS_MAX):
+        self.maximo = maximo
+        self._lock = threading.Lock()
+        self._vistas = {}   # clave -> DataFrame (orden de inserción = uso más antiguo primero)
+        self.aciertos = 0
+        self.fallos = 0
+
+    @staticmethod
+    def clave(version, seleccion: dict) -> tuple:
+        """Clave hashable: versión + selección congelada por campo (None = sin filtro)."""
+        return (version,) + tuple((c, None if v is None else frozenset(v)) for c, v in sorted(seleccion.items()))
+
+    def obtener(self, clave: tuple, construir) -> pd.DataFrame:
+        """Vista guardada para `clave` o construir() si no existe (y se guarda)."""
+        with self._lock:
+            vista = self._vistas.pop(clave, None)
+            if vista is not None:
+                self._vistas[clave] = vista
+                self.aciertos += 1
+                return vista.copy(deep=False) if isinstance(vista, pd.DataFrame) else vista
+            self.fallos += 1
+        vista = construir()
+        with self._lock:
+            self._vistas[clave] = vista
+            while len(self._vistas) > self.maximo:
+                self._vistas.pop(next(iter(self._vistas)))
+        return vista.copy(deep=False) if isinstance(vista, pd.DataFrame) else vista
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "vistas": len(self._vistas),
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_acierto": round(self.aciertos / total * 100, 1) if total else 0.0,
+            }
+
+@st.cache_resource(show_spinner=False)
+def _vistas_filtradas() -> _VistasFiltradas:
+    """LRU único por proceso de vistas filtradas."""
+    return _VistasFiltradas()
+
+# === CUBO DE AGREGADOS DEL DASHBOARD ===
+# Un solo groupby sobre los clientes (estatus × sucursal × asesor × fuente × fecha de ingreso ×
+# mes de dispersión) con conteos y sumas de montos. Se memoriza por versión de los datos y
+# todas las vistas (KPIs, pestañas, análisis financiero, presentación) leen de él; el costo
+# de cada vista depende del tamaño del cubo, no del número de clientes.
+# La fecha de ingreso se guarda por día para que los filtros de período sigan siendo exactos;
+# el mes se deriva del cubo.
+CUBO_DIMENSIONES = ["estatus", "sucursal", "asesor", "fuente", "fecha", "mes_dispersion"]
+CUBO_MEDIDAS = ["clientes", "monto_propuesta", "monto_final", "monto_analisis", "con_monto"]
+
+def construir_cubo(snap: pd.DataFrame) -> pd.DataFrame:
+    """Agrega la instantánea tipada (construir_snapshot) por CUBO_DIMENSIONES con las medidas CUBO_MEDIDAS."""
+    if snap is None or snap.empty:
+        return pd.DataFrame(columns=CUBO_DIMENSIONES + CUBO_MEDIDAS)
+    estatus = snap["estatus"]
+    propuesta = snap["monto_propuesta"]
+    final = snap["monto_final"]
+    # Monto del modelo financiero: monto final si está dispersado, propuesta en otro caso
+    analisis = final.where(estatus == "DISPERSADO", propuesta)
+    dispersion = snap["fecha_dispersion"]
+    base = pd.DataFrame({
+        "estatus": estatus,
+        "sucursal": snap["sucursal"],
+        "asesor": snap["asesor"],
+        "fuente": snap["fuente"],
+        "fecha": snap["fecha_ingreso"].dt.normalize(),
+        "mes_dispersion": dispersion.dt.to_period("M").astype(str).where(dispersion.notna(), ""),
+        "clientes": 1,
+        "monto_propuesta": propuesta,
+        "monto_final": final,
+        "monto_analisis": analisis.where(analisis > 0, 0.0),
+        "con_monto": (analisis > 0).astype(int),
+    })
+    cubo = base.groupby(CUBO_DIMENSIONES, dropna=False, sort=False, observed=True).sum().reset_index()
+    # El cubo es pequeño: sus dimensiones vuelven a texto para no arrastrar categorías sin uso
+    for c in ["estatus", "sucursal", "asesor", "fuente"]:
+        cubo[c] = cubo[c].astype(str)
+    return cubo
+
+def cubo_clientes(df: pd.DataFrame | None = None) -> pd.DataFrame:
+    """Cubo memorizado junto a su instantánea (sólo se conserva el de la versión más reciente)."""
+    cache = _data_cache()
+    clave = _clave_datos(df)
+    cubo = cache.get(f"cubo:{clave}")
+    if cubo is None:
+        cubo = construir_cubo(snapshot_clientes(df))
+        cache.invalidate(f"cubo:{clave.split(':', 1)[0]}:")
+        cache.put(f"cubo:{clave}", cubo)
+    return cubo
+
+def cubo_conteo(cubo: pd.DataFrame, dim, etiquetas: pd.Series | None = None) -> pd.Series:
+    """Equivalente a value_counts() de una dimensión (o de etiquetas derivadas) leído del cubo."""
+    claves = etiquetas if etiquetas is not None else cubo[dim]
+    conteo = cubo["clientes"].groupby(claves.to_numpy()).sum()
+    conteo = conteo[conteo > 0].sort_values(ascending=False, kind="stable")
+    conteo.index.name = dim
+    return conteo.rename("count")
+
+def cubo_por(cubo: pd.DataFrame, dim) -> pd.DataFrame:
+    """Suma de todas las medidas por una o varias dimensiones."""
+    return cubo.groupby(dim, sort=True)[CUBO_MEDIDAS].sum()
+
+# Modelo financiero por estatus: probabilidad de conversión, factor de retorno y riesgo (%)
+MODELO_PROB_CONVERSION = {
+    "DISPERSADO": 1.00,
+    "APROB. CON PROPUESTA": 0.75,
+    "PROPUESTA": 0.75,  # Alias para propuesta
+    "PEND. ACEPT. CLIENTE": 0.65,
+    "PENDIENTE CLIENTE": 0.65,  # Alias
+    "PEND. DOC. PARA EVALUACION": 0.45,
+    "PENDIENTE DOC": 0.45,  # Alias
+    "EN ONBOARDING": 0.55,
+    "RECH. CLIENTE CANCELA": 0.10,
+    "RECH. SOBREENDEUDAMIENTO": 0.05,
+}
+MODELO_FACTOR_RETORNO = {
+    "DISPERSADO": 1.00,
+    "APROB. CON PROPUESTA": 0.85,
+    "PROPUESTA": 0.85,
+    "PEND. ACEPT. CLIENTE": 0.80,
+    "PENDIENTE CLIENTE": 0.80,
+    "PEND. DOC. PARA EVALUACION": 0.70,
+    "PENDIENTE DOC": 0.70,
+    "EN ONBOARDING": 0.75,
+    "RECH. CLIENTE CANCELA": 0.00,
+    "RECH. SOBREENDEUDAMIENTO": 0.00,
+}
+MODELO_RIESGO_PCT = {
+    "DISPERSADO": 5,
+    "APROB. CON PROPUESTA": 20,
+    "PROPUESTA": 20,
+    "PEND. ACEPT. CLIENTE": 30,
+    "PENDIENTE CLIENTE": 30,
+    "PEND. DOC. PARA EVALUACION": 45,
+    "PENDIENTE DOC": 45,
+    "EN ONBOARDING": 40,
+    "RECH. CLIENTE CANCELA": 90,
+    "RECH. SOBREENDEUDAMIENTO": 95,
+}
+
+# Escenarios: multiplicadores sobre las tablas anteriores (DISPERSADO no cambia: ya es un hecho).
+# Se puede pasar el nombre o un dict propio con las mismas llaves; "prob", "factor" y "riesgo_pct"
+# (opcionales) reemplazan valores de las tablas por estatus.
+ESCENARIOS_FINANCIEROS = {
+    "base":        {"conversion": 1.00, "retorno": 1.00, "riesgo": 1.00},
+    "conservador": {"conversion": 0.80, "retorno": 0.90, "riesgo": 1.20},
+    "optimista":   {"conversion": 1.15, "retorno": 1.05, "riesgo": 0.85},
+}
+
+def escenario_financiero(escenario="base") -> dict:
+    """Parámetros completos de un escenario (nombre de ESCENARIOS_FINANCIEROS o dict)."""
+    params = dict(ESCENARIOS_FINANCIEROS.get(escenario, ESCENARIOS_FINANCIEROS["base"])
+                  if isinstance(escenario, str) else escenario or {})
+    for k, v in ESCENARIOS_FINANCIEROS["base"].items():
+        params.setdefault(k, v)
+    params["prob"] = {**MODELO_PROB_CONVERSION, **(params.get("prob") or {})}
+    params["factor"] = {**MODELO_FACTOR_RETORNO, **(params.get("factor") or {})}
+    params["riesgo_pct"] = {**MODELO_RIESGO_PCT, **(params.get("riesgo_pct") or {})}
+    return params
+
+def tabla_modelo_financiero(estatus, escenario="base") -> pd.DataFrame:
+    """
+    prob / factor / riesgo por estatus (índice = estatus) bajo un escenario.
+    Estatus fuera de las tablas: los de rechazo (REC*) con conversión 0.05, retorno 0 y riesgo 95;
+    el resto con valores neutros (0.5, 0.5, 50).
+    """
+    params = escenario_financiero(escenario)
+    est = pd.Series(pd.Index(estatus).astype(str))
+    rechazo = est.str.startswith("REC").to_numpy()
+    fijo = (est == "DISPERSADO").to_numpy()
+    prob = est.map(params["prob"]).to_numpy(dtype=float)
+    factor = est.map(params["factor"]).to_numpy(dtype=float)
+    riesgo = est.map(params["riesgo_pct"]).to_numpy(dtype=float)
+    prob = np.where(np.isnan(prob), np.where(rechazo, 0.05, 0.5), prob)
+    factor = np.where(np.isnan(factor), np.where(rechazo, 0.0, 0.5), factor)
+    riesgo = np.where(np.isnan(riesgo), np.where(rechazo, 95.0, 50.0), riesgo)
+    return pd.DataFrame({
+        "prob": np.where(fijo, prob, np.clip(prob * params["conversion"], 0.0, 1.0)),
+        "factor": np.where(fijo, factor, np.clip(factor * params["retorno"], 0.0, 1.0)),
+        "riesgo": np.where(fijo, riesgo, np.clip(riesgo * params["riesgo"], 0.0, 100.0)),
+    }, index=pd.Index(est.to_numpy(), name="estatus"))
+
+def proyeccion_financiera(snap: pd.DataFrame, escenario="base") -> pd.DataFrame:
+    """
+    Modelo por cliente sobre la instantánea tipada: los parámetros se buscan con los códigos
+    de la categoría 'estatus' (una tabla por categoría, no por fila).
+    Columnas: id, estatus, sucursal, asesor, monto, con_monto, prob, factor, riesgo,
+    monto_esperado, retorno_esperado (los clientes sin monto quedan con monto 0).
+    """
+    estatus = snap["estatus"]
+    if not isinstance(estatus.dtype, pd.CategoricalDtype):
+        estatus = estatus.fillna("").astype(str).astype("category")
+    tabla = tabla_modelo_financiero(estatus.cat.categories, escenario)
+    codigos = estatus.cat.codes.to_numpy()
+    dispersado = (estatus == "DISPERSADO").to_numpy()
+    monto = np.where(dispersado, snap["monto_final"].to_numpy(dtype=float), snap["monto_propuesta"].to_numpy(dtype=float))
+    con_monto = monto > 0
+    monto = np.where(con_monto, monto, 0.0)
+    prob = tabla["prob"].to_numpy()[codigos]
+    factor = tabla["factor"].to_numpy()[codigos]
+    return pd.DataFrame({
+        "id": snap["id"],
+        "estatus": estatus,
+        "sucursal": snap["sucursal"],
+        "asesor": snap["asesor"],
+        "monto": monto,
+        "con_monto": con_monto,
+        "prob": prob,
+        "factor": factor,
+        "riesgo": tabla["riesgo"].to_numpy()[codigos],
+        "monto_esperado": monto * prob,
+        "retorno_esperado": monto * factor,
+    }, index=snap.index)
+
+def resumen_financiero_por_estatus(cubo: pd.DataFrame, escenario="base") -> pd.DataFrame:
+    """
+    Modelo financiero por estatus leído del cubo (sólo clientes con monto > 0).
+    Columnas: clientes, monto, prob, factor, riesgo, monto_esperado, retorno_esperado.
+    """
+    por = cubo_por(cubo[cubo["con_monto"] > 0], "estatus")
+    tabla = tabla_modelo_financiero(por.index, escenario)
+    resumen = pd.DataFrame({
+        "clientes": por["con_monto"],
+        "monto": por["monto_analisis"],
+        "prob": tabla["prob"].to_numpy(),
+        "factor": tabla["factor"].to_numpy(),
+        "riesgo": tabla["riesgo"].to_numpy(),
+    }, index=por.index)
+    resumen["monto_esperado"] = resumen["monto"] * resumen["prob"]
+    resumen["retorno_esperado"] = resumen["monto"] * resumen["factor"]
+    return resumen
+
+def totales_financieros(resumen: pd.DataFrame) -> dict | None:
+    """Métricas globales del modelo (promedios ponderados por clientes). None si no hay montos."""
+    n = resumen["clientes"].sum() if not resumen.empty else 0
+    if n == 0:
+        return None
+    return {
+        "total_cartera": float(resumen["monto"].sum()),
+        "total_monto_esperado": float(resumen["monto_esperado"].sum()),
+        "total_retorno": float(resumen["retorno_esperado"].sum()),
+        "prom_riesgo": float((resumen["clientes"] * resumen["riesgo"]).sum() / n),
+        "prom_conversion": float((resumen["clientes"] * resumen["prob"]).sum() / n * 100),
+    }
+
+# === SIMULACIÓN MONTE CARLO DE LA CARTERA ===
+# Cada simulación decide, cliente por cliente, si el crédito se dispersa (probabilidad del
+# modelo financiero); el volumen dispersado es la suma de montos de los que convierten.
+# Las simulaciones se sortean por bloques (simulaciones × clientes en un solo arreglo) y
+# se suman por grupo con np.add.reduceat sobre tramos contiguos de clientes ordenados por grupo.
+# Los clientes ya dispersados (prob. 1) son un monto fijo.
+MC_SIMULACIONES = 10_000
+MC_SEMILLA = 20240101
+MC_BLOQUE = 262_144     # elementos por bloque (simulaciones × clientes con incertidumbre; ~1 MB en float32)
+
+def simular_cartera(proy: pd.DataFrame, simulaciones: int = MC_SIMULACIONES, semilla: int = MC_SEMILLA,
+                    dimensiones=("sucursal", "asesor")) -> dict:
+    """
+    Percentiles del volumen dispersado a partir de proyeccion_financiera.
+    Retorna {"total": {p10, p50, p90, esperado}, <dimension>: DataFrame(p10, p50, p90, esperado)}.
+    Misma semilla y mismos datos -> mismo resultado.
+    """
+    base = proy[proy["con_monto"]] if not proy.empty else proy
+    monto = base["monto"].to_numpy(dtype=float)
+    prob = np.clip(base["prob"].to_numpy(dtype=float), 0.0, 1.0)
+    seguro = prob >= 1.0
+    azar = ~seguro & (prob > 0)
+
+    grupos, fijos, esperados, codigos_azar = {}, [monto[seguro].sum()], [(monto * prob).sum()], []
+    inicio = 1
+    for dim in dimensiones:
+        codigos, nombres = pd.factorize(base[dim].astype(str), sort=True)
+        g = len(nombres)
+        fijos.extend(np.bincount(codigos[seguro], weights=monto[seguro], minlength=g))
+        esperados.extend(np.bincount(codigos, weights=monto * prob, minlength=g))
+        grupos[dim] = (nombres, slice(inicio, inicio + g))
+        codigos_azar.append(codigos[azar])
+        inicio += g
+    sim = np.zeros((simulaciones, inicio))
+
+    # Sin matriz one-hot (el costo no crece con clientes × grupos): por cada dimensión los
+    # clientes inciertos se ordenan por grupo y cada bloque se suma por tramos contiguos con
+    # np.add.reduceat. Los arreglos ya vienen ordenados por la primera dimensión.
+    n_azar = int(azar.sum())
+    if n_azar:
+        orden = np.argsort(codigos_azar[0], kind="stable") if codigos_azar else np.arange(n_azar)
+        p_azar = prob[azar][orden].astype(np.float32)
+        m_azar = monto[azar][orden].astype(np.float32)
+        por_dim = []   # (posiciones ordenadas por grupo o None, inicio de cada tramo, columnas destino)
+        for j, (nombres, cols) in enumerate(grupos.values()):
+            codigos = codigos_azar[j][orden]
+            posiciones = None if j == 0 else np.argsort(codigos, kind="stable")
+            presentes, tramos = np.unique(codigos if posiciones is None else codigos[posiciones], return_index=True)
+            por_dim.append((posiciones, tramos, cols.start + presentes))
+
+        rng = np.random.default_rng(semilla)
+        bloque = max(1, MC_BLOQUE // n_azar)
+        # Búferes reutilizados entre bloques (sin reservar memoria por bloque)
+        valores = np.empty((bloque, n_azar), dtype=np.float32)
+        reordenados = np.empty_like(valores) if len(por_dim) > 1 else None
+        for ini in range(0, simulaciones, bloque):
+            n = min(bloque, simulaciones - ini)
+            v = valores[:n]
+            rng.random(dtype=np.float32, out=v)
+            np.multiply(v < p_azar, m_azar, out=v)
+            for posiciones, tramos, destino in por_dim:
+                tabla = v if posiciones is None else np.take(v, posiciones, axis=1, out=reordenados[:n])
+                sim[ini:ini + n, destino] = np.add.reduceat(tabla, tramos, axis=1, dtype=np.float64)
+            # El total es la suma de los grupos de la primera dimensión (ya calculados)
+            if por_dim:
+                sim[ini:ini + n, 0] = sim[ini:ini + n, por_dim[0][2]].sum(axis=1)
+            else:
+                sim[ini:ini + n, 0] = v.sum(axis=1, dtype=np.float64)
+    sim += np.asarray(fijos)
+
+    pct = np.percentile(sim, [10, 50, 90], axis=0) if simulaciones else np.zeros((3, sim.shape[1]))
+    esperados = np.asarray(esperados)
+    resultado = {"total": {"p10": float(pct[0, 0]), "p50": float(pct[1, 0]), "p90": float(pct[2, 0]),
+                           "esperado": float(esperados[0])}}
+    for dim, (nombres, cols) in grupos.items():
+        resultado[dim] = pd.DataFrame({
+            "p10": pct[0, cols], "p50": pct[1, cols], "p90": pct[2, cols], "esperado": esperados[cols],
+        }, index=pd.Index(nombres, name=dim)).sort_values("esperado", ascending=False)
+    return resultado
+
+def simulacion_cartera(escenario: str = "base", simulaciones: int = MC_SIMULACIONES, semilla: int = MC_SEMILLA) -> dict:
+    """simular_cartera sobre los clientes en caché, memorizada por versión de datos y parámetros."""
+    cache = _data_cache()
+    snap = snapshot_clientes()
+    clave = f"montecarlo:{_clave_datos(None)}:{escenario}:{simulaciones}:{semilla}"
+    resultado = cache.get(clave)
+    if resultado is None:
+        resultado = simular_cartera(proyeccion_financiera(snap, escenario), simulaciones, semilla)
+        cache.invalidate("montecarlo:")
+        cache.put(clave, resultado)
+    return resultado
+
+def datos_presentacion(df_cli: pd.DataFrame) -> dict:
+    """Agregados que alimentan la presentación (datos puros leídos del cubo, sin gráficas)."""
+    cubo = cubo_clientes(df_cli)
+    total_clientes = int(cubo["clientes"].sum())
+    estatus_counts = cubo_conteo(cubo, "estatus")
+    
+    dispersados = int(estatus_counts.get("DISPERSADO", 0))
+    rechazados = int(sum([
+        count for estatus, count in estatus_counts.items() 
+        if estatus and (estatus.startswith("RECH") or estatus.startswith("REC"))
+    ]))
+    en_proceso = total_clientes - dispersados - rechazados
+    
+    # Top estatus por monto propuesto
+    por_estatus = cubo_por(cubo, "estatus")["monto_propuesta"]
+    por_estatus = por_estatus[por_estatus > 0]
+    top_estatus = por_estatus.sort_values(ascending=False).head(5) if not por_estatus.empty else None
+    
+    # Evolución mensual: altas por fecha de ingreso y dispersiones por mes de dispersión
+    ingreso = cubo["clientes"].groupby(cubo["fecha"].dt.to_period("M").astype(str).to_numpy()).sum()
+    ingreso = ingreso[ingreso.index != "NaT"]
+    disp = cubo[(cubo["estatus"] == "DISPERSADO") & (cubo["mes_dispersion"] != "")]
+    dispersion = disp["clientes"].groupby(disp["mes_dispersion"].to_numpy()).sum()
+    mensual = pd.concat([ingreso.rename("ingresos"), dispersion.rename("dispersados")], axis=1).fillna(0).sort_index().tail(12)
+    
+    return {
+        "total_clientes": total_clientes,
+        "dispersados": dispersados,
+        "en_proceso": en_proceso,
+        "rechazados": rechazados,
+        "tasa_exito": (dispersados / total_clientes * 100) if total_clientes > 0 else 0,
+        "tasa_proceso": (en_proceso / total_clientes * 100) if total_clientes > 0 else 0,
+        "tasa_rechazo": (rechazados / total_clientes * 100) if total_clientes > 0 else 0,
+        "total_presupuesto": float(cubo["monto_propuesta"].sum()),
+        "top_estatus_monto": top_estatus,
+        "financiero": totales_financieros(resumen_financiero_por_estatus(cubo)),
+        "estatus_counts": estatus_counts,
+        "sucursal_counts": cubo_conteo(cubo, "sucursal"),
+        "asesor_counts": cubo_conteo(cubo, "asesor"),
+        "mensual": mensual,
+    }
+
+def graficas_presentacion(datos: dict) -> dict:
+    """Specs (datos puros) de cada gráfica de la presentación; ver reporte_graficas.render_png."""
+    specs = {
+        "kpis": {
+            "tipo": "pie", "figsize": [4, 3],
+            "categorias": ['Dispersados', 'En Proceso', 'Rechazados'],
+            "series": [{"valores": [datos["dispersados"], datos["en_proceso"], datos["rechazados"]]}],
+            "colores": ['#28a745', '#ffc107', '#dc3545'],
+        },
+    }
+    top = datos["top_estatus_monto"]
+    if top is not None:
+        montos = [float(m) for m in top.values]
+        specs["top_estatus_monto"] = {
+            "tipo": "barh", "figsize": [8, 4], "titulo": 'Top 5 Estatus por Monto', "xlabel": 'Monto ($)',
+            "categorias": [str(e)[:30] for e in top.index],
+            "series": [{"nombre": "Monto", "valores": montos, "color": '#28a745'}],
+            "anotaciones": [formatear_monto(m) for m in montos],
+        }
+    fin = datos["financiero"]
+    if fin is not None:
+        valores = [fin["total_cartera"], fin["total_monto_esperado"], fin["total_retorno"]]
+        specs["financiero"] = {
+            "tipo": "bar", "figsize": [8, 2.5], "titulo": 'Análisis Financiero de Cartera', "ylabel": 'Monto ($)',
+            "categorias": ['Cartera\nTotal', 'Conversión\nEsperada', 'Retorno\nEsperado'],
+            "series": [{"nombre": "Monto", "valores": valores}],
+            "colores": ['#007bff', '#28a745', '#ffc107'], "alpha": 0.7, "edgecolor": 'black',
+            "anotaciones": [formatear_monto(v) for v in valores],
+        }
+    for clave, serie, titulo, limite, largo, color in (
+        ("estatus", datos["estatus_counts"], 'Top 10 Estatus (por cantidad)', 10, 25, '#17a2b8'),
+        ("sucursales", datos["sucursal_counts"], 'Clientes por Sucursal', None, 30, '#6f42c1'),
+        ("asesores", datos["asesor_counts"], 'Top 10 Asesores (por cantidad de clientes)', 10, 30, '#fd7e14'),
+    ):
+        serie = serie.head(limite) if limite else serie
+        cantidades = [int(c) for c in serie.values]
+        specs[clave] = {
+            "tipo": "barh", "figsize": [8, 5], "titulo": titulo, "xlabel": 'Cantidad de Clientes', "invertir_y": True,
+            "categorias": [str(e)[:largo] for e in serie.index],
+            "series": [{"nombre": "Clientes", "valores": cantidades, "color": color}],
+            "anotaciones": [str(c) for c in cantidades],
+        }
+    mensual = datos["mensual"]
+    if not mensual.empty:
+        specs["mensual"] = {
+            "tipo": "line", "figsize": [8, 4.5], "titulo": 'Evolución Mensual', "ylabel": 'Clientes',
+            "categorias": [str(p) for p in mensual.index],
+            "series": [
+                {"nombre": "Ingresos", "valores": [int(v) for v in mensual["ingresos"]], "color": '#007bff'},
+                {"nombre": "Dispersados", "valores": [int(v) for v in mensual["dispersados"]], "color": '#28a745'},
+            ],
+        }
+    return specs
+
+# --- Render de gráficas en paralelo (procesos con backend Agg) ---
+# Cada spec se renderiza en un ProcessPoolExecutor; el PNG se guarda por hash del spec,
+# así que una gráfica cuyos agregados no cambiaron no se vuelve a dibujar.
+GRAFICAS_CACHE_MAX = 64
+GRAFICAS_PROCESOS = max(1, min(4, os.cpu_count() or 1))
+
+@st.cache_resource(show_spinner=False)
+def _graficas_pool():
+    """Pool de procesos para matplotlib (spawn: no hereda hilos ni estado de Streamlit)."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=GRAFICAS_PROCESOS, mp_context=multiprocessing.get_context("spawn"))
+
+@st.cache_resource(show_spinner=False)
+def _graficas_cache() -> dict:
+    """PNG por hash de spec (orden de inserción = antigüedad) y su lock."""
+    return {"png": {}, "lock": threading.Lock()}
+
+def _hash_spec(spec: dict) -> str:
+    return hashlib.sha1(json.dumps(spec, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+def renderizar_graficas(specs: dict) -> dict:
+    """PNG por nombre de gráfica. Sólo se dibujan las que no están en caché, en paralelo."""
+    from reporte_graficas import render_png
+    memo = _graficas_cache()
+    claves = {nombre: _hash_spec(spec) for nombre, spec in specs.items()}
+    with memo["lock"]:
+        faltan = {h: specs[n] for n, h in claves.items() if h not in memo["png"]}
+    if faltan:
+        try:
+            pool = _graficas_pool()
+            futuros = {h: pool.submit(render_png, spec) for h, spec in faltan.items()}
+            nuevos = {h: f.result() for h, f in futuros.items()}
+        except Exception:
+            # Sin procesos disponibles (p. ej. entorno restringido): render en este proceso
+            nuevos = {h: render_png(spec) for h, spec in faltan.items()}
+        with memo["lock"]:
+            memo["png"].update(nuevos)
+            while len(memo["png"]) > GRAFICAS_CACHE_MAX:
+                del memo["png"][next(iter(memo["png"]))]
+    with memo["lock"]:
+        return {n: memo["png"][h] for n, h in claves.items() if h in memo["png"]}
+
+def _agregar_grafica_nativa(slide, spec: dict, x: float, y: float, ancho: float):
+    """Inserta un spec como gráfica nativa de PowerPoint (editable, sin imagen)."""
+    from pptx.chart.data import CategoryChartData
+    from pptx.enum.chart import XL_CHART_TYPE, XL_LEGEND_POSITION, XL_LABEL_POSITION
+    from pptx.dml.color import RGBColor
+    from pptx.util import Inches, Pt
+    
+    def _rgb(color_hex):
+        return RGBColor.from_string(str(color_hex).lstrip("#").upper())
+    
+    tipo = spec.get("tipo", "bar")
+    tipos = {
+        "pie": XL_CHART_TYPE.DOUGHNUT,
+        "barh": XL_CHART_TYPE.BAR_CLUSTERED,
+        "bar": XL_CHART_TYPE.COLUMN_CLUSTERED,
+        "line": XL_CHART_TYPE.LINE_MARKERS,
+    }
+    datos_grafica = CategoryChartData()
+    datos_grafica.categories = [str(c).replace("\n", " ") for c in spec.get("categorias", [])]
+    for serie in spec.get("series", []):
+        datos_grafica.add_series(serie.get("nombre") or "Valor", [float(v) for v in serie["valores"]])
+    
+    w, h = spec.get("figsize", (8, 5))
+    grafico = slide.shapes.add_chart(
+        tipos.get(tipo, XL_CHART_TYPE.COLUMN_CLUSTERED), Inches(x), Inches(y), Inches(ancho), Inches(ancho * h / w), datos_grafica
+    ).chart
+    grafico.font.size = Pt(10)
+    if spec.get("titulo"):
+        grafico.has_title = True
+        grafico.chart_title.text_frame.text = spec["titulo"]
+        grafico.chart_title.text_frame.paragraphs[0].font.size = Pt(13)
+        grafico.chart_title.text_frame.paragraphs[0].font.bold = True
+    else:
+        grafico.has_title = False
+    
+    plot = grafico.plots[0]
+    colores = spec.get("colores")
+    if tipo == "pie":
+        grafico.has_legend = True
+        grafico.legend.position = XL_LEGEND_POSITION.RIGHT
+        grafico.legend.include_in_layout = False
+        plot.has_data_labels = True
+        plot.data_labels.show_percentage = True
+        plot.data_labels.show_value = False
+        plot.data_labels.number_format = "0.0%"
+        plot.data_labels.number_format_is_linked = False
+    else:
+        grafico.has_legend = len(spec.get("series", [])) > 1
+        if grafico.has_legend:
+            grafico.legend.position = XL_LEGEND_POSITION.BOTTOM
+            grafico.legend.include_in_layout = False
+        if tipo in ("bar", "barh"):
+            plot.has_data_labels = True
+            plot.data_labels.show_value = True
+            plot.data_labels.number_format = '"$"#,##0' if "Monto" in str(spec.get("xlabel", "")) + str(spec.get("ylabel", "")) else "#,##0"
+            plot.data_labels.number_format_is_linked = False
+            plot.data_labels.position = XL_LABEL_POSITION.OUTSIDE_END
+            plot.gap_width = 60
+        if spec.get("invertir_y"):
+            grafico.category_axis.reverse_order = True
+    
+    for i, serie in enumerate(plot.series):
+        color = (spec.get("series") or [{}])[i].get("color")
+        if colores and tipo in ("pie", "bar"):
+            for j, c in enumerate(colores):
+                punto = serie.points[j]
+                punto.format.fill.solid()
+                punto.format.fill.fore_color.rgb = _rgb(c)
+        elif color and tipo == "line":
+            serie.format.line.color.rgb = _rgb(color)
+            serie.marker.format.fill.solid()
+            serie.marker.format.fill.fore_color.rgb = _rgb(color)
+        elif color:
+            serie.format.fill.solid()
+            serie.format.fill.fore_color.rgb = _rgb(color)
+
+def generar_presentacion_dashboard(df_cli: pd.DataFrame, graficas_nativas: bool = False) -> bytes:
+    """
+    Genera una presentación PowerPoint completa del dashboard con gráficas.
+    graficas_nativas: True para gráficas nativas de PowerPoint (editables, sin matplotlib);
+    False para imágenes PNG renderizadas con matplotlib.
+    """
     from pptx import Presentation
     from pptx.util import Inches, Pt
     from pptx.enum.text import PP_ALIGN
     from pptx.dml.color import RGBColor
     from io import BytesIO
-    import matplotlib.pyplot as plt
-    import matplotlib
-    matplotlib.use('Agg')  # Backend sin GUI
+    
+    # Agregados y gráficas (renderizadas en paralelo antes de armar las diapositivas)
+    datos = datos_presentacion(df_cli)
+    specs = graficas_presentacion(datos)
+    imagenes = {} if graficas_nativas else renderizar_graficas(specs)
+    
+    def agregar_grafica(slide, nombre, x, y, ancho):
+        if graficas_nativas:
+            if nombre in specs:
+                _agregar_grafica_nativa(slide, specs[nombre], x, y, ancho)
+        elif nombre in imagenes:
+            slide.shapes.add_picture(BytesIO(imagenes[nombre]), Inches(x), Inches(y), width=Inches(ancho))
+    
+    def agregar_titulo(slide, texto):
+        title_box = slide.shapes.add_textbox(Inches(0.5), Inches(0.3), Inches(9), Inches(0.6))
+        title_frame = title_box.text_frame
+        title_frame.text = texto
+        title_p = title_frame.paragraphs[0]
+        title_p.font.size = Pt(32)
+        title_p.font.bold = True
+        title_p.font.color.rgb = RGBColor(33, 37, 41)
     
     # Crear presentación
     prs = Presentation()
     prs.slide_width = Inches(10)
     prs.slide_height = Inches(7.5)
     
-    # Calcular todas las métricas necesarias
-    total_clientes = len(df_cli)
-    estatus_counts = df_cli["estatus"].fillna("").value_counts()
-    
-    dispersados = estatus_counts.get("DISPERSADO", 0)
-    rechazados = sum([
-        count for estatus, count in estatus_counts.items() 
-        if estatus and (estatus.startswith("RECH") or estatus.startswith("REC"))
-    ])
-    en_proceso = total_clientes - dispersados - rechazados
-    
-    tasa_exito = (dispersados / total_clientes * 100) if total_clientes > 0 else 0
-    tasa_proceso = (en_proceso / total_clientes * 100) if total_clientes > 0 else 0
-    tasa_rechazo = (rechazados / total_clientes * 100) if total_clientes > 0 else 0
-    
-    # Análisis financiero
-    analisis_financiero = calcular_analisis_financiero(df_cli)
-    total_presupuesto = analisis_financiero['total_propuesto']
-    
     # === SLIDE 1: PORTADA ===
     slide = prs.slides.add_slide(prs.slide_layouts[6])  # Layout en blanco
     
@@ -759,7 +1463,6 @@ def generar_presentacion_dashboard(df_cli: pd.DataFrame) -> bytes:
     # Subtítulo con fecha
     subtitle_box = slide.shapes.add_textbox(Inches(1), Inches(4.5), Inches(8), Inches(0.8))
     subtitle_frame = subtitle_box.text_frame
-    from datetime import datetime
     subtitle_frame.text = f"Reporte Ejecutivo - {datetime.now().strftime('%d/%m/%Y')}"
     subtitle_p = subtitle_frame.paragraphs[0]
     subtitle_p.font.size = Pt(24)
@@ -768,22 +1471,14 @@ def generar_presentacion_dashboard(df_cli: pd.DataFrame) -> bytes:
     
     # === SLIDE 2: KPIs PRINCIPALES ===
     slide = prs.slides.add_slide(prs.slide_layouts[6])
-    
-    # Título
-    title_box = slide.shapes.add_textbox(Inches(0.5), Inches(0.3), Inches(9), Inches(0.6))
-    title_frame = title_box.text_frame
-    title_frame.text = "📊 KPIs Principales"
-    title_p = title_frame.paragraphs[0]
-    title_p.font.size = Pt(32)
-    title_p.font.bold = True
-    title_p.font.color.rgb = RGBColor(33, 37, 41)
+    agregar_titulo(slide, "📊 KPIs Principales")
     
     # KPIs en cuadros
     kpis = [
-        ("Total de Clientes", total_clientes, "👥", ""),
-        ("Dispersados (Éxito)", dispersados, "✅", f"{tasa_exito:.1f}%"),
-        ("En Proceso", en_proceso, "⏳", f"{tasa_proceso:.1f}%"),
-        ("Rechazados", rechazados, "❌", f"{tasa_rechazo:.1f}%")
+        ("Total de Clientes", datos["total_clientes"], "👥", ""),
+        ("Dispersados (Éxito)", datos["dispersados"], "✅", f"{datos['tasa_exito']:.1f}%"),
+        ("En Proceso", datos["en_proceso"], "⏳", f"{datos['tasa_proceso']:.1f}%"),
+        ("Rechazados", datos["rechazados"], "❌", f"{datos['tasa_rechazo']:.1f}%")
     ]
     
     x_start = 0.5
@@ -840,147 +1535,28 @@ def generar_presentacion_dashboard(df_cli: pd.DataFrame) -> bytes:
             delta_p.alignment = PP_ALIGN.CENTER
     
     # Gráfica de distribución de estatus (pie chart)
-    fig, ax = plt.subplots(figsize=(4, 3))
-    sizes = [dispersados, en_proceso, rechazados]
-    labels = ['Dispersados', 'En Proceso', 'Rechazados']
-    colors = ['#28a745', '#ffc107', '#dc3545']
-    
-    if sum(sizes) > 0:
-        ax.pie(sizes, labels=labels, autopct='%1.1f%%', colors=colors, startangle=90)
-        ax.axis('equal')
-    
-    # Guardar gráfica en BytesIO
-    img_stream = BytesIO()
-    plt.tight_layout()
-    plt.savefig(img_stream, format='png', dpi=150, bbox_inches='tight')
-    plt.close()
-    img_stream.seek(0)
-    
-    # Agregar gráfica al slide
-    slide.shapes.add_picture(img_stream, Inches(3), Inches(3.8), width=Inches(4))
+    agregar_grafica(slide, "kpis", 3, 3.8, 4)
     
     # === SLIDE 3: TOP ESTATUS POR MONTO ===
     slide = prs.slides.add_slide(prs.slide_layouts[6])
-    
-    # Título
-    title_box = slide.shapes.add_textbox(Inches(0.5), Inches(0.3), Inches(9), Inches(0.6))
-    title_frame = title_box.text_frame
-    title_frame.text = "💹 Top Estatus por Monto"
-    title_p = title_frame.paragraphs[0]
-    title_p.font.size = Pt(32)
-    title_p.font.bold = True
-    title_p.font.color.rgb = RGBColor(33, 37, 41)
+    agregar_titulo(slide, "💹 Top Estatus por Monto")
     
     # Total presupuesto
     presupuesto_box = slide.shapes.add_textbox(Inches(0.5), Inches(1), Inches(9), Inches(0.4))
     presupuesto_frame = presupuesto_box.text_frame
-    presupuesto_frame.text = f"Total Presupuesto General: {formatear_monto(total_presupuesto)}"
+    presupuesto_frame.text = f"Total Presupuesto General: {formatear_monto(datos['total_presupuesto'])}"
     presupuesto_p = presupuesto_frame.paragraphs[0]
     presupuesto_p.font.size = Pt(18)
     presupuesto_p.font.bold = True
     presupuesto_p.font.color.rgb = RGBColor(33, 37, 41)
     
-    # Top estatus
-    if not analisis_financiero['montos_por_estatus'].empty:
-        estatus_con_monto = analisis_financiero['montos_por_estatus'][
-            analisis_financiero['montos_por_estatus'][('monto_propuesta_num', 'sum')] > 0
-        ]
-        top_estatus = estatus_con_monto.sort_values(
-            ('monto_propuesta_num', 'sum'), ascending=False
-        ).head(5)
-        
-        # Crear gráfica de barras
-        fig, ax = plt.subplots(figsize=(8, 4))
-        estatus_nombres = [str(e)[:30] for e in top_estatus.index]  # Limitar longitud
-        montos = [top_estatus.loc[e, ('monto_propuesta_num', 'sum')] for e in top_estatus.index]
-        
-        bars = ax.barh(estatus_nombres, montos, color='#28a745')
-        ax.set_xlabel('Monto ($)', fontsize=11)
-        ax.set_title('Top 5 Estatus por Monto', fontsize=13, fontweight='bold')
-        
-        # Agregar valores en las barras
-        for i, (bar, monto) in enumerate(zip(bars, montos)):
-            ax.text(bar.get_width(), bar.get_y() + bar.get_height()/2, 
-                   f' {formatear_monto(monto)}', 
-                   va='center', fontsize=10, fontweight='bold')
-        
-        plt.tight_layout()
-        
-        # Guardar gráfica
-        img_stream = BytesIO()
-        plt.savefig(img_stream, format='png', dpi=150, bbox_inches='tight')
-        plt.close()
-        img_stream.seek(0)
-        
-        # Agregar al slide
-        slide.shapes.add_picture(img_stream, Inches(0.8), Inches(1.8), width=Inches(8.4))
+    agregar_grafica(slide, "top_estatus_monto", 0.8, 1.8, 8.4)
     
     # === SLIDE 4: ANÁLISIS FINANCIERO ===
-    df_temp = df_cli.copy()
-    
-    def limpiar_monto_simple(monto_str):
-        if pd.isna(monto_str) or str(monto_str).strip() == "":
-            return 0.0
-        try:
-            import re
-            clean = re.sub(r'[,$\s]', '', str(monto_str))
-            return float(clean)
-        except:
-            return 0.0
-    
-    df_temp['monto_analisis'] = df_temp.apply(
-        lambda row: limpiar_monto_simple(row['monto_final']) if row['estatus'] == 'DISPERSADO' 
-        else limpiar_monto_simple(row['monto_propuesta']), axis=1
-    )
-    df_analisis = df_temp[df_temp['monto_analisis'] > 0].copy()
-    
-    if not df_analisis.empty:
-        # Modelo financiero
-        prob_conversion = {
-            "DISPERSADO": 1.00, "APROB. CON PROPUESTA": 0.75, "PROPUESTA": 0.75,
-            "PEND. ACEPT. CLIENTE": 0.65, "PENDIENTE CLIENTE": 0.65,
-            "PEND. DOC. PARA EVALUACION": 0.45, "PENDIENTE DOC": 0.45,
-            "EN ONBOARDING": 0.55, "RECH. CLIENTE CANCELA": 0.10,
-            "RECH. SOBREENDEUDAMIENTO": 0.05,
-        }
-        factor_retorno = {
-            "DISPERSADO": 1.00, "APROB. CON PROPUESTA": 0.85, "PROPUESTA": 0.85,
-            "PEND. ACEPT. CLIENTE": 0.80, "PENDIENTE CLIENTE": 0.80,
-            "PEND. DOC. PARA EVALUACION": 0.70, "PENDIENTE DOC": 0.70,
-            "EN ONBOARDING": 0.75, "RECH. CLIENTE CANCELA": 0.00,
-            "RECH. SOBREENDEUDAMIENTO": 0.00,
-        }
-        riesgo_pct = {
-            "DISPERSADO": 5, "APROB. CON PROPUESTA": 20, "PROPUESTA": 20,
-            "PEND. ACEPT. CLIENTE": 30, "PENDIENTE CLIENTE": 30,
-            "PEND. DOC. PARA EVALUACION": 45, "PENDIENTE DOC": 45,
-            "EN ONBOARDING": 40, "RECH. CLIENTE CANCELA": 90,
-            "RECH. SOBREENDEUDAMIENTO": 95,
-        }
-        
-        df_analisis["Probabilidad de Conversión"] = df_analisis["estatus"].map(prob_conversion).fillna(0.5)
-        df_analisis["Factor Retorno"] = df_analisis["estatus"].map(factor_retorno).fillna(0.5)
-        df_analisis["Riesgo (%)"] = df_analisis["estatus"].map(riesgo_pct).fillna(50)
-        
-        df_analisis["Monto Esperado"] = df_analisis["monto_analisis"] * df_analisis["Probabilidad de Conversión"]
-        df_analisis["Retorno Esperado"] = df_analisis["monto_analisis"] * df_analisis["Factor Retorno"]
-        
-        total_cartera = df_analisis["monto_analisis"].sum()
-        total_monto_esperado = df_analisis["Monto Esperado"].sum()
-        total_retorno = df_analisis["Retorno Esperado"].sum()
-        prom_riesgo = df_analisis["Riesgo (%)"].mean()
-        prom_conversion = df_analisis["Probabilidad de Conversión"].mean() * 100
-        
+    fin = datos["financiero"]
+    if fin is not None:
         slide = prs.slides.add_slide(prs.slide_layouts[6])
-        
-        # Título
-        title_box = slide.shapes.add_textbox(Inches(0.5), Inches(0.3), Inches(9), Inches(0.6))
-        title_frame = title_box.text_frame
-        title_frame.text = "🧠 Diagnóstico Financiero"
-        title_p = title_frame.paragraphs[0]
-        title_p.font.size = Pt(32)
-        title_p.font.bold = True
-        title_p.font.color.rgb = RGBColor(33, 37, 41)
+        agregar_titulo(slide, "🧠 Diagnóstico Financiero")
         
         # Resumen ejecutivo en texto
         resumen_box = slide.shapes.add_textbox(Inches(0.8), Inches(1.2), Inches(8.4), Inches(2.5))
@@ -995,11 +1571,11 @@ def generar_presentacion_dashboard(df_cli: pd.DataFrame) -> bytes:
         p1.font.color.rgb = RGBColor(0, 102, 204)
         
         puntos = [
-            f"Cartera total: {formatear_monto(total_cartera)}",
-            f"Conversión esperada: {formatear_monto(total_monto_esperado)} ({(total_monto_esperado/total_cartera*100):.1f}% de la cartera)",
-            f"Retorno esperado: {formatear_monto(total_retorno)}",
-            f"Riesgo promedio: {prom_riesgo:.1f}%",
-            f"Conversión media: {prom_conversion:.1f}%"
+            f"Cartera total: {formatear_monto(fin['total_cartera'])}",
+            f"Conversión esperada: {formatear_monto(fin['total_monto_esperado'])} ({(fin['total_monto_esperado']/fin['total_cartera']*100):.1f}% de la cartera)",
+            f"Retorno esperado: {formatear_monto(fin['total_retorno'])}",
+            f"Riesgo promedio: {fin['prom_riesgo']:.1f}%",
+            f"Conversión media: {fin['prom_conversion']:.1f}%"
         ]
         
         for punto in puntos:
@@ -1009,153 +1585,28 @@ def generar_presentacion_dashboard(df_cli: pd.DataFrame) -> bytes:
             p.font.color.rgb = RGBColor(51, 51, 51)
             p.level = 1
         
-        # Gráfica de métricas financieras
-        fig, ax = plt.subplots(figsize=(8, 2.5))
-        
-        categorias = ['Cartera\nTotal', 'Conversión\nEsperada', 'Retorno\nEsperado']
-        valores = [total_cartera, total_monto_esperado, total_retorno]
-        colores = ['#007bff', '#28a745', '#ffc107']
-        
-        bars = ax.bar(categorias, valores, color=colores, alpha=0.7, edgecolor='black')
-        ax.set_ylabel('Monto ($)', fontsize=11)
-        ax.set_title('Análisis Financiero de Cartera', fontsize=13, fontweight='bold')
-        
-        # Agregar valores en las barras
-        for bar, valor in zip(bars, valores):
-            height = bar.get_height()
-            ax.text(bar.get_x() + bar.get_width()/2., height,
-                   f'{formatear_monto(valor)}',
-                   ha='center', va='bottom', fontsize=11, fontweight='bold')
-        
-        plt.tight_layout()
-        
-        img_stream = BytesIO()
-        plt.savefig(img_stream, format='png', dpi=150, bbox_inches='tight')
-        plt.close()
-        img_stream.seek(0)
-        
-        slide.shapes.add_picture(img_stream, Inches(1), Inches(4.2), width=Inches(8))
+        agregar_grafica(slide, "financiero", 1, 4.2, 8)
     
     # === SLIDE 5: DISTRIBUCIÓN POR ESTATUS ===
     slide = prs.slides.add_slide(prs.slide_layouts[6])
+    agregar_titulo(slide, "📊 Distribución de Clientes por Estatus")
+    agregar_grafica(slide, "estatus", 0.8, 1.2, 8.4)
     
-    title_box = slide.shapes.add_textbox(Inches(0.5), Inches(0.3), Inches(9), Inches(0.6))
-    title_frame = title_box.text_frame
-    title_frame.text = "📊 Distribución de Clientes por Estatus"
-    title_p = title_frame.paragraphs[0]
-    title_p.font.size = Pt(32)
-    title_p.font.bold = True
-    title_p.font.color.rgb = RGBColor(33, 37, 41)
-    
-    # Gráfica de barras horizontales con todos los estatus
-    fig, ax = plt.subplots(figsize=(8, 5))
-    
-    # Ordenar por cantidad
-    top_10_estatus = estatus_counts.head(10)
-    
-    estatus_labels = [str(e)[:25] for e in top_10_estatus.index]
-    cantidades = top_10_estatus.values
-    
-    bars = ax.barh(estatus_labels, cantidades, color='#17a2b8')
-    ax.set_xlabel('Cantidad de Clientes', fontsize=11)
-    ax.set_title('Top 10 Estatus (por cantidad)', fontsize=13, fontweight='bold')
-    ax.invert_yaxis()
-    
-    # Agregar valores
-    for bar, cantidad in zip(bars, cantidades):
-        ax.text(bar.get_width(), bar.get_y() + bar.get_height()/2,
-               f' {int(cantidad)}',
-               va='center', fontsize=10, fontweight='bold')
-    
-    plt.tight_layout()
-    
-    img_stream = BytesIO()
-    plt.savefig(img_stream, format='png', dpi=150, bbox_inches='tight')
-    plt.close()
-    img_stream.seek(0)
-    
-    slide.shapes.add_picture(img_stream, Inches(0.8), Inches(1.2), width=Inches(8.4))
+    # === SLIDE 6: EVOLUCIÓN MENSUAL ===
+    if "mensual" in specs:
+        slide = prs.slides.add_slide(prs.slide_layouts[6])
+        agregar_titulo(slide, "📈 Evolución Mensual")
+        agregar_grafica(slide, "mensual", 0.8, 1.2, 8.4)
     
-    # === SLIDE 6: DISTRIBUCIÓN POR SUCURSALES ===
+    # === SLIDE 7: DISTRIBUCIÓN POR SUCURSALES ===
     slide = prs.slides.add_slide(prs.slide_layouts[6])
+    agregar_titulo(slide, "🏢 Distribución por Sucursales")
+    agregar_grafica(slide, "sucursales", 0.8, 1.2, 8.4)
     
-    title_box = slide.shapes.add_textbox(Inches(0.5), Inches(0.3), Inches(9), Inches(0.6))
-    title_frame = title_box.text_frame
-    title_frame.text = "🏢 Distribución por Sucursales"
-    title_p = title_frame.paragraphs[0]
-    title_p.font.size = Pt(32)
-    title_p.font.bold = True
-    title_p.font.color.rgb = RGBColor(33, 37, 41)
-    
-    # Contar clientes por sucursal
-    sucursal_counts = df_cli["sucursal"].fillna("Sin sucursal").value_counts()
-    
-    # Crear gráfica de barras
-    fig, ax = plt.subplots(figsize=(8, 5))
-    
-    sucursal_labels = [str(s)[:30] for s in sucursal_counts.index]
-    cantidades = sucursal_counts.values
-    
-    bars = ax.barh(sucursal_labels, cantidades, color='#6f42c1')
-    ax.set_xlabel('Cantidad de Clientes', fontsize=11)
-    ax.set_title('Clientes por Sucursal', fontsize=13, fontweight='bold')
-    ax.invert_yaxis()
-    
-    # Agregar valores
-    for bar, cantidad in zip(bars, cantidades):
-        ax.text(bar.get_width(), bar.get_y() + bar.get_height()/2,
-               f' {int(cantidad)}',
-               va='center', fontsize=10, fontweight='bold')
-    
-    plt.tight_layout()
-    
-    img_stream = BytesIO()
-    plt.savefig(img_stream, format='png', dpi=150, bbox_inches='tight')
-    plt.close()
-    img_stream.seek(0)
-    
-    slide.shapes.add_picture(img_stream, Inches(0.8), Inches(1.2), width=Inches(8.4))
-    
-    # === SLIDE 7: DISTRIBUCIÓN POR ASESORES ===
+    # === SLIDE 8: DISTRIBUCIÓN POR ASESORES ===
     slide = prs.slides.add_slide(prs.slide_layouts[6])
-    
-    title_box = slide.shapes.add_textbox(Inches(0.5), Inches(0.3), Inches(9), Inches(0.6))
-    title_frame = title_box.text_frame
-    title_frame.text = "👤 Distribución por Asesores"
-    title_p = title_frame.paragraphs[0]
-    title_p.font.size = Pt(32)
-    title_p.font.bold = True
-    title_p.font.color.rgb = RGBColor(33, 37, 41)
-    
-    # Contar clientes por asesor
-    asesor_counts = df_cli["asesor"].fillna("Sin asesor").value_counts()
-    
-    # Crear gráfica de barras (mostrar top 10 si hay muchos)
-    fig, ax = plt.subplots(figsize=(8, 5))
-    
-    top_asesores = asesor_counts.head(10)
-    asesor_labels = [str(a)[:30] for a in top_asesores.index]
-    cantidades = top_asesores.values
-    
-    bars = ax.barh(asesor_labels, cantidades, color='#fd7e14')
-    ax.set_xlabel('Cantidad de Clientes', fontsize=11)
-    ax.set_title('Top 10 Asesores (por cantidad de clientes)', fontsize=13, fontweight='bold')
-    ax.invert_yaxis()
-    
-    # Agregar valores
-    for bar, cantidad in zip(bars, cantidades):
-        ax.text(bar.get_width(), bar.get_y() + bar.get_height()/2,
-               f' {int(cantidad)}',
-               va='center', fontsize=10, fontweight='bold')
-    
-    plt.tight_layout()
-    
-    img_stream = BytesIO()
-    plt.savefig(img_stream, format='png', dpi=150, bbox_inches='tight')
-    plt.close()
-    img_stream.seek(0)
-    
-    slide.shapes.add_picture(img_stream, Inches(0.8), Inches(1.2), width=Inches(8.4))
+    agregar_titulo(slide, "👤 Distribución por Asesores")
+    agregar_grafica(slide, "asesores", 0.8, 1.2, 8.4)
     
     # Guardar presentación en BytesIO
     pptx_stream = BytesIO()
@@ -1164,6 +1615,64 @@ def generar_presentacion_dashboard(df_cli: pd.DataFrame) -> bytes:
     
     return pptx_stream.getvalue()
 
+# --- Generación bajo demanda de la presentación ---
+# La presentación sólo se arma cuando alguien la pide, en un hilo aparte, y se memoriza por
+# la versión de los datos (_clave_datos) y la fecha de la portada: descargar de nuevo sin
+# cambios en los datos es inmediato y el render del dashboard no recorre los clientes.
+PPTX_MEMO_MAX = 4   # presentaciones guardadas en memoria
+
+def hash_contenido_df(df: pd.DataFrame) -> str:
+    """Hash estable del contenido de un DataFrame (columnas + valores, sin índice)."""
+    h = hashlib.sha1("|".join(map(str, df.columns)).encode("utf-8"))
+    if not df.empty:
+        h.update(pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+class _GeneradorPresentaciones:
+    """Ejecuta generar_presentacion_dashboard fuera del hilo del script y memoriza el resultado."""
+
+    def __init__(self):
+        # Un solo trabajador: las gráficas ya se reparten en procesos (renderizar_graficas)
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="crm-pptx")
+        self._lock = threading.Lock()
+        self._trabajos = {}   # clave -> Future (orden de inserción = antigüedad)
+
+    @staticmethod
+    def clave(df: pd.DataFrame | None, graficas_nativas: bool = False) -> str:
+        """df=None: los clientes en caché (por versión de carga, sin hashear el contenido)."""
+        return f"{_clave_datos(df)}:{date.today().isoformat()}:{'nativas' if graficas_nativas else 'png'}"
+
+    def solicitar(self, df: pd.DataFrame, graficas_nativas: bool = False, clave: str | None = None) -> str:
+        """Encola la generación (si no existe ya) y retorna su clave (por defecto, la de `df`)."""
+        clave = clave or self.clave(df, graficas_nativas)
+        with self._lock:
+            fut = self._trabajos.get(clave)
+            if fut is None or (fut.done() and fut.exception() is not None):
+                self._trabajos[clave] = self._pool.submit(generar_presentacion_dashboard, df.copy(), graficas_nativas)
+                while len(self._trabajos) > PPTX_MEMO_MAX:
+                    viejo = next(iter(self._trabajos))
+                    if not self._trabajos[viejo].done():
+                        break
+                    del self._trabajos[viejo]
+        return clave
+
+    def estado(self, clave: str) -> tuple[str, object]:
+        """("pendiente"|"generando"|"listo"|"error", bytes o mensaje)."""
+        with self._lock:
+            fut = self._trabajos.get(clave)
+        if fut is None:
+            return "pendiente", None
+        if not fut.done():
+            return "generando", None
+        if fut.exception() is not None:
+            return "error", str(fut.exception())
+        return "listo", fut.result()
+
+@st.cache_resource(show_spinner=False)
+def _generador_presentaciones() -> _GeneradorPresentaciones:
+    """Generador único por proceso (comparte memo entre sesiones)."""
+    return _GeneradorPresentaciones()
+
 def get_base64_image(image_path):
     """Convierte imagen a base64 para embedding en HTML"""
     import base64
@@ -1248,6 +1757,7 @@ DOCS_DIR = DATA_DIR / "docs"
 DOCS_DIR.mkdir(parents=True, exist_ok=True)
 CLIENTES_CSV = DATA_DIR / "clientes.csv"
 CLIENTES_XLSX = DATA_DIR / "clientes.xlsx"
+CLIENTES_DB = DATA_DIR / "clientes.db"   # sistema de registro local (SQLite)
 
 # === CONFIGURACIÓN GOOGLE SHEETS ===
 USE_GSHEETS = True   # pon False si quieres trabajar sólo local
@@ -1260,51 +1770,278 @@ GSHEET_SUCURSALES_TAB = "sucursales"
 GSHEET_ASESORES_TAB = "asesores"  
 GSHEET_ESTATUS_TAB = "estatus"
 GSHEET_SEGUNDO_ESTATUS_TAB = "segundo_estatus"
+GSHEET_USERSTAB = "users"         # usuarios y roles
 
 
 # Opcional: pega aquí el contenido JSON del service account si prefieres no usar el archivo
 # Si la variable está vacía (""), se seguirá leyendo `service_account.json` desde disco.
 SERVICE_ACCOUNT_JSON_STR = ""
-# CACHING para gspread: minimizar auth / apertura repetida durante reruns
-_GS_CREDS = None
-_GS_GC = None
-_GS_SH = None
-_GS_WS_CACHE: dict = {}
-
-# Variables globales para caché de worksheets con timestamp
-_GS_WS_CACHE_TIME = {}
-
-# Variables globales para caché de clientes
-_CLIENTES_CACHE = None
-_CLIENTES_CACHE_TIME = 0
-
-# Variables globales para caché de historial
-_HISTORIAL_CACHE = None
-_HISTORIAL_CACHE_TIME = 0
-
-# Variables globales para caché de usuarios
-_USUARIOS_CACHE = None
-_USUARIOS_CACHE_TIME = 0
-
-# Variables globales para caché de catálogos
-_CATALOGS_CACHE = {
-    "sucursales": None,
-    "estatus": None,
-    "segundo_estatus": None,
-    "asesores": None
-}
-_CATALOGS_CACHE_TIME = {
-    "sucursales": 0,
-    "estatus": 0,
-    "segundo_estatus": 0,
-    "asesores": 0
+
+# === CACHÉ COMPARTIDO (sobrevive a reruns y se comparte entre sesiones) ===
+# Las variables globales del script se reinician en cada rerun; por eso el caché vive
+# en un recurso de proceso (st.cache_resource) con una instantánea por conjunto de datos.
+# Duración (segundos) por conjunto de datos; la clave usa el prefijo antes de ":".
+CACHE_TTL = {
+    "clientes": 60,
+    "historial": 60,
+    "usuarios": 300,     # los usuarios no cambian frecuentemente
+    "catalogo": 600,     # los catálogos cambian muy raramente
+    "worksheet": 300,    # handles de gspread (no datos)
+    "gs": None,          # credenciales / spreadsheet: sin expiración
+    "snapshot": None,    # instantánea tipada: la clave ya es la versión / hash de los datos
+    "cubo": None,        # agregados del dashboard: misma clave que su instantánea
+    "montecarlo": None,  # simulación de cartera: la clave incluye la versión de los datos
+    "filtros": None,     # índice de filtros del sidebar: misma clave que la instantánea
+    "ids": None,         # índice id -> fila: misma clave que la instantánea
 }
 
+class _DataCache:
+    """
+    Caché de proceso con una instantánea por conjunto de datos.
+    - get(): devuelve la instantánea si no ha expirado (cuenta aciertos/fallos)
+    - put(): guarda una instantánea nueva e incrementa su versión
+    - invalidate(): invalidación explícita tras escrituras (acepta prefijos como "catalogo:")
+    Los valores guardados son compartidos: quien los vaya a modificar debe copiarlos.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries: dict = {}    # name -> (valor, timestamp)
+        self._versions: dict = {}   # name -> int (monótono)
+        self._hits: dict = {}
+        self._misses: dict = {}
+
+    @staticmethod
+    def _ttl(name: str):
+        return CACHE_TTL.get(name.split(":", 1)[0], 60)
+
+    def get(self, name: str, ttl: float | None = None):
+        """Instantánea vigente de `name` o None si no existe / expiró."""
+        ttl = self._ttl(name) if ttl is None else ttl
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and (ttl is None or (time.time() - entry[1]) < ttl):
+                self._hits[name] = self._hits.get(name, 0) + 1
+                return entry[0]
+            self._misses[name] = self._misses.get(name, 0) + 1
+            return None
+
+    def peek(self, name: str):
+        """Última instantánea conocida aunque haya expirado (respaldo ante errores de API)."""
+        with self._lock:
+            entry = self._entries.get(name)
+            return entry[0] if entry is not None else None
+
+    def put(self, name: str, value):
+        with self._lock:
+            self._entries[name] = (value, time.time())
+            self._versions[name] = self._versions.get(name, 0) + 1
+        return value
+
+    def invalidate(self, *names: str):
+        """Invalida conjuntos por nombre exacto o por prefijo terminado en ':'."""
+        with self._lock:
+            for name in names:
+                if name.endswith(":"):
+                    for k in [k for k in self._entries if k.startswith(name)]:
+                        self._entries.pop(k, None)
+                        self._versions[k] = self._versions.get(k, 0) + 1
+                elif name in self._entries:
+                    self._entries.pop(name, None)
+                    self._versions[name] = self._versions.get(name, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            for k in list(self._entries):
+                self._versions[k] = self._versions.get(k, 0) + 1
+            self._entries.clear()
+
+    def version(self, name: str) -> int:
+        with self._lock:
+            return self._versions.get(name, 0)
+
+    def age(self, name: str) -> float | None:
+        """Segundos desde la última carga de `name` (None si no está en caché)."""
+        with self._lock:
+            entry = self._entries.get(name)
+            return (time.time() - entry[1]) if entry is not None else None
+
+    def stats(self) -> list[dict]:
+        """Resumen por conjunto de datos para el panel de diagnóstico."""
+        with self._lock:
+            names = sorted(set(self._hits) | set(self._misses) | set(self._entries))
+            out = []
+            for n in names:
+                h, m = self._hits.get(n, 0), self._misses.get(n, 0)
+                entry = self._entries.get(n)
+                out.append({
+                    "dataset": n,
+                    "aciertos": h,
+                    "fallos": m,
+                    "tasa_acierto": round(h / (h + m) * 100, 1) if (h + m) else 0.0,
+                    "version": self._versions.get(n, 0),
+                    "edad_s": round(time.time() - entry[1], 1) if entry is not None else None,
+                })
+            return out
+
+@st.cache_resource(show_spinner=False)
+def _data_cache() -> _DataCache:
+    """Instancia única por proceso del caché de datos."""
+    return _DataCache()
+
+# === LIMITADOR DE LLAMADAS A GOOGLE (cuota compartida por todo el proceso) ===
+# Todas las sesiones usan la misma cuenta de servicio, así que la cuota de Sheets
+# (60 lecturas/min por usuario) es de todo el proceso. Cada llamada pasa por _gs_call:
+# toma un token del bucket de su API y reintenta con backoff exponencial ante 429/5xx.
+# Hay dos carriles: "interactivo" (lo que espera un usuario) siempre pasa primero y
+# "fondo" (cola de sincronización, compactación) deja una reserva de tokens libre.
+GS_CUOTA_MINUTO = {"sheets": 55, "drive": 600}   # margen bajo la cuota real
+GS_RAFAGA = {"sheets": 10, "drive": 50}          # tokens acumulables
+GS_RESERVA_INTERACTIVA = 3                       # tokens que el carril de fondo no puede tomar
+GS_REINTENTOS = 5
+GS_BACKOFF_BASE = 1.0                            # segundos; se duplica por intento
+GS_BACKOFF_MAX = 32.0
+GS_CODIGOS_REINTENTO = {429, 500, 502, 503, 504}
+GS_METRICAS_MINUTOS = 15
+GS_COSTO_SET_DATAFRAME = 2                       # set_with_dataframe(resize=True): resize + escritura de valores
+
+class _RateLimiter:
+    """Token bucket con carril prioritario y métricas por minuto."""
+
+    def __init__(self, por_minuto: float, rafaga: int, reserva: int = 0):
+        self.tasa = por_minuto / 60.0
+        self.capacidad = float(rafaga)
+        self.reserva = reserva
+        self._tokens = float(rafaga)
+        self._t = time.monotonic()
+        self._cond = threading.Condition()
+        self._interactivos_esperando = 0
+        self._metricas = {}   # minuto -> {"interactivo": n, "fondo": n, "reintentos": n, "espera_s": s}
+
+    def _recargar(self):
+        ahora = time.monotonic()
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._t) * self.tasa)
+        self._t = ahora
+
+    def _registrar(self, campo: str, valor: float = 1):
+        minuto = int(time.time() // 60)
+        fila = self._metricas.setdefault(minuto, {"interactivo": 0, "fondo": 0, "reintentos": 0, "espera_s": 0.0})
+        fila[campo] += valor
+        for viejo in [m for m in self._metricas if m <= minuto - GS_METRICAS_MINUTOS]:
+            del self._metricas[viejo]
+
+    def adquirir(self, carril: str = "interactivo", costo: int = 1) -> float:
+        """Bloquea hasta obtener `costo` tokens (llamadas reales a la API). Retorna los segundos de espera."""
+        interactivo = carril != "fondo"
+        costo = min(max(float(costo), 1.0), self.capacidad)
+        inicio = time.monotonic()
+        with self._cond:
+            if interactivo:
+                self._interactivos_esperando += 1
+            try:
+                while True:
+                    self._recargar()
+                    minimo = costo if interactivo else costo + self.reserva
+                    if (interactivo or self._interactivos_esperando == 0) and self._tokens >= minimo:
+                        self._tokens -= costo
+                        break
+                    faltan = max(minimo - self._tokens, 0.0) / self.tasa
+                    self._cond.wait(timeout=min(max(faltan, 0.05), 5.0))
+            finally:
+                if interactivo:
+                    self._interactivos_esperando -= 1
+                    self._cond.notify_all()
+            espera = time.monotonic() - inicio
+            self._registrar("interactivo" if interactivo else "fondo", int(costo))
+            self._registrar("espera_s", espera)
+            return espera
+
+    def penalizar(self):
+        """Tras un 429 se vacía el bucket para que todos los carriles frenen."""
+        with self._cond:
+            self._recargar()
+            self._tokens = min(self._tokens, 0.0)
+            self._registrar("reintentos")
+
+    def registrar_reintento(self):
+        """Cuenta un reintento por error transitorio distinto de 429 (sin tocar el bucket)."""
+        with self._cond:
+            self._registrar("reintentos")
+
+    def metricas(self) -> list[dict]:
+        """Uso por minuto (más reciente primero)."""
+        with self._cond:
+            return [
+                {"minuto": datetime.fromtimestamp(m * 60).strftime("%H:%M"), **{k: round(v, 2) for k, v in fila.items()}}
+                for m, fila in sorted(self._metricas.items(), reverse=True)
+            ]
+
+@st.cache_resource(show_spinner=False)
+def _gs_limiter(api: str = "sheets") -> _RateLimiter:
+    """Limitador único por proceso y por API."""
+    return _RateLimiter(GS_CUOTA_MINUTO.get(api, 60), GS_RAFAGA.get(api, 10), GS_RESERVA_INTERACTIVA)
+
+_gs_carril_local = threading.local()
+
+class _gs_carril:
+    """Contexto que marca las llamadas del hilo actual con un carril ('interactivo' o 'fondo')."""
+
+    def __init__(self, carril: str):
+        self.carril = carril
+
+    def __enter__(self):
+        self._previo = getattr(_gs_carril_local, "carril", "interactivo")
+        _gs_carril_local.carril = self.carril
+        return self
+
+    def __exit__(self, *exc):
+        _gs_carril_local.carril = self._previo
+        return False
+
+def _gs_codigo_error(e: Exception) -> int | None:
+    """Código HTTP de un error de gspread / googleapiclient (None si no aplica)."""
+    for obtener in (
+        lambda: e.response.status_code,   # gspread.exceptions.APIError
+        lambda: e.code,                   # gspread >= 6
+        lambda: e.resp.status,            # googleapiclient.errors.HttpError
+    ):
+        try:
+            codigo = int(obtener())
+            if codigo:
+                return codigo
+        except Exception:
+            pass
+    texto = str(e)
+    if "RESOURCE_EXHAUSTED" in texto or "Quota exceeded" in texto:
+        return 429
+    return None
+
+def _gs_call(fn, *args, api: str = "sheets", costo: int = 1, **kwargs):
+    """
+    Ejecuta una llamada a la API de Google respetando la cuota y reintentando ante 429/5xx.
+    costo: número de peticiones que hace `fn` (helpers como set_with_dataframe hacen varias).
+    """
+    limiter = _gs_limiter(api)
+    carril = getattr(_gs_carril_local, "carril", "interactivo")
+    for intento in range(GS_REINTENTOS + 1):
+        limiter.adquirir(carril, costo)
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            codigo = _gs_codigo_error(e)
+            if codigo not in GS_CODIGOS_REINTENTO or intento == GS_REINTENTOS:
+                raise
+            if codigo == 429:
+                limiter.penalizar()
+            else:
+                limiter.registrar_reintento()
+            time.sleep(min(GS_BACKOFF_MAX, GS_BACKOFF_BASE * (2 ** intento)) + random.uniform(0, 1))
+
 def _gs_credentials():
     """Carga credenciales desde Streamlit secrets - Versión mejorada para Streamlit Cloud"""
-    global _GS_CREDS
-    if _GS_CREDS is not None:
-        return _GS_CREDS
+    cached = _data_cache().get("gs:creds")
+    if cached is not None:
+        return cached
     try:
         # 1) Streamlit Secrets (PRIMARIO para Streamlit Cloud)
         if hasattr(st, "secrets"):
@@ -1326,8 +2063,7 @@ def _gs_credentials():
                     sa_info["private_key"] = sa_info["private_key"].replace("\\n", "\n")
                 
                 scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-                _GS_CREDS = Credentials.from_service_account_info(sa_info, scopes=scopes)
-                return _GS_CREDS
+                return _data_cache().put("gs:creds", Credentials.from_service_account_info(sa_info, scopes=scopes))
         
         # 2) Fallback para desarrollo local
         try:
@@ -1337,8 +2073,7 @@ def _gs_credentials():
                 if "private_key" in sa_info:
                     sa_info["private_key"] = sa_info["private_key"].replace("\\n", "\n")
                 scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-                _GS_CREDS = Credentials.from_service_account_info(sa_info, scopes=scopes)
-                return _GS_CREDS
+                return _data_cache().put("gs:creds", Credentials.from_service_account_info(sa_info, scopes=scopes))
         except FileNotFoundError:
             pass
             
@@ -1349,67 +2084,55 @@ def _gs_credentials():
         st.error(f"❌ Error en autenticación Google Sheets: {str(e)}")
         return None
 
+def _gs_spreadsheet():
+    """Spreadsheet principal (cliente y handle quedan en el caché compartido). None si no hay conexión."""
+    cache = _data_cache()
+    sh = cache.get("gs:spreadsheet")
+    if sh is not None:
+        return sh
+    try:
+        creds = _gs_credentials()
+        if creds is None:
+            return None
+        gc = cache.get("gs:client")
+        if gc is None:
+            gc = cache.put("gs:client", gspread.authorize(creds))
+        return cache.put("gs:spreadsheet", _gs_call(gc.open_by_key, GSHEET_ID))
+    except Exception:
+        return None
+
 def _gs_open_worksheet(tab_name: str, force_reload: bool = False):
-    """Versión con caché temporal para evitar recargas innecesarias"""
-    global _GS_GC, _GS_SH, _GS_WS_CACHE, _GS_WS_CACHE_TIME
-    
-    # Verificar si el caché es reciente (menos de 5 segundos)
-    import time
-    now = time.time()
-    cache_duration = 5  # segundos
-    
-    if not force_reload and tab_name in _GS_WS_CACHE:
-        if tab_name in _GS_WS_CACHE_TIME:
-            if (now - _GS_WS_CACHE_TIME[tab_name]) < cache_duration:
-                return _GS_WS_CACHE[tab_name]
+    """Abre (o crea) una pestaña reutilizando cliente, spreadsheet y worksheet del caché compartido"""
+    cache = _data_cache()
+    key = f"worksheet:{tab_name}"
+    if not force_reload:
+        ws = cache.get(key)
+        if ws is not None:
+            return ws
     
     try:
         creds = _gs_credentials()
         if creds is None:
             return None
 
-        if _GS_GC is None:
-            _GS_GC = gspread.authorize(creds)
-        
-        if _GS_SH is None:
-            try:
-                _GS_SH = _GS_GC.open_by_key(GSHEET_ID)
-            except Exception:
-                return None
+        sh = _gs_spreadsheet()
+        if sh is None:
+            return None
 
         try:
-            ws = _GS_SH.worksheet(tab_name)
+            ws = _gs_call(sh.worksheet, tab_name)
         except gspread.exceptions.WorksheetNotFound:
-            ws = _GS_SH.add_worksheet(title=tab_name, rows="5000", cols="50")
+            ws = _gs_call(sh.add_worksheet, title=tab_name, rows="5000", cols="50")
 
-        _GS_WS_CACHE[tab_name] = ws
-        _GS_WS_CACHE_TIME[tab_name] = now
-        return ws
+        return cache.put(key, ws)
         
     except Exception:
         return None
 
 def limpiar_cache_gsheets():
     """Limpia todos los cachés de Google Sheets para forzar recarga de datos."""
-    global _GS_GC, _GS_SH, _GS_WS_CACHE, _CLIENTES_CACHE, _CLIENTES_CACHE_TIME, _GS_WS_CACHE_TIME
-    global _HISTORIAL_CACHE, _HISTORIAL_CACHE_TIME, _USUARIOS_CACHE, _USUARIOS_CACHE_TIME
-    global _CATALOGS_CACHE, _CATALOGS_CACHE_TIME
-    
-    _GS_WS_CACHE.clear()
-    _GS_WS_CACHE_TIME.clear()
-    _GS_GC = None
-    _GS_SH = None
-    _CLIENTES_CACHE = None
-    _CLIENTES_CACHE_TIME = 0
-    _HISTORIAL_CACHE = None
-    _HISTORIAL_CACHE_TIME = 0
-    _USUARIOS_CACHE = None
-    _USUARIOS_CACHE_TIME = 0
-    
-    # Limpiar catálogos
-    for key in _CATALOGS_CACHE:
-        _CATALOGS_CACHE[key] = None
-        _CATALOGS_CACHE_TIME[key] = 0
+    cache = _data_cache()
+    cache.invalidate("gs:client", "gs:spreadsheet", "worksheet:", "clientes", "historial", "usuarios", "catalogo:", "misc:precarga")
     
     st.cache_data.clear()
     if 'gs_load_msg_shown' in st.session_state:
@@ -1419,9 +2142,7 @@ def limpiar_cache_gsheets():
 
 def limpiar_cache_usuarios():
     """Limpia el caché de usuarios para forzar recarga"""
-    global _USUARIOS_CACHE, _USUARIOS_CACHE_TIME
-    _USUARIOS_CACHE = None
-    _USUARIOS_CACHE_TIME = 0
+    _data_cache().invalidate("usuarios")
 
 def find_logo_path() -> Path | None:
     # Buscar logo en data/ (logo.png, logo.jpg) o en data/logo subfolder
@@ -1482,17 +2203,14 @@ def save_sucursales(lst: list):
     try:
         clean = [str(x).strip() for x in lst if str(x).strip()]
         SUCURSALES_FILE.write_text(json.dumps(clean, ensure_ascii=False, indent=2), encoding="utf-8")
-        # Limpiar cache relacionado
-        _cache_data.pop("sucursales", None)
-        _cache_timestamp.pop("sucursales", None)
+        # Invalidar la instantánea compartida del catálogo
+        _data_cache().invalidate("catalogo:sucursales")
         # Sincronizar con Google Sheets
         if USE_GSHEETS:
             sync_catalog_to_gsheet("sucursales", clean, GSHEET_SUCURSALES_TAB)
     except Exception:
         pass
 
-# Inicializar lista de sucursales desde disco
-SUCURSALES = load_sucursales()
 ESTATUS_FILE = DATA_DIR / "estatus.json"
 SEGUNDO_ESTATUS_FILE = DATA_DIR / "segundo_estatus.json"
 
@@ -1535,40 +2253,25 @@ def load_estatus() -> list:
         pass
     return defaults
 
-# Cache simple para mejorar rendimiento
-_cache_data = {}
-_cache_timestamp = {}
-
 def get_cached_data(key: str, loader_func, cache_duration: int = 30):
-    """Cache simple con expiración en segundos"""
-    import time
-    now = time.time()
-    
-    # Verificar si el cache es válido
-    if (key in _cache_data and 
-        key in _cache_timestamp and 
-        (now - _cache_timestamp[key]) < cache_duration):
-        return _cache_data[key]
-    
-    # Cargar datos frescos
-    data = loader_func()
-    _cache_data[key] = data
-    _cache_timestamp[key] = now
+    """Cache simple con expiración en segundos (respaldado por el caché compartido)"""
+    cache = _data_cache()
+    name = f"misc:{key}"
+    data = cache.get(name, ttl=cache_duration)
+    if data is None:
+        data = cache.put(name, loader_func())
     return data
 
 def clear_cache():
     """Limpiar todo el cache"""
-    global _cache_data, _cache_timestamp
-    _cache_data.clear()
-    _cache_timestamp.clear()
+    _data_cache().clear()
 
 def save_estatus(lst: list):
     try:
         clean = [str(x).strip() for x in lst if str(x).strip()]
         ESTATUS_FILE.write_text(json.dumps(clean, ensure_ascii=False, indent=2), encoding="utf-8")
-        # Limpiar cache relacionado
-        _cache_data.pop("estatus", None)
-        _cache_timestamp.pop("estatus", None)
+        # Invalidar la instantánea compartida del catálogo
+        _data_cache().invalidate("catalogo:estatus")
         # Sincronizar con Google Sheets
         if USE_GSHEETS:
             sync_catalog_to_gsheet("estatus", clean, GSHEET_ESTATUS_TAB)
@@ -1618,9 +2321,8 @@ def save_segundo_estatus(lst: list):
     try:
         clean = [str(x).strip() for x in lst if (str(x).strip() or x == "")]
         SEGUNDO_ESTATUS_FILE.write_text(json.dumps(clean, ensure_ascii=False, indent=2), encoding="utf-8")
-        # Limpiar cache relacionado
-        _cache_data.pop("segundo_estatus", None)
-        _cache_timestamp.pop("segundo_estatus", None)
+        # Invalidar la instantánea compartida del catálogo
+        _data_cache().invalidate("catalogo:segundo_estatus")
         # Sincronizar con Google Sheets
         if USE_GSHEETS:
             sync_catalog_to_gsheet("segundo_estatus", clean, GSHEET_SEGUNDO_ESTATUS_TAB)
@@ -1642,11 +2344,11 @@ def sync_catalog_to_gsheet(catalog_name: str, catalog_data: list, sheet_tab: str
         df_catalog = pd.DataFrame({"valor": catalog_data})
         
         # Limpiar la hoja y escribir los datos
-        ws.clear()
-        ws.update("A1", [["valor"]])  # Encabezado
+        _gs_call(ws.clear)
+        _gs_call(ws.update, "A1", [["valor"]])  # Encabezado
         if not df_catalog.empty:
             rows = df_catalog.values.tolist()
-            ws.append_rows(rows, value_input_option="RAW")
+            _gs_call(ws.append_rows, rows, value_input_option="RAW")
             
     except Exception:
         pass  # Fallar silenciosamente
@@ -1656,8 +2358,6 @@ def load_catalog_from_gsheet(sheet_tab: str, default_values: list = None, force_
     Carga un catálogo desde Google Sheets con caché inteligente
     force_reload: True para forzar recarga desde Google Sheets
     """
-    global _CATALOGS_CACHE, _CATALOGS_CACHE_TIME
-    
     if not USE_GSHEETS:
         return default_values or []
     
@@ -1672,27 +2372,25 @@ def load_catalog_from_gsheet(sheet_tab: str, default_values: list = None, force_
     elif "asesor" in sheet_tab.lower():
         catalog_name = "asesores"
     
-    # Si tenemos el nombre del catálogo, usar caché
-    if catalog_name:
-        import time
-        now = time.time()
-        cache_duration = 600  # 10 minutos (los catálogos cambian muy raramente)
-        
-        # Usar caché si es reciente y no se fuerza recarga
-        if not force_reload and _CATALOGS_CACHE.get(catalog_name) is not None:
-            if (now - _CATALOGS_CACHE_TIME.get(catalog_name, 0)) < cache_duration:
-                return _CATALOGS_CACHE[catalog_name].copy()
+    cache = _data_cache()
+    key = f"catalogo:{catalog_name}" if catalog_name else None
+    
+    # Usar caché si es reciente y no se fuerza recarga (TTL en CACHE_TTL["catalogo"])
+    if key and not force_reload:
+        cached = cache.get(key)
+        if cached is not None:
+            return list(cached)
     
     try:
         ws = _gs_open_worksheet(sheet_tab, force_reload=force_reload)
         if ws is None:
             # Si hay caché antiguo, usarlo
-            if catalog_name and _CATALOGS_CACHE.get(catalog_name) is not None:
-                return _CATALOGS_CACHE[catalog_name].copy()
+            if key and cache.peek(key) is not None:
+                return list(cache.peek(key))
             return default_values or []
         
         # Obtener todos los valores
-        data = ws.get_all_records()
+        data = _gs_call(ws.get_all_records)
         if data:
             values = [str(row.get("valor", "")).strip() for row in data]
             # Filtrar valores vacíos
@@ -1702,17 +2400,15 @@ def load_catalog_from_gsheet(sheet_tab: str, default_values: list = None, force_
             result = default_values or []
         
         # Actualizar caché si identificamos el catálogo
-        if catalog_name:
-            import time
-            _CATALOGS_CACHE[catalog_name] = result.copy()
-            _CATALOGS_CACHE_TIME[catalog_name] = time.time()
+        if key:
+            cache.put(key, list(result))
         
         return result
             
     except Exception:
         # Si hay error y existe caché, usarlo
-        if catalog_name and _CATALOGS_CACHE.get(catalog_name) is not None:
-            return _CATALOGS_CACHE[catalog_name].copy()
+        if key and cache.peek(key) is not None:
+            return list(cache.peek(key))
         pass
     
     return default_values or []
@@ -1767,7 +2463,106 @@ def load_catalogs_from_gsheet():
     except Exception:
         pass  # Mantener valores actuales si falla
 
-# Inicializar catálogos desde disco (con posible actualización desde Google Sheets)
+# === PRECARGA EN UNA SOLA LECTURA (values.batchGet) ===
+# Al arrancar se piden juntas las pestañas cuyo caché no está vigente y con eso se llenan los
+# cachés de catálogos, usuarios y, si la base local está vacía, la hoja de clientes. Los
+# cargadores normales encuentran su caché lleno y no hacen más viajes de red.
+PRECARGA_CATALOGOS = {
+    GSHEET_SUCURSALES_TAB: "catalogo:sucursales",
+    GSHEET_ESTATUS_TAB: "catalogo:estatus",
+    GSHEET_SEGUNDO_ESTATUS_TAB: "catalogo:segundo_estatus",
+    GSHEET_ASESORES_TAB: "catalogo:asesores",
+}
+
+def _valores_a_df(filas: list) -> pd.DataFrame:
+    """Valores crudos de la API (primera fila = encabezado) en el formato de get_as_dataframe (etiqueta = fila - 2)."""
+    if not filas:
+        return pd.DataFrame()
+    encabezado = [str(h).strip() for h in filas[0]]
+    n = len(encabezado)
+    datos = [list(f[:n]) + [""] * (n - len(f)) for f in filas[1:]]
+    df = pd.DataFrame(datos, columns=encabezado, dtype=str)
+    return df.replace("", np.nan).dropna(how="all")
+
+def _usuarios_desde_df(df: pd.DataFrame) -> dict:
+    """Convierte la pestaña de usuarios a {"users": [...]} (sólo usuarios completos)."""
+    if df is None or df.empty:
+        return {"users": []}
+    users = []
+    for _, row in df.fillna("").iterrows():
+        user_data = {
+            "user": row.get("user", ""),
+            "role": row.get("role", "member"),
+            "salt": row.get("salt", ""),
+            "hash": row.get("hash", "")
+        }
+        # Solo agregar usuarios válidos
+        if user_data["user"] and user_data["salt"] and user_data["hash"]:
+            users.append(user_data)
+    return {"users": users}
+
+def _base_local_vacia() -> bool:
+    """True si la base local aún no tiene clientes (se consulta antes de abrir la conexión compartida)."""
+    try:
+        conn = sqlite3.connect(f"file:{CLIENTES_DB}?mode=ro", uri=True)
+        try:
+            return int(conn.execute("SELECT COUNT(*) FROM clientes").fetchone()[0]) == 0
+        finally:
+            conn.close()
+    except Exception:
+        return True
+
+def precargar_gsheets(force_reload: bool = False) -> int:
+    """
+    Llena los cachés de catálogos, usuarios y (en el primer arranque) clientes con un solo
+    values.batchGet. Retorna cuántas pestañas se leyeron; 0 si no hacía falta o si falló
+    (en ese caso cada cargador hace su propia lectura como antes).
+    """
+    if not USE_GSHEETS:
+        return 0
+    cache = _data_cache()
+    # Una precarga por ventana de TTL: las pestañas vacías no se vuelven a pedir en cada rerun
+    ventana = min(CACHE_TTL["usuarios"], CACHE_TTL["catalogo"])
+    if not force_reload and cache.get("misc:precarga", ttl=ventana) is not None:
+        return 0
+    claves = dict(PRECARGA_CATALOGOS)
+    claves[GSHEET_USERSTAB] = "usuarios"
+    if _base_local_vacia():
+        claves[GSHEET_TAB] = "misc:hoja_clientes"
+    tabs = [tab for tab, clave in claves.items() if force_reload or cache.get(clave) is None]
+    if not tabs:
+        return 0
+    try:
+        sh = _gs_spreadsheet()
+        if sh is None:
+            return 0
+        respuesta = _gs_call(sh.values_batch_get, [f"'{tab}'" for tab in tabs])
+        rangos = respuesta.get("valueRanges", [])
+    except Exception:
+        return 0
+    cache.put("misc:precarga", time.time())
+
+    for tab, rango in zip(tabs, rangos):
+        try:
+            df = _valores_a_df(rango.get("values", []))
+            clave = claves[tab]
+            if clave.startswith("catalogo:"):
+                if "valor" not in df.columns:
+                    continue
+                valores = [v for v in df["valor"].fillna("").astype(str).str.strip() if v]
+                if valores:
+                    cache.put(clave, valores)
+            elif clave == "usuarios":
+                cache.put(clave, _usuarios_desde_df(df))
+            else:
+                cache.put(clave, df)
+        except Exception:
+            pass
+    return len(rangos)
+
+# Inicializar catálogos: una lectura en lote llena los cachés y el disco queda como respaldo
+precargar_gsheets()
+SUCURSALES = load_sucursales()
 ESTATUS_OPCIONES = load_estatus()
 SEGUNDO_ESTATUS_OPCIONES = load_segundo_estatus()
 
@@ -1782,17 +2577,22 @@ DOC_CATEGORIAS = {
 # ---------- Helpers ----------
 SAFE_NAME_RE = re.compile(r"[^A-Za-z0-9._\\-áéíóúÁÉÍÓÚñÑ ]+")
 
-def sort_df_by_dates(df: pd.DataFrame) -> pd.DataFrame:
+def sort_df_by_dates(df: pd.DataFrame, snap: pd.DataFrame | None = None) -> pd.DataFrame:
     """
     Ordena el DataFrame por las columnas de fecha si existen ('fecha_ingreso', 'fecha_dispersion', 'ts').
     Si ninguna existe, retorna el DataFrame sin cambios.
     Maneja formatos de fecha MM/DD/YYYY y DD/MM/YYYY automáticamente.
+    snap: instantánea tipada (snapshot_clientes); si las filas corresponden, reutiliza sus fechas ya parseadas.
     """
     df = df.copy()
     date_cols = [col for col in ["fecha_ingreso", "fecha_dispersion", "ts"] if col in df.columns]
+    parseadas = _fechas_alineadas(df, snap)
     for col in date_cols:
         try:
-            df[col] = parse_dates_flexible(df[col])
+            if parseadas is not None and col in parseadas.columns:
+                df[col] = parseadas[col]
+            else:
+                df[col] = parse_dates_flexible(df[col])
         except Exception:
             pass
     if date_cols:
@@ -1829,6 +2629,7 @@ def safe_name(s: str) -> str:
     return s[:150]
 
 # NEW: normalización y búsqueda de asesor existente
+@lru_cache(maxsize=50_000)
 def _norm_key(s: str) -> str:
     s = (s or "")
     s = str(s).strip()
@@ -1838,6 +2639,85 @@ def _norm_key(s: str) -> str:
     # usar casefold() en lugar de lower() para una comparación Unicode más robusta
     return s.casefold()
 
+def _titulo_asesor(name: str) -> str:
+    """Forma "limpia" con Title Case para un asesor nuevo (mínima transformación)."""
+    return " ".join(w.capitalize() for w in str(name).split())
+
+def _diccionario_asesores(serie: pd.Series) -> dict:
+    """Clave normalizada -> primera forma registrada entre los asesores de `serie`."""
+    dic = {}
+    for a in pd.unique(serie.fillna("").astype(str)):
+        if a.strip():
+            dic.setdefault(_norm_key(a), a)
+    return dic
+
+# --- Catálogo de asesores (compartido por todas las sesiones) ---
+# Clave normalizada -> nombre registrado. Se reconstruye desde la base cada vez que cambia la
+# versión de "clientes" (un renombre en la base se refleja) y entre recargas se actualiza de
+# forma incremental: sólo se normalizan los nombres que no se habían visto.
+class _CatalogoAsesores:
+    """Diccionario de asesores de la base actual; dentro de ella gana la primera forma de cada clave."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nombres: dict = {}   # clave normalizada -> forma registrada
+        self._vistos: set = set()  # textos ya procesados
+        self.version = None        # versión de "clientes" con la que se sincronizó
+
+    def registrar(self, nombres) -> None:
+        nuevos = [a for a in pd.unique(pd.Series(nombres, dtype=object).fillna("").astype(str)) if a not in self._vistos]
+        if not nuevos:
+            return
+        with self._lock:
+            for a in nuevos:
+                self._vistos.add(a)
+                if a.strip():
+                    self._nombres.setdefault(_norm_key(a), a)
+
+    def sincronizar(self) -> None:
+        """Reconstruye el catálogo con los asesores de la última carga de clientes si cambió su versión."""
+        if _data_cache().version("clientes") != self.version:
+            asesores = cargar_clientes()["asesor"]
+            nombres = _diccionario_asesores(asesores)
+            vistos = set(pd.unique(asesores.fillna("").astype(str)))
+            with self._lock:
+                self._nombres, self._vistos = nombres, vistos
+            self.version = _data_cache().version("clientes")
+
+    def diccionario(self) -> dict:
+        with self._lock:
+            return dict(self._nombres)
+
+@st.cache_resource(show_spinner=False)
+def _catalogo_asesores() -> _CatalogoAsesores:
+    """Instancia única por proceso del catálogo de asesores."""
+    return _CatalogoAsesores()
+
+def match_asesores(serie: pd.Series, referencia: pd.DataFrame | None = None) -> pd.Series:
+    """
+    find_matching_asesor para toda una columna: cada valor distinto se normaliza una sola vez.
+    referencia: DataFrame con 'asesor' contra el cual buscar; None usa el catálogo compartido.
+    Los nombres sin coincidencia se unifican entre sí (la primera forma en Title Case gana),
+    igual que si se agregaran uno por uno.
+    """
+    if referencia is None:
+        catalogo = _catalogo_asesores()
+        catalogo.sincronizar()
+        dic = catalogo.diccionario()
+    else:
+        dic = _diccionario_asesores(referencia["asesor"]) if "asesor" in referencia.columns else {}
+    valores = serie.fillna("").astype(str).str.strip()
+    salida = {}
+    for v in pd.unique(valores):
+        if not v:
+            salida[v] = ""
+            continue
+        clave = _norm_key(v)
+        if clave not in dic:
+            dic[clave] = _titulo_asesor(v)
+        salida[v] = dic[clave]
+    return valores.map(salida)
+
 def find_matching_asesor(name: str, df: pd.DataFrame) -> str:
     """
     Si name coincide (normalizado) con algún 'asesor' ya presente en df -> retorna la forma registrada.
@@ -1846,15 +2726,148 @@ def find_matching_asesor(name: str, df: pd.DataFrame) -> str:
     name = (name or "").strip()
     if not name:
         return ""
-    name_key = _norm_key(name)
-    # buscar en el dataframe por la clave normalizada
-    for a in df["asesor"].fillna("").unique():
-        if not str(a).strip():
-            continue
-        if _norm_key(a) == name_key:
-            return a  # usar la forma ya existente
+    # buscar en el dataframe por la clave normalizada (claves memorizadas por _norm_key)
+    registrado = _diccionario_asesores(df["asesor"]).get(_norm_key(name))
+    if registrado is not None:
+        return registrado  # usar la forma ya existente
     # si no existe, devolver una versión "limpia" con Title Case (mínima transformación)
-    return " ".join(w.capitalize() for w in name.split())
+    return _titulo_asesor(name)
+
+def aplicar_cambios_editor(df_base: pd.DataFrame, df_editor: pd.DataFrame, cambios: dict | None):
+    """
+    Aplica sólo el conjunto de cambios de st.data_editor (edited_rows / added_rows / deleted_rows)
+    sobre df_base. Las posiciones de edited_rows y deleted_rows se refieren a las filas de df_editor.
+    Los asesores editados se unifican con find_matching_asesor; el resto de la base no se toca.
+    Retorna (df_nuevo, {id: [campos cambiados]}, ids_agregados, ids_eliminados).
+    """
+    cambios = cambios or {}
+    ids_editor = df_editor["id"].astype(str).to_numpy() if "id" in df_editor.columns else np.array([], dtype=object)
+    nuevo = df_base.copy()
+
+    # Ediciones agrupadas por columna: {columna: {id: valor}}
+    por_columna: dict = {}
+    for pos, fila in (cambios.get("edited_rows") or {}).items():
+        pos = int(pos)
+        if not (0 <= pos < len(ids_editor)):
+            continue
+        for col, valor in (fila or {}).items():
+            if col in COLUMNS and col != "id":
+                por_columna.setdefault(col, {})[ids_editor[pos]] = "" if valor is None else str(valor)
+    if "asesor" in por_columna:
+        editados = por_columna["asesor"]
+        por_columna["asesor"] = dict(zip(editados, match_asesores(pd.Series(list(editados.values()), dtype=object), df_base)))
+
+    posiciones = pd.Index(nuevo["id"].astype(str))
+    campos_cambiados: dict = {}
+    for col in [c for c in COLUMNS if c in por_columna]:
+        valores = por_columna[col]
+        ids = np.array(list(valores), dtype=object)
+        filas = posiciones.get_indexer(ids)
+        existe = filas >= 0
+        ids, filas = ids[existe], filas[existe]
+        nuevos = np.array([valores[cid] for cid in ids], dtype=object)
+        distinto = nuevo[col].iloc[filas].astype(str).to_numpy() != nuevos
+        if distinto.any():
+            nuevo.iloc[filas[distinto], nuevo.columns.get_loc(col)] = nuevos[distinto]
+            for cid in ids[distinto]:
+                campos_cambiados.setdefault(cid, []).append(col)
+
+    ids_eliminados = []
+    for pos in cambios.get("deleted_rows") or []:
+        if 0 <= int(pos) < len(ids_editor):
+            ids_eliminados.append(ids_editor[int(pos)])
+    if ids_eliminados:
+        nuevo = nuevo[~nuevo["id"].astype(str).isin(ids_eliminados)]
+        for cid in ids_eliminados:
+            campos_cambiados.pop(cid, None)
+
+    ids_agregados = []
+    agregados = []
+    for fila in cambios.get("added_rows") or []:
+        fila = {c: ("" if fila.get(c) is None else str(fila.get(c))) for c in COLUMNS}
+        if not fila["id"].strip() or fila["id"] in posiciones or fila["id"] in ids_agregados:
+            fila["id"] = nuevo_id_cliente(pd.concat([nuevo[["id"]], pd.DataFrame({"id": ids_agregados})], ignore_index=True))
+        if fila["asesor"]:
+            fila["asesor"] = find_matching_asesor(fila["asesor"], df_base)
+        ids_agregados.append(fila["id"])
+        agregados.append(fila)
+    if agregados:
+        nuevo = pd.concat([nuevo, pd.DataFrame(agregados, columns=COLUMNS)], ignore_index=True)
+
+    return nuevo.reset_index(drop=True), campos_cambiados, ids_agregados, ids_eliminados
+
+def importar_clientes(base: pd.DataFrame, entrada: pd.DataFrame, modo: str):
+    """
+    Importa `entrada` sobre `base` con un solo join por la llave del modo:
+    - "Actualizar por ID (si coincide)": llave id.
+    - "Upsert por Nombre+Teléfono": llave nombre+teléfono (ambos no vacíos).
+    - "Agregar (solo nuevos)": no actualiza; omite filas cuya llave nombre+teléfono ya existe.
+    Filas repetidas de la entrada se comportan como si se importaran una por una (la primera crea
+    el registro y las siguientes lo actualizan u omiten). Los nuevos se agregan en un solo concat
+    y los ids faltantes se reservan en un bloque.
+    Retorna (df_nuevo, actualizados, agregados): DataFrames con los registros aplicados y su id final.
+    """
+    campos = [c for c in COLUMNS if c != "id"]
+    base = base.copy()
+    for c in COLUMNS:
+        if c not in base.columns:
+            base[c] = ""
+    ent = entrada.reset_index(drop=True).reindex(columns=COLUMNS).fillna("").astype(str)
+    ent["asesor"] = match_asesores(entrada["asesor"].reset_index(drop=True) if "asesor" in entrada.columns else pd.Series("", index=ent.index)).to_numpy()
+    rid = ent["id"].str.strip()
+    nombre = ent["nombre"].str.strip()
+    tel = ent["telefono"].str.strip()
+    vacio = ent.iloc[:0][COLUMNS]
+
+    if modo == "Actualizar por ID (si coincide)":
+        llave, valida = rid, rid != ""
+        llave_base = base["id"].astype(str)
+    else:
+        llave, valida = nombre + "\x1f" + tel, (nombre != "") & (tel != "")
+        llave_base = base["nombre"].astype(str) + "\x1f" + base["telefono"].astype(str)
+
+    # Hash join: llave de la entrada -> primera fila de la base con esa llave
+    unicas = ~llave_base.duplicated(keep="first")
+    pos = pd.Index(llave_base[unicas]).get_indexer(llave.where(valida, None))
+    etiquetas = base.index[unicas]
+    en_base = pd.Series(valida.to_numpy() & (pos >= 0), index=ent.index)
+    repetida = valida & ~en_base & llave.duplicated(keep="first")
+
+    if modo == "Agregar (solo nuevos)":
+        actualizados = vacio
+        nuevos = ent[~en_base & ~repetida].copy()
+    else:
+        # Actualizaciones contra la base: gana la última fila de cada llave
+        upd = ent[en_base].assign(_fila=etiquetas[pos[en_base.to_numpy()]])
+        upd["id"] = base.loc[upd["_fila"], "id"].astype(str).to_numpy()
+        ultimas = upd.drop_duplicates("_fila", keep="last")
+        if not ultimas.empty:
+            base.loc[ultimas["_fila"].to_numpy(), campos] = ultimas[campos].to_numpy()
+        # Llaves nuevas repetidas: la primera crea el registro con los valores de la última
+        nuevos = ent[~en_base & ~repetida].copy()
+        if repetida.any():
+            finales = ent[valida & ~en_base].groupby(llave[valida & ~en_base], sort=False)[campos].last()
+            con_llave = valida[nuevos.index]
+            nuevos.loc[con_llave, campos] = finales.loc[llave[nuevos.index[con_llave]]].to_numpy()
+        actualizados = pd.concat([upd[COLUMNS], ent[repetida][COLUMNS]])
+
+    # Ids de los nuevos: el de la entrada si está libre; los demás se reservan en un solo bloque
+    ids_base = base["id"].astype(str)
+    propio = rid[nuevos.index]
+    libre = (propio != "") & ~propio.isin(ids_base) & ~propio.duplicated(keep="first")
+    nuevos["id"] = propio.where(libre, "")
+    faltan = int((~libre).sum())
+    if faltan:
+        nuevos.loc[~libre, "id"] = reservar_ids(faltan, pd.concat([ids_base, propio[libre]], ignore_index=True))
+    if len(actualizados) and repetida.any():
+        # las repetidas apuntan al id final del registro que crearon
+        id_por_llave = pd.Series(nuevos["id"].to_numpy(), index=llave[nuevos.index].to_numpy())
+        id_por_llave = id_por_llave[valida[nuevos.index].to_numpy()]
+        actualizados.loc[repetida[repetida].index, "id"] = id_por_llave.loc[llave[repetida]].to_numpy()
+
+    if not nuevos.empty:
+        base = pd.concat([base, nuevos[COLUMNS]], ignore_index=True)
+    return base, actualizados.reset_index(drop=True), nuevos.reset_index(drop=True)
 
 
 # ----- Document helpers para manejo de archivos de clientes -----
@@ -1951,7 +2964,7 @@ def crear_carpeta_cliente_drive(cliente_id, cliente_nombre=""):
     
     # Buscar carpeta principal "CRM Kapitaliza"
     query = "name='CRM Kapitaliza' and mimeType='application/vnd.google-apps.folder' and trashed=false"
-    results = drive_service.files().list(q=query, fields="files(id, name)").execute()
+    results = _gs_call(drive_service.files().list(q=query, fields="files(id, name)").execute, api="drive")
     
     if not results.get('files'):
         # Crear carpeta principal
@@ -1959,7 +2972,7 @@ def crear_carpeta_cliente_drive(cliente_id, cliente_nombre=""):
             'name': 'CRM Kapitaliza',
             'mimeType': 'application/vnd.google-apps.folder'
         }
-        main_folder = drive_service.files().create(body=folder_metadata, fields='id').execute()
+        main_folder = _gs_call(drive_service.files().create(body=folder_metadata, fields='id').execute, api="drive")
         main_folder_id = main_folder.get('id')
     else:
         main_folder_id = results['files'][0]['id']
@@ -1975,7 +2988,7 @@ def crear_carpeta_cliente_drive(cliente_id, cliente_nombre=""):
     
     # Buscar si ya existe una carpeta con este nombre
     query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and '{main_folder_id}' in parents and trashed=false"
-    results = drive_service.files().list(q=query, fields="files(id, name)").execute()
+    results = _gs_call(drive_service.files().list(q=query, fields="files(id, name)").execute, api="drive")
     
     if not results.get('files'):
         # Crear carpeta del cliente
@@ -1984,7 +2997,7 @@ def crear_carpeta_cliente_drive(cliente_id, cliente_nombre=""):
             'mimeType': 'application/vnd.google-apps.folder',
             'parents': [main_folder_id]
         }
-        client_folder = drive_service.files().create(body=folder_metadata, fields='id').execute()
+        client_folder = _gs_call(drive_service.files().create(body=folder_metadata, fields='id').execute, api="drive")
         return client_folder.get('id')
     else:
         return results['files'][0]['id']
@@ -2007,7 +3020,7 @@ def subir_a_drive(uploaded_file, cliente_id=None, cliente_nombre=""):
         file_metadata["parents"] = [parent_folder_id]
     
     media = MediaIoBaseUpload(io.BytesIO(uploaded_file.getbuffer()), mimetype=uploaded_file.type)
-    file = drive_service.files().create(body=file_metadata, media_body=media, fields="id, webViewLink").execute()
+    file = _gs_call(drive_service.files().create(body=file_metadata, media_body=media, fields="id, webViewLink").execute, api="drive")
     
     # Hacer el archivo público para visualización
     try:
@@ -2015,7 +3028,7 @@ def subir_a_drive(uploaded_file, cliente_id=None, cliente_nombre=""):
             'type': 'anyone',
             'role': 'reader'
         }
-        drive_service.permissions().create(fileId=file.get('id'), body=permission).execute()
+        _gs_call(drive_service.permissions().create(fileId=file.get('id'), body=permission).execute, api="drive")
     except:
         pass  # Si no se puede hacer público, continuar
     
@@ -2187,61 +3200,95 @@ def listar_docs_cliente(cid: str):
 
 def nuevo_id_cliente(df: pd.DataFrame) -> str:
     """
-    Genera un nuevo ID de cliente único con prefijo 'C' basado en los IDs existentes del DataFrame.
-    Si no encuentra IDs del formato C<number>, comienza en C1000.
+    Genera un nuevo ID de cliente único con prefijo 'C' (contador persistente, ver reservar_ids).
+    Los ids de `df` que aún no estén guardados tampoco se repiten. Comienza en C1000.
     """
-    base_id = 1000
-    try:
-        if df is not None and not df.empty and "id" in df.columns:
-            nums = []
-            for x in df["id"].astype(str):
-                if not x:
-                    continue
-                m = re.match(r"^C(\d+)$", str(x).strip())
-                if m:
-                    try:
-                        nums.append(int(m.group(1)))
-                    except Exception:
-                        continue
-            if nums:
-                base_id = max(nums) + 1
-            else:
-                # fallback: avoid collision con filas existentes
-                base_id = base_id + len(df)
-    except Exception:
-        base_id = base_id
-    return f"C{base_id}"
+    existentes = df["id"] if (df is not None and not df.empty and "id" in df.columns) else None
+    return reservar_ids(1, existentes)[0]
+
+# --- Búsqueda de clientes por id ---
+# Índice hash id -> posición de fila, construido una vez por versión de los datos; los
+# selectbox llaman get_nombre_by_id en su format_func por cada opción, así que cada consulta
+# debe ser O(1). Con ids repetidos gana la primera fila (igual que el filtro original).
+# Las consultas usan el índice de la carga vigente en el caché compartido (cada guardado
+# sube la versión), no el df_cli del script, que se reasigna a mitad del rerun.
+class _IndiceClientes:
+    """Posición por id y columnas como arreglos de texto para consultas directas."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.n = len(df)
+        self.ids = df["id"].astype(str).to_numpy() if "id" in df.columns else np.array([], dtype=object)
+        # Recorrido inverso: las primeras apariciones sobrescriben a las repetidas
+        self._pos = dict(zip(self.ids[::-1], range(self.n - 1, -1, -1)))
+        self._df = df
+        self._columnas: dict = {}   # campo -> ndarray de texto (se arma al primer uso)
+
+    def _columna(self, campo: str):
+        col = self._columnas.get(campo)
+        if col is None and campo in self._df.columns:
+            col = self._df[campo].fillna("").astype(str).to_numpy()
+            self._columnas[campo] = col
+        return col
+
+    def posicion(self, cid) -> int:
+        return self._pos.get(str(cid), -1)
+
+    def get_field(self, cid, campo: str) -> str:
+        i = self.posicion(cid)
+        col = self._columna(campo)
+        return str(col[i]) if (i >= 0 and col is not None) else ""
+
+    def get_fields(self, ids, campos) -> pd.DataFrame:
+        """DataFrame indexado por los ids pedidos con una columna por campo ('' si no existe)."""
+        ids = [str(x) for x in ids]
+        pos = np.fromiter((self._pos.get(x, -1) for x in ids), dtype=np.int64, count=len(ids))
+        faltan = pos < 0
+        out = {}
+        for campo in campos:
+            col = self._columna(campo)
+            if col is None or not len(col):
+                out[campo] = np.full(len(ids), "", dtype=object)
+                continue
+            valores = col[np.where(faltan, 0, pos)].astype(object)
+            valores[faltan] = ""
+            out[campo] = valores
+        return pd.DataFrame(out, index=pd.Index(ids, name="id"))
+
+def indice_clientes(df: pd.DataFrame | None = None) -> _IndiceClientes:
+    """Índice por id: sin argumentos, de la última carga (memorizado por versión); con `df`, ad hoc."""
+    if df is not None:
+        return _IndiceClientes(df)
+    cache = _data_cache()
+    indice = cache.get(f"ids:{_clave_datos(None)}")
+    if indice is None:
+        base = cargar_clientes()
+        clave = _clave_datos(None)  # la carga pudo refrescar la versión
+        indice = _IndiceClientes(base)
+        cache.invalidate("ids:")
+        cache.put(f"ids:{clave}", indice)
+    return indice
 
 def get_nombre_by_id(cid: str) -> str:
     """Retorna el nombre del cliente por id de forma segura ('' si no existe)."""
-    try:
-        if cid is None or cid == "":
-            return ""
-        if 'id' not in df_cli.columns or df_cli.empty:
-            return ""
-        sel = df_cli.loc[df_cli['id'] == cid, 'nombre']
-        if sel is None or sel.empty:
-            return ""
-        return str(sel.values[0])
-    except Exception:
-        return ""
+    return get_field_by_id(cid, "nombre")
 
 def get_field_by_id(cid: str, field: str) -> str:
     """Retorna el valor de `field` para el cliente `cid` de forma segura ('' si no existe)."""
     try:
         if cid is None or cid == "":
             return ""
-        if 'id' not in df_cli.columns or df_cli.empty:
-            return ""
-        if field not in df_cli.columns:
-            return ""
-        sel = df_cli.loc[df_cli['id'] == cid, field]
-        if sel is None or sel.empty:
-            return ""
-        return str(sel.values[0])
+        return indice_clientes().get_field(cid, field)
     except Exception:
         return ""
 
+def get_fields(ids, fields) -> pd.DataFrame:
+    """Consulta por lote: DataFrame indexado por id con las columnas `fields` ('' si no existe)."""
+    try:
+        return indice_clientes().get_fields(ids, fields)
+    except Exception:
+        pass
+    return pd.DataFrame({f: [""] * len(ids) for f in fields}, index=pd.Index([str(x) for x in ids], name="id"))
+
 # --- NEW: búsquedas rápidas y cacheadas (preindexado) ---
 @st.cache_data(show_spinner=False)
 def build_text_index(options: list[str]):
@@ -2552,21 +3599,347 @@ COLUMNS = [
     "score","telefono","correo","analista","fuente"
 ]
 
+# === ALMACENAMIENTO LOCAL (SQLite, modo WAL) ===
+# Una fila por id; las escrituras son upserts de las filas que cambiaron.
+# CSV/XLSX dejan de reescribirse en cada guardado: son exportaciones bajo demanda.
+DB_INDEX_COLUMNS = ["estatus", "sucursal", "asesor", "fuente", "fecha_ingreso", "fecha_dispersion"]
+
+@st.cache_resource(show_spinner=False)
+def _db_resource(db_path: str):
+    """Conexión única por proceso a la base local y lock que serializa su uso entre sesiones."""
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    cols_sql = ", ".join(f'"{c}" TEXT NOT NULL DEFAULT \'\'' for c in COLUMNS if c != "id")
+    conn.execute(f"CREATE TABLE IF NOT EXISTS clientes (id TEXT PRIMARY KEY, {cols_sql}, _updated_at TEXT)")
+    # Columnas agregadas a COLUMNS después de crear la base
+    existentes = {r[1] for r in conn.execute("PRAGMA table_info(clientes)")}
+    for c in COLUMNS:
+        if c not in existentes:
+            conn.execute(f'ALTER TABLE clientes ADD COLUMN "{c}" TEXT NOT NULL DEFAULT \'\'')
+    for c in DB_INDEX_COLUMNS:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_clientes_{c} ON clientes("{c}")')
+    # Mapa id -> fila física en la hoja de clientes (evita descargar la hoja para ubicar filas)
+    conn.execute("CREATE TABLE IF NOT EXISTS sheet_rowmap (id TEXT PRIMARY KEY, fila INTEGER NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS sheet_meta (clave TEXT PRIMARY KEY, valor TEXT NOT NULL)")
+    # Cola persistente de sincronización con Google Sheets (coalescida por id)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS sync_queue (id TEXT PRIMARY KEY, op TEXT NOT NULL, encolado REAL NOT NULL, "
+        "intentos INTEGER NOT NULL DEFAULT 0, proximo_intento REAL NOT NULL DEFAULT 0, ultimo_error TEXT NOT NULL DEFAULT '')"
+    )
+    # Contadores monótonos persistentes (último id 'C<n>' asignado)
+    conn.execute("CREATE TABLE IF NOT EXISTS secuencias (nombre TEXT PRIMARY KEY, valor INTEGER NOT NULL)")
+    conn.commit()
+    return conn, threading.RLock()
+
+def _db():
+    """(conexión, lock) de la base local configurada en CLIENTES_DB."""
+    return _db_resource(str(CLIENTES_DB))
+
+def db_leer_clientes() -> pd.DataFrame:
+    """Lee todos los clientes de la base local en orden de alta."""
+    conn, lock = _db()
+    cols = ", ".join(f'"{c}"' for c in COLUMNS)
+    with lock:
+        df = pd.read_sql_query(f"SELECT {cols} FROM clientes ORDER BY rowid", conn)
+    return df.fillna("").astype(str)
+
+def db_contar_clientes() -> int:
+    conn, lock = _db()
+    with lock:
+        return int(conn.execute("SELECT COUNT(*) FROM clientes").fetchone()[0])
+
+# --- Asignación de ids de cliente ---
+# Un contador persistente en SQLite entrega ids 'C<n>' consecutivos sin recorrer la base:
+# se siembra una sola vez con el mayor id existente y de ahí sólo avanza. Las reservas
+# verifican por llave primaria que los ids no existan (altas hechas por otra instancia
+# directamente en la hoja) y, si chocan, saltan después del mayor id usado.
+ID_PREFIJO = "C"
+ID_INICIAL = 1000
+
+def _max_id_numerico(ids) -> int:
+    """Mayor n de los ids con formato C<n> (ID_INICIAL - 1 si no hay ninguno), vectorizado."""
+    nums = pd.Series(ids, dtype=object).fillna("").astype(str).str.strip().str.extract(r"^C(\d+)$")[0]
+    nums = pd.to_numeric(nums, errors="coerce").dropna()
+    return int(nums.max()) if not nums.empty else ID_INICIAL - 1
+
+def reservar_ids(n: int = 1, existentes=None) -> list[str]:
+    """
+    Reserva `n` ids consecutivos (un bloque para importaciones masivas).
+    existentes: ids que aún no están en la base local y tampoco deben repetirse.
+    """
+    if n <= 0:
+        return []
+    externos = pd.Series(existentes, dtype=object).fillna("").astype(str).str.strip() if existentes is not None else pd.Series([], dtype=object)
+    try:
+        conn, lock = _db()
+        with lock, conn:
+            fila = conn.execute("SELECT valor FROM secuencias WHERE nombre = 'clientes'").fetchone()
+            if fila is None:
+                # Primera reserva: sembrar con el mayor id de la base local
+                ids_db = [r[0] for r in conn.execute(f"SELECT id FROM clientes WHERE id GLOB '{ID_PREFIJO}[0-9]*'")]
+                actual = _max_id_numerico(ids_db)
+            else:
+                actual = int(fila[0])
+            for _ in range(2):
+                candidatos = [f"{ID_PREFIJO}{actual + i}" for i in range(1, n + 1)]
+                choque = bool(externos.isin(candidatos).any())
+                for i in range(0, n, 500):
+                    lote = candidatos[i:i + 500]
+                    marcas = ",".join("?" * len(lote))
+                    if conn.execute(f"SELECT 1 FROM clientes WHERE id IN ({marcas}) LIMIT 1", lote).fetchone():
+                        choque = True
+                        break
+                if not choque:
+                    break
+                # Saltar después del mayor id usado (sólo ocurre si alguien asignó ids por fuera)
+                ids_db = [r[0] for r in conn.execute(f"SELECT id FROM clientes WHERE id GLOB '{ID_PREFIJO}[0-9]*'")]
+                actual = max(actual, _max_id_numerico(ids_db), _max_id_numerico(externos))
+            conn.execute("INSERT OR REPLACE INTO secuencias (nombre, valor) VALUES ('clientes', ?)", (actual + n,))
+        return candidatos
+    except Exception:
+        # Sin base local: continuar después del mayor id conocido
+        inicio = _max_id_numerico(externos) + 1
+        return [f"{ID_PREFIJO}{inicio + i}" for i in range(n)]
+
+def _db_sql_upsert(df: pd.DataFrame) -> tuple[str, list]:
+    """SQL de INSERT ... ON CONFLICT(id) y las filas con id de `df` (sin ejecutar)."""
+    cols = COLUMNS + ["_updated_at"]
+    nombres = ", ".join(f'"{c}"' for c in cols)
+    marcas = ", ".join("?" for _ in cols)
+    asignaciones = ", ".join(f'"{c}"=excluded."{c}"' for c in cols if c != "id")
+    sql = f"INSERT INTO clientes ({nombres}) VALUES ({marcas}) ON CONFLICT(id) DO UPDATE SET {asignaciones}"
+    if df is None or df.empty:
+        return sql, []
+    df = _ensure_columns(df, COLUMNS)
+    df = df[df["id"].str.strip() != ""]
+    ts = pd.Timestamp.now().isoformat()
+    return sql, [tuple(r) + (ts,) for r in df[COLUMNS].itertuples(index=False, name=None)]
+
+def db_upsert_clientes(df: pd.DataFrame) -> int:
+    """Inserta o actualiza por id las filas de `df` en una sola transacción. Retorna filas escritas."""
+    sql, rows = _db_sql_upsert(df)
+    if not rows:
+        return 0
+    conn, lock = _db()
+    with lock, conn:
+        conn.executemany(sql, rows)
+    return len(rows)
+
+def db_eliminar_clientes(ids) -> int:
+    """Borra de la base local los ids indicados."""
+    ids = [str(i) for i in ids if str(i).strip()]
+    if not ids:
+        return 0
+    conn, lock = _db()
+    with lock, conn:
+        conn.executemany("DELETE FROM clientes WHERE id = ?", [(i,) for i in ids])
+    return len(ids)
+
+def db_reemplazar_clientes(df: pd.DataFrame) -> int:
+    """Reemplaza el contenido de la base local (hidratación desde Google Sheets o archivos heredados)."""
+    # DELETE e INSERT en la misma transacción: si la escritura falla, la base queda como estaba
+    sql, rows = _db_sql_upsert(df)
+    conn, lock = _db()
+    with lock, conn:
+        conn.execute("DELETE FROM clientes")
+        if rows:
+            conn.executemany(sql, rows)
+    return len(rows)
+
+def _hash_filas(df: pd.DataFrame) -> pd.Series:
+    """Hash de 64 bits por fila sobre COLUMNS (vectorizado), indexado por id."""
+    h = pd.util.hash_pandas_object(df[COLUMNS], index=False)
+    return pd.Series(h.to_numpy(), index=df["id"].to_numpy())
+
+def diff_clientes(base: pd.DataFrame, nuevo: pd.DataFrame) -> dict:
+    """
+    Diferencia vectorizada entre dos versiones de la base, unidas por id.
+    Retorna {"insertados": [...], "actualizados": [...], "eliminados": [...]} (listas de ids).
+    Filas sin id se ignoran; con ids repetidos gana la última aparición.
+    """
+    def _preparar(df):
+        df = _ensure_columns(df if df is not None else pd.DataFrame(columns=COLUMNS), COLUMNS)
+        df = df[df["id"].str.strip() != ""]
+        return _hash_filas(df.drop_duplicates("id", keep="last"))
+
+    hb = _preparar(base)
+    hn = _preparar(nuevo)
+    comunes = hn.index.intersection(hb.index)
+    distintos = hn.loc[comunes].to_numpy() != hb.loc[comunes].to_numpy()
+    return {
+        "insertados": hn.index.difference(hb.index, sort=False).tolist(),
+        "actualizados": comunes[distintos].tolist(),
+        "eliminados": hb.index.difference(hn.index, sort=False).tolist(),
+    }
+
+def _rangos_contiguos(filas) -> list[tuple[int, int]]:
+    """Agrupa números de fila en tramos contiguos: [2,3,4,9] -> [(2,4),(9,9)]."""
+    arr = np.unique(np.asarray(list(filas), dtype=np.int64))
+    if arr.size == 0:
+        return []
+    cortes = np.flatnonzero(np.diff(arr) != 1)
+    inicios = np.concatenate(([arr[0]], arr[cortes + 1]))
+    fines = np.concatenate((arr[cortes], [arr[-1]]))
+    return [(int(a), int(b)) for a, b in zip(inicios, fines)]
+
+def _col_letra(n: int) -> str:
+    """Letra de columna A1 para el número de columna 1-based (1 -> A, 27 -> AA)."""
+    letras = ""
+    while n > 0:
+        n, r = divmod(n - 1, 26)
+        letras = chr(65 + r) + letras
+    return letras
+
+def _filas_cambiadas(base: pd.DataFrame, nuevo: pd.DataFrame) -> tuple[pd.DataFrame, list]:
+    """
+    Compara dos versiones de la base por id.
+    Retorna (filas de `nuevo` que son nuevas o cambiaron, ids que ya no están en `nuevo`).
+    """
+    nuevo = _ensure_columns(nuevo, COLUMNS)
+    dif = diff_clientes(base, nuevo)
+    cambiadas = nuevo[nuevo["id"].isin(dif["insertados"] + dif["actualizados"])]
+    return cambiadas, dif["eliminados"]
+
+def exportar_clientes_csv() -> bytes:
+    """Exporta la base local a CSV (también deja copia en data/clientes.csv)."""
+    data = db_leer_clientes().to_csv(index=False).encode("utf-8")
+    try:
+        CLIENTES_CSV.write_bytes(data)
+    except Exception:
+        pass
+    return data
+
+def _motor_excel() -> str | None:
+    """'xlsxwriter' u 'openpyxl' según lo instalado (None si no hay ninguno)."""
+    try:
+        import xlsxwriter  # type: ignore
+        return "xlsxwriter"
+    except Exception:
+        try:
+            import openpyxl  # type: ignore
+            return "openpyxl"
+        except Exception:
+            return None
+
+def exportar_clientes_xlsx() -> bytes | None:
+    """Exporta la base local a XLSX (también deja copia en data/clientes.xlsx). None si no hay motor Excel."""
+    engine = _motor_excel()
+    if engine is None:
+        return None
+    bio = io.BytesIO()
+    with pd.ExcelWriter(bio, engine=engine) as writer:
+        db_leer_clientes().to_excel(writer, index=False, sheet_name="Clientes")
+    data = bio.getvalue()
+    try:
+        CLIENTES_XLSX.write_bytes(data)
+    except Exception:
+        pass
+    return data
+
+# --- Exportaciones Excel de los clientes filtrados (bajo demanda) ---
+EXPORTACIONES_MAX = 4   # libros generados que se conservan en memoria
+
+def _nombre_hoja(nombre: str) -> str:
+    """Nombre válido de pestaña de Excel (máximo 31 caracteres, sin / \\ * ? : [ ])."""
+    hoja = str(nombre)[:31] if nombre else "Sin_asesor"
+    for ch in '/\\*?:[]':
+        hoja = hoja.replace(ch, "_")
+    return hoja
+
+def excel_clientes_filtrados(df: pd.DataFrame) -> bytes | None:
+    """Libro con una sola hoja 'Filtrados' ordenada por fechas. None si no hay motor Excel."""
+    engine = _motor_excel()
+    if engine is None:
+        return None
+    try:
+        df_export = sort_df_by_dates(df, snapshot_clientes()) if not df.empty else df.copy()
+    except Exception:
+        df_export = df.copy()
+    bio = io.BytesIO()
+    with pd.ExcelWriter(bio, engine=engine) as writer:
+        try:
+            df_export.to_excel(writer, index=False, sheet_name="Filtrados")
+        except Exception:
+            # fallback: intentar convertir todo a strings y volver a escribir
+            df_export.astype(str).to_excel(writer, index=False, sheet_name="Filtrados")
+    return bio.getvalue()
+
+def excel_por_asesores(df: pd.DataFrame) -> bytes | None:
+    """
+    Libro con una pestaña por asesor (un solo groupby). Con xlsxwriter se escribe fila por fila
+    en modo constant_memory; con openpyxl se usa pandas. None si no hay motor o no hay filas.
+    """
+    engine = _motor_excel()
+    if engine is None or df.empty or "asesor" not in df.columns:
+        return None
+    try:
+        df_export = sort_df_by_dates(df, snapshot_clientes())
+    except Exception:
+        df_export = df.copy()
+    df_export["asesor"] = df_export["asesor"].fillna("").replace({"": "(Sin asesor)"})
+    fechas = [c for c in df_export.columns if pd.api.types.is_datetime64_any_dtype(df_export[c])]
+    columnas = list(df_export.columns)
+    bio = io.BytesIO()
+    if engine == "xlsxwriter":
+        import xlsxwriter  # type: ignore
+        libro = xlsxwriter.Workbook(bio, {"constant_memory": True})
+        formato_fecha = libro.add_format({"num_format": "yyyy-mm-dd"})
+        encabezado = libro.add_format({"bold": True})
+        pos_fechas = [columnas.index(c) for c in fechas]
+        for asesor, grupo in df_export.groupby("asesor", sort=True):
+            try:
+                hoja = libro.add_worksheet(_nombre_hoja(asesor))
+            except Exception:
+                # Nombre repetido tras recortar/limpiar: se omite la pestaña
+                continue
+            hoja.write_row(0, 0, columnas, encabezado)
+            valores = grupo.astype(object).where(grupo.notna(), "").to_numpy()
+            for r, fila in enumerate(valores, start=1):
+                # Las fechas van aparte con formato; en constant_memory cada fila se escribe completa y en orden
+                fechas_fila = [(j, fila[j]) for j in pos_fechas]
+                fila = list(fila)
+                for j in pos_fechas:
+                    fila[j] = None
+                hoja.write_row(r, 0, fila)
+                for j, valor in fechas_fila:
+                    if valor != "":
+                        hoja.write_datetime(r, j, valor.to_pydatetime(), formato_fecha)
+        libro.close()
+    else:
+        with pd.ExcelWriter(bio, engine=engine) as writer:
+            for asesor, grupo in df_export.groupby("asesor", sort=True):
+                try:
+                    grupo.to_excel(writer, index=False, sheet_name=_nombre_hoja(asesor))
+                except Exception:
+                    continue
+    return bio.getvalue()
+
+@st.cache_resource(show_spinner=False)
+def _exportaciones_excel() -> _VistasFiltradas:
+    """LRU único por proceso de libros Excel por (tipo, versión de datos, filtros)."""
+    return _VistasFiltradas(maximo=EXPORTACIONES_MAX)
+
+def exportacion_excel(tipo: str, df: pd.DataFrame, clave_vista: tuple | None = None) -> bytes | None:
+    """Libro 'filtrados' o 'asesores' memorizado por la clave de la vista (sin clave no se memoriza)."""
+    construir = (lambda: excel_por_asesores(df)) if tipo == "asesores" else (lambda: excel_clientes_filtrados(df))
+    if clave_vista is None:
+        return construir()
+    return _exportaciones_excel().obtener((tipo,) + clave_vista, construir)
+
 def cargar_clientes(force_reload: bool = False) -> pd.DataFrame:
     """
-    Lee primero de Google Sheets con caché inteligente
+    Lee la base local (SQLite) con caché compartido; Google Sheets sólo se consulta
+    cuando la base local está vacía o se fuerza la recarga (y entonces la hidrata).
     force_reload: True para forzar recarga desde Google Sheets
     """
-    global _CLIENTES_CACHE, _CLIENTES_CACHE_TIME
-    
-    import time
-    now = time.time()
-    cache_duration = 3  # segundos
+    cache = _data_cache()
     
-    # Usar caché si es reciente y no se fuerza recarga
-    if not force_reload and _CLIENTES_CACHE is not None:
-        if (now - _CLIENTES_CACHE_TIME) < cache_duration:
-            return _CLIENTES_CACHE.copy()
+    # Usar la instantánea compartida si es reciente y no se fuerza recarga
+    if not force_reload:
+        cached = cache.get("clientes")
+        if cached is not None:
+            return cached.copy()
     
     def _ensure_cols(df: pd.DataFrame) -> pd.DataFrame:
         df = df.copy().fillna("")
@@ -2575,17 +3948,43 @@ def cargar_clientes(force_reload: bool = False) -> pd.DataFrame:
                 df[c] = ""
         return df[[c for c in COLUMNS if c in df.columns]]
 
-    # 1) Intentar Google Sheets
+    def _desde_db():
+        try:
+            if db_contar_clientes() > 0:
+                return db_leer_clientes()
+        except Exception:
+            pass
+        return None
+
+    # 1) Base local (sistema de registro)
+    if not force_reload:
+        result = _desde_db()
+        if result is not None:
+            cache.put("clientes", result.copy())
+            return result
+
+    # 2) Google Sheets (primer arranque o recarga forzada)
     if USE_GSHEETS:
         try:
-            ws = _gs_open_worksheet(GSHEET_TAB, force_reload=force_reload)
-            if ws is None:
-                raise Exception("No connection")
-                
-            df = get_as_dataframe(ws, evaluate_formulas=True, dtype=str, header=0).dropna(how="all")
+            # La precarga de arranque ya trae la hoja (se usa una sola vez)
+            df = None if force_reload else cache.get("misc:hoja_clientes")
+            if df is not None:
+                cache.invalidate("misc:hoja_clientes")
+            else:
+                ws = _gs_open_worksheet(GSHEET_TAB, force_reload=force_reload)
+                if ws is None:
+                    raise Exception("No connection")
+                df = _gs_call(get_as_dataframe, ws, evaluate_formulas=True, dtype=str, header=0).dropna(how="all")
             if df is None or df.empty:
                 df = pd.DataFrame(columns=COLUMNS)
             else:
+                # La lectura completa deja el mapa id -> fila al día sin costo extra
+                try:
+                    _rowmap_desde_df(df.fillna(""))
+                except Exception:
+                    pass
+                # Ocultar clientes con borrado lógico pendiente de compactar
+                df = _filtrar_eliminados(df.fillna(""))
                 # Mostrar mensaje solo al iniciar sesión
                 if 'gs_first_load' not in st.session_state:
                     st.session_state['gs_first_load'] = True
@@ -2598,42 +3997,63 @@ def cargar_clientes(force_reload: bool = False) -> pd.DataFrame:
             
             result = df[COLUMNS].astype(str).fillna("")
             
+            # Hidratar la base local (una hoja vacía nunca borra la base local)
+            if not result.empty:
+                try:
+                    # Lo que sigue en la cola aún no llega a la hoja: prevalece la versión local
+                    pend = sync_pendientes()
+                    if pend["upsert"] or pend["delete"]:
+                        local = db_leer_clientes()
+                        result = pd.concat([
+                            result[~result["id"].isin(pend["upsert"] | pend["delete"])],
+                            local[local["id"].isin(pend["upsert"])],
+                        ], ignore_index=True)
+                    db_reemplazar_clientes(result)
+                except Exception:
+                    pass
+            else:
+                local = _desde_db()
+                if local is not None:
+                    result = local
+            
             # Actualizar caché
-            _CLIENTES_CACHE = result.copy()
-            _CLIENTES_CACHE_TIME = now
+            cache.put("clientes", result.copy())
             
             return result
         except Exception as e:
             if 'gs_first_load' not in st.session_state:
                 st.warning(f"⚠️ No se pudo cargar desde Google Sheets, usando datos locales")
 
-    # 2) Fallback a archivos locales
-    try:
-        if CLIENTES_XLSX.exists():
-            df = pd.read_excel(CLIENTES_XLSX, dtype=str).fillna("")
-            result = _ensure_cols(df)
-            _CLIENTES_CACHE = result.copy()
-            _CLIENTES_CACHE_TIME = now
-            return result
-    except Exception:
-        pass
+    # 3) Fallback: base local aunque se haya pedido recarga
+    result = _desde_db()
+    if result is not None:
+        cache.put("clientes", result.copy())
+        return result
 
-    try:
-        if CLIENTES_CSV.exists():
-            df = pd.read_csv(CLIENTES_CSV, dtype=str).fillna("")
-            result = _ensure_cols(df)
-            _CLIENTES_CACHE = result.copy()
-            _CLIENTES_CACHE_TIME = now
-            return result
-    except Exception:
-        pass
+    # 4) Archivos heredados (CSV/XLSX): se migran a la base local
+    for path, reader in ((CLIENTES_XLSX, pd.read_excel), (CLIENTES_CSV, pd.read_csv)):
+        try:
+            if path.exists():
+                df = reader(path, dtype=str).fillna("")
+                result = _ensure_cols(df)
+                try:
+                    db_upsert_clientes(result)
+                except Exception:
+                    pass
+                cache.put("clientes", result.copy())
+                return result
+        except Exception:
+            pass
 
     return pd.DataFrame(columns=COLUMNS)
 
-def guardar_clientes(df: pd.DataFrame):
-    """Guarda la base y actualiza caché"""
-    global _CLIENTES_CACHE, _CLIENTES_CACHE_TIME
-    
+def guardar_clientes(df: pd.DataFrame, base: pd.DataFrame | None = None):
+    """
+    Guarda en la base local sólo las filas que cambiaron y actualiza caché.
+    base: versión de la que partió quien edita; si se indica, las filas que ya no están
+    en `df` se borran y las que no tocó no pisan cambios concurrentes de otros usuarios.
+    Sin base se compara contra la base local y no se borra nada.
+    """
     try:
         if df is None:
             return
@@ -2643,37 +4063,31 @@ def guardar_clientes(df: pd.DataFrame):
                 df[c] = ""
         df_to_save = df[[c for c in COLUMNS if c in df.columns]].copy().fillna("").astype(str)
 
-        # CSV (local)
-        df_to_save.to_csv(CLIENTES_CSV, index=False, encoding="utf-8")
+        # La llave primaria exige id: asignar uno a las filas que no lo tengan
+        if (df_to_save["id"].str.strip() == "").any():
+            df_to_save = _fix_missing_or_duplicate_ids(df_to_save)
 
-        # XLSX (respaldo)
+        # Upsert de filas nuevas/modificadas (y borrado explícito cuando hay base)
+        referencia = base if base is not None else db_leer_clientes()
+        cambiadas, eliminados = _filas_cambiadas(referencia, df_to_save)
+        db_upsert_clientes(cambiadas)
+        # Catálogo de asesores: sólo los nombres que no se habían visto
         try:
-            engine = None
-            try:
-                import xlsxwriter
-                engine = "xlsxwriter"
-            except Exception:
-                try:
-                    import openpyxl
-                    engine = "openpyxl"
-                except Exception:
-                    engine = None
-
-            if engine:
-                with pd.ExcelWriter(CLIENTES_XLSX, engine=engine) as writer:
-                    df_to_save.to_excel(writer, index=False, sheet_name="Clientes")
+            _catalogo_asesores().registrar(cambiadas["asesor"])
         except Exception:
             pass
+        if base is not None and eliminados:
+            db_eliminar_clientes(eliminados)
 
-        # Actualizar caché inmediatamente
-        import time
-        _CLIENTES_CACHE = df_to_save.copy()
-        _CLIENTES_CACHE_TIME = time.time()
+        # Actualizar caché inmediatamente (write-through: nueva versión de "clientes")
+        _data_cache().put("clientes", db_leer_clientes())
 
-        # Google Sheets (async, sin bloquear)
+        # Google Sheets: encolar y regresar (el worker sube en segundo plano)
         if USE_GSHEETS:
             try:
-                guardar_clientes_gsheet_append(df_to_save)
+                sync_encolar(cambiadas["id"].tolist(), op="upsert")
+                if base is not None and eliminados:
+                    sync_encolar(eliminados, op="delete")
             except Exception:
                 pass
 
@@ -2691,87 +4105,395 @@ def _ensure_columns(df: pd.DataFrame, cols: list[str]) -> pd.DataFrame:
             df[c] = ""
     return df[cols].astype(str).fillna("")
 
+# --- Borrado lógico en la hoja de clientes ---
+# Borrar un cliente sólo marca la celda "eliminado" de su fila (una escritura, sin desplazar
+# filas); las lecturas ocultan esas filas y la compactación periódica las quita físicamente
+# con un solo batchUpdate de deleteDimension.
+GSHEET_TOMBSTONE_COL = "eliminado"
+SHEET_COLUMNS = COLUMNS + [GSHEET_TOMBSTONE_COL]
+SYNC_COMPACTAR_MIN = 50            # marcas pendientes que disparan la compactación
+SYNC_COMPACTAR_INTERVALO = 3600.0  # segundos; con alguna marca pendiente se compacta al menos así de seguido
+
+def _filtrar_eliminados(df: pd.DataFrame) -> pd.DataFrame:
+    """Quita las filas con marca de borrado y la columna de la marca."""
+    if df is None or df.empty or GSHEET_TOMBSTONE_COL not in df.columns:
+        return df
+    marca = df[GSHEET_TOMBSTONE_COL].fillna("").astype(str).str.strip()
+    return df[marca == ""].drop(columns=[GSHEET_TOMBSTONE_COL])
+
 def _sheet_to_df(ws) -> pd.DataFrame:
-    dfsh = get_as_dataframe(ws, evaluate_formulas=True, dtype=str, header=0).dropna(how="all")
+    dfsh = _gs_call(get_as_dataframe, ws, evaluate_formulas=True, dtype=str, header=0).dropna(how="all")
     if dfsh is None or dfsh.empty:
         return pd.DataFrame()
-    return dfsh.fillna("").astype(str)
+    return _filtrar_eliminados(dfsh.fillna("").astype(str))
+
+# --- Mapa id -> fila de la hoja de clientes ---
+# Se guarda en la base local junto con la última fila con datos. Antes de escribir se hace un
+# chequeo barato (batch_get de las celdas A de las filas objetivo + la fila siguiente a la última
+# conocida); si no coincide, se reconstruye leyendo sólo la columna A.
+
+def _rowmap_leer() -> tuple[dict, int | None]:
+    conn, lock = _db()
+    with lock:
+        filas = dict(conn.execute("SELECT id, fila FROM sheet_rowmap").fetchall())
+        meta = conn.execute("SELECT valor FROM sheet_meta WHERE clave = 'ultima_fila'").fetchone()
+    return filas, (int(meta[0]) if meta else None)
+
+def _rowmap_guardar(filas: dict, ultima_fila: int):
+    conn, lock = _db()
+    with lock, conn:
+        conn.execute("DELETE FROM sheet_rowmap")
+        conn.executemany("INSERT OR REPLACE INTO sheet_rowmap (id, fila) VALUES (?, ?)", [(str(k), int(v)) for k, v in filas.items()])
+        conn.execute("INSERT OR REPLACE INTO sheet_meta (clave, valor) VALUES ('ultima_fila', ?)", (str(int(ultima_fila)),))
+
+def _rowmap_invalidar():
+    conn, lock = _db()
+    with lock, conn:
+        conn.execute("DELETE FROM sheet_meta WHERE clave = 'ultima_fila'")
+
+def _marcas_pendientes() -> int:
+    """Filas marcadas como eliminadas desde la última compactación (según esta instancia)."""
+    conn, lock = _db()
+    with lock:
+        meta = conn.execute("SELECT valor FROM sheet_meta WHERE clave = 'marcas'").fetchone()
+    return int(meta[0]) if meta else 0
+
+def _marcas_sumar(n: int | None):
+    """Suma n marcas pendientes; None reinicia el contador (tras compactar)."""
+    conn, lock = _db()
+    with lock, conn:
+        if n is None:
+            conn.execute("INSERT OR REPLACE INTO sheet_meta (clave, valor) VALUES ('marcas', '0')")
+        else:
+            conn.execute(
+                "INSERT INTO sheet_meta (clave, valor) VALUES ('marcas', ?) "
+                "ON CONFLICT(clave) DO UPDATE SET valor = CAST(CAST(valor AS INTEGER) + ? AS TEXT)",
+                (str(int(n)), int(n)),
+            )
+
+def _rowmap_desde_df(df_hoja: pd.DataFrame):
+    """Reconstruye el mapa a partir de una lectura completa (etiqueta de get_as_dataframe = fila - 2)."""
+    if df_hoja is None or df_hoja.empty or "id" not in df_hoja.columns:
+        return
+    ids = df_hoja["id"].astype(str).str.strip()
+    if GSHEET_TOMBSTONE_COL in df_hoja.columns:
+        ids = ids[df_hoja[GSHEET_TOMBSTONE_COL].astype(str).str.strip() == ""]
+    filas = {cid: int(lbl) + 2 for lbl, cid in ids.items() if cid}
+    _rowmap_guardar(filas, int(df_hoja.index.max()) + 2)
+
+def _rowmap_reconstruir(ws) -> tuple[dict, int]:
+    """Reconstruye el mapa leyendo sólo la columna de ids y la de marcas de borrado."""
+    col_marca = _col_letra(len(SHEET_COLUMNS))
+    rangos = _gs_call(ws.batch_get, ["A:A", f"{col_marca}:{col_marca}"], major_dimension="COLUMNS")
+    valores = list(rangos[0][0]) if rangos and rangos[0] else []
+    marcas = list(rangos[1][0]) if len(rangos) > 1 and rangos[1] else []
+    filas = {}
+    for fila, cid in enumerate(valores[1:], start=2):
+        cid = str(cid).strip()
+        marcada = fila - 1 < len(marcas) and str(marcas[fila - 1]).strip() != ""
+        if cid and not marcada:
+            filas[cid] = fila
+    ultima = len(valores)
+    _rowmap_guardar(filas, ultima)
+    return filas, ultima
+
+def _rowmap_verificar(ws, filas: dict, ultima: int, ids_objetivo) -> bool:
+    """Chequeo de consistencia: ids esperados en sus filas y nada escrito después de la última fila conocida."""
+    objetivo = [i for i in ids_objetivo if i in filas]
+    rangos = [f"A{filas[i]}" for i in objetivo] + [f"A{ultima + 1}"]
+    valores = []
+    for i in range(0, len(rangos), 200):
+        valores += _gs_call(ws.batch_get, rangos[i:i+200])
+    def _celda(v):
+        try:
+            return str(v[0][0]).strip() if v and v[0] else ""
+        except Exception:
+            return ""
+    if any(_celda(v) != cid for cid, v in zip(objetivo, valores[:-1])):
+        return False
+    return _celda(valores[-1]) == ""
+
+def _fila_inicial_append(respuesta) -> int | None:
+    """Primera fila escrita por append_rows (de updates.updatedRange, p.ej. 'clientes!A120:Q125')."""
+    try:
+        rango = respuesta["updates"]["updatedRange"]
+        return int(re.search(r"![A-Z]+(\d+)", rango).group(1))
+    except Exception:
+        return None
+
+def _gs_aplicar_clientes(df_upserts: pd.DataFrame, ids_eliminar=()):
+    """
+    Aplica en la hoja de clientes un lote de upserts y borrados sin descargar la hoja:
+    las filas se ubican con el mapa id -> fila (verificado antes de escribir). Los borrados
+    sólo marcan la columna "eliminado", así que ninguna fila cambia de número.
+    Lanza excepción si la API falla para que la cola de sincronización reintente el lote.
+    """
+    ws = _gs_open_worksheet(GSHEET_TAB)
+    if ws is None:
+        raise RuntimeError("Sin conexión con Google Sheets")
+
+    df_nuevo = _ensure_columns(df_upserts if df_upserts is not None else pd.DataFrame(), COLUMNS)
+    df_nuevo = df_nuevo[df_nuevo["id"].str.strip() != ""].drop_duplicates("id", keep="last").set_index("id", drop=False)
+    ids_eliminar = {str(i) for i in ids_eliminar if str(i).strip()}
+
+    # Asegurar encabezado (se verifica una vez y queda en caché con el worksheet)
+    cache = _data_cache()
+    clave_encabezado = f"worksheet:{GSHEET_TAB}:encabezado"
+    if cache.get(clave_encabezado) is None:
+        header_norm = [str(h).strip() for h in _gs_call(ws.row_values, 1)]
+        if header_norm[:len(SHEET_COLUMNS)] != SHEET_COLUMNS:
+            _gs_call(ws.update, "A1", [SHEET_COLUMNS])
+        cache.put(clave_encabezado, True)
+
+    filas, ultima = _rowmap_leer()
+    if ultima is None:
+        filas, ultima = _rowmap_reconstruir(ws)
+    elif not _rowmap_verificar(ws, filas, ultima, list(df_nuevo.index) + list(ids_eliminar)):
+        filas, ultima = _rowmap_reconstruir(ws)
+
+    # Hoja sin datos: escribir la base local completa (una sola vez)
+    if ultima <= 1:
+        df_full = db_leer_clientes()
+        df_full = df_full[~df_full["id"].isin(ids_eliminar)].reset_index(drop=True)
+        df_full[GSHEET_TOMBSTONE_COL] = ""
+        if not df_full.empty:
+            _gs_call(set_with_dataframe, ws, df_full, include_index=False, include_column_header=True, resize=True, costo=GS_COSTO_SET_DATAFRAME)
+        _rowmap_guardar({cid: i + 2 for i, cid in df_full["id"].items()}, len(df_full) + 1)
+        return
+
+    df_nuevo[GSHEET_TOMBSTONE_COL] = ""
+    updates = []
+
+    # 1) Actualizados: un rango por tramo de filas contiguas (la marca de borrado se limpia)
+    existentes = [cid for cid in df_nuevo.index if cid in filas]
+    if existentes:
+        id_por_fila = pd.Series(existentes, index=[filas[cid] for cid in existentes]).sort_index()
+        ultima_col = _col_letra(len(SHEET_COLUMNS))
+        for ini, fin in _rangos_contiguos(id_por_fila.index):
+            ids_tramo = id_por_fila.loc[ini:fin].tolist()
+            updates.append({
+                "range": f"A{ini}:{ultima_col}{fin}",
+                "values": df_nuevo.loc[ids_tramo, SHEET_COLUMNS].values.tolist(),
+            })
+
+    # 2) Eliminados: sólo se escribe la marca; las filas no se mueven
+    filas_borrar = sorted(filas[cid] for cid in ids_eliminar if cid in filas)
+    if filas_borrar:
+        col_marca = _col_letra(len(SHEET_COLUMNS))
+        marca = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for ini, fin in _rangos_contiguos(filas_borrar):
+            updates.append({
+                "range": f"{col_marca}{ini}:{col_marca}{fin}",
+                "values": [[marca]] * (fin - ini + 1),
+            })
+
+    # Batch update (máximo 100 rangos por lote para evitar límites de API)
+    for i in range(0, len(updates), 100):
+        _gs_call(ws.batch_update, updates[i:i+100], value_input_option="RAW")
+    if filas_borrar:
+        filas = {cid: f for cid, f in filas.items() if cid not in ids_eliminar}
+        _rowmap_guardar(filas, ultima)
+        _marcas_sumar(len(filas_borrar))
+
+    # 3) Nuevos: append en lote; el mapa se completa con el rango que reporta la API
+    nuevos_ids = [cid for cid in df_nuevo.index if cid not in filas and cid not in ids_eliminar]
+    if nuevos_ids:
+        respuesta = _gs_call(ws.append_rows, df_nuevo.loc[nuevos_ids, SHEET_COLUMNS].values.tolist(), value_input_option="RAW")
+        inicio = _fila_inicial_append(respuesta)
+        if inicio is None:
+            _rowmap_invalidar()
+            return
+        for k, cid in enumerate(nuevos_ids):
+            filas[cid] = inicio + k
+        ultima = max(ultima, inicio + len(nuevos_ids) - 1)
+        _rowmap_guardar(filas, ultima)
+
+def _gs_compactar_clientes() -> int:
+    """
+    Quita físicamente las filas marcadas como eliminadas con un solo batchUpdate
+    (deleteDimension por tramo contiguo, de abajo hacia arriba) y reconstruye el mapa.
+    Retorna cuántas filas se quitaron. Debe correr sin lotes de sincronización en curso.
+    """
+    ws = _gs_open_worksheet(GSHEET_TAB)
+    if ws is None:
+        raise RuntimeError("Sin conexión con Google Sheets")
+    marcas = _gs_call(ws.col_values, len(SHEET_COLUMNS))
+    filas = [fila for fila, v in enumerate(marcas[1:], start=2) if str(v).strip()]
+    if filas:
+        requests = [
+            {"deleteDimension": {"range": {
+                "sheetId": ws.id, "dimension": "ROWS", "startIndex": int(ini) - 1, "endIndex": int(fin),
+            }}}
+            for ini, fin in reversed(_rangos_contiguos(filas))
+        ]
+        _gs_call(ws.spreadsheet.batch_update, {"requests": requests})
+        _rowmap_reconstruir(ws)
+    _marcas_sumar(None)
+    return len(filas)
 
 def guardar_clientes_gsheet_append(df_nuevo: pd.DataFrame):
-    """Versión optimizada: solo actualiza filas modificadas"""
+    """Versión optimizada: solo actualiza filas modificadas (síncrona, silenciosa ante errores)"""
     if df_nuevo is None or df_nuevo.empty:
         return
+    try:
+        _gs_aplicar_clientes(df_nuevo)
+    except Exception:
+        pass
 
+# === COLA DE SINCRONIZACIÓN CON GOOGLE SHEETS (write-behind) ===
+# guardar_clientes confirma en SQLite y sólo encola los ids afectados; un hilo de fondo
+# vacía la cola por lotes. La cola vive en la misma base, así que sobrevive a reinicios,
+# y se coalesce por id: varios guardados del mismo cliente se suben una sola vez.
+SYNC_LOTE = 200              # ids por lote
+SYNC_INTERVALO = 2.0         # segundos entre revisiones de la cola
+SYNC_BACKOFF_BASE = 5.0      # segundos; se duplica en cada intento fallido
+SYNC_BACKOFF_MAX = 300.0
+
+def sync_encolar(ids, op: str = "upsert"):
+    """Encola ids para subir ('upsert') o borrar ('delete') en Google Sheets."""
+    if not USE_GSHEETS:
+        return
+    ids = [str(i) for i in ids if str(i).strip()]
+    if not ids:
+        return
+    ahora = time.time()
+    conn, lock = _db()
+    with lock, conn:
+        conn.executemany(
+            "INSERT INTO sync_queue (id, op, encolado, intentos, proximo_intento, ultimo_error) VALUES (?, ?, ?, 0, 0, '') "
+            "ON CONFLICT(id) DO UPDATE SET op=excluded.op, encolado=excluded.encolado, proximo_intento=0",
+            [(i, op, ahora) for i in ids],
+        )
     try:
-        ws = _gs_open_worksheet(GSHEET_TAB)
-        if ws is None:
-            return
-            
-        df_nuevo = _ensure_columns(df_nuevo, COLUMNS)
+        _sync_worker().despertar()
+    except Exception:
+        pass
 
-        # Asegurar encabezado
-        try:
-            header_row = ws.row_values(1)
-            header_norm = [str(h).strip() for h in header_row]
-            if header_norm[:len(COLUMNS)] != COLUMNS:
-                ws.update("A1", [COLUMNS])
-        except Exception:
-            ws.update("A1", [COLUMNS])
+def sync_pendientes() -> dict:
+    """ids en cola por operación: {"upsert": set, "delete": set}."""
+    conn, lock = _db()
+    with lock:
+        filas = conn.execute("SELECT id, op FROM sync_queue").fetchall()
+    out = {"upsert": set(), "delete": set()}
+    for cid, op in filas:
+        out.setdefault(op, set()).add(cid)
+    return out
+
+def sync_estado() -> dict:
+    """Resumen de la cola para la interfaz."""
+    conn, lock = _db()
+    with lock:
+        pendientes, con_error = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(intentos > 0), 0) FROM sync_queue"
+        ).fetchone()
+        ultimo = conn.execute(
+            "SELECT ultimo_error FROM sync_queue WHERE ultimo_error != '' ORDER BY encolado DESC LIMIT 1"
+        ).fetchone()
+    worker = _sync_worker()
+    return {
+        "pendientes": int(pendientes or 0),
+        "con_error": int(con_error or 0),
+        "ultimo_error": ultimo[0] if ultimo else "",
+        "ultimo_vaciado": worker.ultimo_vaciado,
+        "subidos": worker.subidos,
+    }
 
-        df_actual = _sheet_to_df(ws)
-        
-        # Si la hoja está vacía, usar set_with_dataframe (una sola vez)
-        if df_actual.empty:
+class _SheetsSyncWorker:
+    """Hilo de fondo que vacía sync_queue hacia Google Sheets con reintentos y backoff exponencial."""
+
+    def __init__(self):
+        self._evento = threading.Event()
+        self._vaciando = threading.Lock()
+        self.ultimo_vaciado = None
+        self.subidos = 0
+        self.ultima_compactacion = time.time()
+        self._hilo = threading.Thread(target=self._loop, name="crm-sheets-sync", daemon=True)
+        self._hilo.start()
+
+    def despertar(self):
+        self._evento.set()
+
+    def _loop(self):
+        while True:
+            self._evento.wait(SYNC_INTERVALO)
+            self._evento.clear()
             try:
-                set_with_dataframe(ws, df_nuevo, include_index=False, include_column_header=True, resize=True)
+                while self.vaciar() >= SYNC_LOTE:
+                    pass
             except Exception:
                 pass
-            return
-        
-        df_actual = _ensure_columns(df_actual, COLUMNS)
-
-        # Índices por ID para detección eficiente
-        idx_actual = {str(r["id"]): i for i, r in df_actual.reset_index(drop=True).iterrows() if str(r["id"]).strip() != ""}
-        idx_nuevo  = {str(r["id"]): i for i, r in df_nuevo.reset_index(drop=True).iterrows() if str(r["id"]).strip() != ""}
-
-        # 1) Nuevos: append en lote
-        nuevos_ids = [i for i in idx_nuevo.keys() if i not in idx_actual]
-        if nuevos_ids:
-            rows_to_append = df_nuevo.loc[df_nuevo["id"].astype(str).isin(nuevos_ids), COLUMNS].values.tolist()
             try:
-                ws.append_rows(rows_to_append, value_input_option="RAW")
+                marcas = _marcas_pendientes()
+                vencida = time.time() - self.ultima_compactacion >= SYNC_COMPACTAR_INTERVALO
+                if marcas >= SYNC_COMPACTAR_MIN or (marcas and vencida):
+                    self.compactar()
             except Exception:
                 pass
 
-        # 2) Actualizados: batch update (más eficiente)
-        comunes_ids = [i for i in idx_nuevo.keys() if i in idx_actual]
-        if comunes_ids:
-            updates = []
-            for _id in comunes_ids:
-                row_new = df_nuevo.loc[idx_nuevo[_id], COLUMNS]
-                row_old = df_actual.loc[idx_actual[_id], COLUMNS]
-                if not row_new.equals(row_old):
-                    fila = idx_actual[_id] + 2  # +2 por encabezado (1-indexed)
-                    # Calcular letra de última columna (ej: P para 16 columnas)
-                    import string
-                    col_letter = string.ascii_uppercase[len(COLUMNS) - 1] if len(COLUMNS) <= 26 else 'Z'
-                    rango = f"A{fila}:{col_letter}{fila}"
-                    updates.append({
-                        "range": rango,
-                        "values": [row_new.tolist()]
-                    })
-
-            # Batch update (máximo 100 por lote para evitar límites de API)
-            if updates:
-                try:
-                    for i in range(0, len(updates), 100):
-                        batch = updates[i:i+100]
-                        ws.batch_update(batch, value_input_option="RAW")
-                except Exception:
-                    pass
-                    
-    except Exception:
-        pass
+    def compactar(self) -> int:
+        """Compacta la hoja sin lotes en curso (las filas sólo se mueven aquí)."""
+        with self._vaciando, _gs_carril("fondo"):
+            n = _gs_compactar_clientes()
+            self.ultima_compactacion = time.time()
+            return n
+
+    def vaciar(self) -> int:
+        """Sube un lote de la cola. Retorna cuántos ids se procesaron (0 si no había pendientes)."""
+        with self._vaciando, _gs_carril("fondo"):
+            conn, lock = _db()
+            ahora = time.time()
+            with lock:
+                lote = conn.execute(
+                    "SELECT id, op, encolado FROM sync_queue WHERE proximo_intento <= ? ORDER BY encolado LIMIT ?",
+                    (ahora, SYNC_LOTE),
+                ).fetchall()
+            if not lote:
+                return 0
+            ids_upsert = [cid for cid, op, _ in lote if op == "upsert"]
+            ids_delete = [cid for cid, op, _ in lote if op == "delete"]
+            try:
+                df = db_leer_clientes()
+                _gs_aplicar_clientes(df[df["id"].isin(ids_upsert)], ids_delete)
+            except Exception as e:
+                error = str(e)[:300]
+                with lock, conn:
+                    conn.executemany(
+                        "UPDATE sync_queue SET intentos = intentos + 1, ultimo_error = ?, "
+                        "proximo_intento = ? + MIN(?, ? * (1 << MIN(intentos, 16))) WHERE id = ?",
+                        [(error, ahora, SYNC_BACKOFF_MAX, SYNC_BACKOFF_BASE, cid) for cid, _, _ in lote],
+                    )
+                return 0
+            # Sólo se retiran los ids que no se volvieron a encolar mientras se subía el lote
+            with lock, conn:
+                conn.executemany(
+                    "DELETE FROM sync_queue WHERE id = ? AND encolado = ?",
+                    [(cid, enc) for cid, _, enc in lote],
+                )
+            self.ultimo_vaciado = time.time()
+            self.subidos += len(lote)
+            return len(lote)
+
+@st.cache_resource(show_spinner=False)
+def _sync_worker() -> _SheetsSyncWorker:
+    """Worker único por proceso (arranca al primer uso)."""
+    return _SheetsSyncWorker()
+
+def compactar_clientes_gsheet() -> int:
+    """Sube lo pendiente y quita de la hoja las filas marcadas como eliminadas. Retorna filas quitadas."""
+    sync_vaciar_ahora()
+    return _sync_worker().compactar()
+
+def sync_vaciar_ahora() -> int:
+    """Ignora el backoff pendiente y vacía la cola en este hilo. Retorna ids subidos."""
+    conn, lock = _db()
+    with lock, conn:
+        conn.execute("UPDATE sync_queue SET proximo_intento = 0")
+    total = 0
+    while True:
+        n = _sync_worker().vaciar()
+        total += n
+        if n < SYNC_LOTE:
+            return total
 
 # Función cargar_y_corregir_clientes optimizada
 # Función cargar_y_corregir_clientes optimizada
@@ -2797,125 +4519,217 @@ def cargar_y_corregir_clientes(force_reload: bool = False) -> pd.DataFrame:
 
 # Función para arreglar IDs duplicados/vacíos
 def _fix_missing_or_duplicate_ids(df: pd.DataFrame) -> pd.DataFrame:
-    """Corrige IDs vacíos o duplicados en el DataFrame"""
+    """Corrige IDs vacíos o duplicados (se conserva la primera aparición) con un bloque de ids nuevos."""
     if df is None or df.empty:
         return df
-    
-    df_fixed = df.copy()
-    
-    # Generar IDs únicos para registros sin ID o con ID vacío
-    for idx, row in df_fixed.iterrows():
-        if pd.isna(row.get('id')) or str(row.get('id')).strip() == '':
-            # Generar nuevo ID único
-            existing_ids = set(df_fixed['id'].dropna().astype(str))
-            counter = 1000
-            while f"C-{counter}" in existing_ids:
-                counter += 1
-            df_fixed.at[idx, 'id'] = f"C-{counter}"
-    
-    return df_fixed
+    df = df.copy()
+    if "id" not in df.columns:
+        df["id"] = ""
+    ids = df["id"].fillna("").astype(str).str.strip()
+    malos = (ids == "") | ids.duplicated(keep="first")
+    if malos.any():
+        df.loc[malos, "id"] = reservar_ids(int(malos.sum()), ids[~malos])
+    return df
 
-# Funciones de historial
-HIST_COLUMNS_DEFAULT = ["fecha","accion","id","nombre","detalle","usuario"]
+# ---------- Historial y eliminación de clientes ----------
+HISTORIAL_CSV = DATA_DIR / "historial.csv"                      # formato heredado (sólo lectura/migración)
+HISTORIAL_JOURNAL = DATA_DIR / "historial.jsonl"                # diario append-only (JSON Lines)
+HISTORIAL_SNAPSHOT = DATA_DIR / "historial_compacto.parquet"    # compactado columnar (CSV si no hay pyarrow)
+HIST_COLUMNS = ["id", "nombre", "estatus_old", "estatus_new", "segundo_old", "segundo_new", "observaciones", "action", "actor", "ts"]
+HIST_FSYNC_EVENTOS = 50        # fsync cada N eventos...
+HIST_FSYNC_SEGUNDOS = 2.0      # ...o si pasó este tiempo desde el último
+HIST_COMPACTAR_EVENTOS = 2000  # eventos en el diario antes de compactar
+
+class _HistJournal:
+    """
+    Diario append-only del historial (una línea JSON por evento).
+    Cada append cuesta O(eventos nuevos): se escribe y se hace flush; el fsync se agrupa
+    por número de eventos o tiempo para no pagar un fsync por evento.
+    """
 
-def append_historial_gsheet(evento: dict):
-    """ Agrega un registro al historial (una fila nueva) """
-    if not USE_GSHEETS:
-        return
-        
-    try:
-        ws = _gs_open_worksheet(GSHEET_HISTTAB)
-        if ws is None:
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.lock = threading.RLock()
+        self._fh = None
+        self._pendientes = 0
+        self._ultimo_fsync = time.time()
+        self.eventos = None  # líneas en el diario (se cuenta al primer uso)
+        atexit.register(self.sync)
+
+    def _handle(self):
+        if self._fh is None or self._fh.closed:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._fh = open(self.path, "a", encoding="utf-8")
+        return self._fh
+
+    def contar(self) -> int:
+        with self.lock:
+            if self.eventos is None:
+                try:
+                    with open(self.path, "rb") as f:
+                        self.eventos = sum(1 for _ in f)
+                except FileNotFoundError:
+                    self.eventos = 0
+            return self.eventos
+
+    def append(self, registros: list[dict]):
+        if not registros:
             return
-            
-        df_actual = _sheet_to_df(ws)
-        if df_actual.empty:
+        lineas = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in registros)
+        with self.lock:
+            self.contar()
+            fh = self._handle()
+            fh.write(lineas)
+            fh.flush()
+            self.eventos += len(registros)
+            self._pendientes += len(registros)
+            if self._pendientes >= HIST_FSYNC_EVENTOS or (time.time() - self._ultimo_fsync) >= HIST_FSYNC_SEGUNDOS:
+                self.sync()
+
+    def sync(self):
+        with self.lock:
             try:
-                ws.update(values=[HIST_COLUMNS_DEFAULT], range_name="A1")
+                if self._fh is not None and not self._fh.closed and self._pendientes:
+                    os.fsync(self._fh.fileno())
             except Exception:
                 pass
-        fila = [str(evento.get(col, "")) for col in HIST_COLUMNS_DEFAULT]
+            self._pendientes = 0
+            self._ultimo_fsync = time.time()
+
+    def leer(self) -> list[dict]:
+        with self.lock:
+            if self._fh is not None and not self._fh.closed:
+                self._fh.flush()
+            registros = []
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    for linea in f:
+                        linea = linea.strip()
+                        if not linea:
+                            continue
+                        try:
+                            registros.append(json.loads(linea))
+                        except Exception:
+                            pass  # línea incompleta por un corte abrupto: se ignora
+            except FileNotFoundError:
+                pass
+            self.eventos = len(registros)
+            return registros
+
+    def truncar(self):
+        with self.lock:
+            fh = self._handle()
+            fh.flush()
+            fh.truncate(0)
+            os.fsync(fh.fileno())
+            self._pendientes = 0
+            self.eventos = 0
+
+@st.cache_resource(show_spinner=False)
+def _hist_journal_resource(path: str) -> _HistJournal:
+    """Un solo escritor del diario por proceso (compartido entre sesiones)."""
+    return _HistJournal(path)
+
+def _hist_journal() -> _HistJournal:
+    return _hist_journal_resource(str(HISTORIAL_JOURNAL))
+
+def _parquet_disponible() -> bool:
+    try:
+        import pyarrow  # type: ignore
+        return True
+    except Exception:
+        return False
+
+def _hist_ensure_cols(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy() if df is not None else pd.DataFrame()
+    for c in HIST_COLUMNS:
+        if c not in df.columns:
+            df[c] = ""
+    return df[HIST_COLUMNS].fillna("").astype(str)
+
+def _leer_snapshot_historial() -> pd.DataFrame:
+    """Lee el compactado (parquet o CSV); si nunca se compactó, parte del historial.csv heredado."""
+    for path in (HISTORIAL_SNAPSHOT, HISTORIAL_SNAPSHOT.with_suffix(".csv")):
         try:
-            ws.append_rows([fila], value_input_option="RAW")
+            if path.exists():
+                if path.suffix == ".parquet":
+                    return _hist_ensure_cols(pd.read_parquet(path))
+                return _hist_ensure_cols(pd.read_csv(path, dtype=str))
         except Exception:
             pass
+    try:
+        if HISTORIAL_CSV.exists():
+            return _hist_ensure_cols(pd.read_csv(HISTORIAL_CSV, dtype=str))
+    except Exception:
+        pass
+    return pd.DataFrame(columns=HIST_COLUMNS)
+
+def _escribir_snapshot_historial(df: pd.DataFrame):
+    """Escribe el compactado de forma atómica (archivo temporal + reemplazo)."""
+    usar_parquet = _parquet_disponible()
+    path = HISTORIAL_SNAPSHOT if usar_parquet else HISTORIAL_SNAPSHOT.with_suffix(".csv")
+    tmp = path.with_name(path.name + ".tmp")
+    df = _hist_ensure_cols(df)
+    if usar_parquet:
+        df.to_parquet(tmp, index=False)
+    else:
+        df.to_csv(tmp, index=False, encoding="utf-8")
+    os.replace(tmp, path)
+    # No dejar un compactado del otro formato que pudiera leerse después
+    otro = HISTORIAL_SNAPSHOT.with_suffix(".csv") if usar_parquet else HISTORIAL_SNAPSHOT
+    try:
+        if otro.exists():
+            otro.unlink()
     except Exception:
         pass
 
-# Función append_historial local
-    """Corrige IDs vacíos o duplicados en el DataFrame"""
-    if df is None or df.empty:
-        return df
-    df = df.copy()
-    if "id" not in df.columns:
-        df["id"] = ""
-
-    usados = set()
-    def _nuevo_id_local(_df):
-        base_id = 1000
+def leer_historial_local() -> pd.DataFrame:
+    """Historial local completo: compactado + eventos del diario posteriores a la compactación."""
+    journal = _hist_journal()
+    with journal.lock:
+        base = _leer_snapshot_historial()
+        nuevos = journal.leer()
+    if not nuevos:
+        return base
+    return pd.concat([base, _hist_ensure_cols(pd.DataFrame(nuevos))], ignore_index=True)
+
+def compactar_historial(df: pd.DataFrame | None = None):
+    """
+    Reescribe el compactado con el historial completo (o con `df` si se indica, p.ej. al
+    borrar eventos) y vacía el diario.
+    """
+    journal = _hist_journal()
+    with journal.lock:
+        if df is None:
+            df = leer_historial_local()
+        _escribir_snapshot_historial(df)
+        journal.truncar()
+    _data_cache().invalidate("historial")
+
+def append_historial_local(registros: list[dict]):
+    """Agrega eventos al diario local; compacta cuando el diario crece demasiado."""
+    journal = _hist_journal()
+    journal.append([{c: str(r.get(c, "") or "") for c in HIST_COLUMNS} for r in registros])
+    if journal.contar() >= HIST_COMPACTAR_EVENTOS:
         try:
-            if not _df.empty and "id" in _df.columns:
-                nums = []
-                for x in _df["id"].astype(str):
-                    if str(x).startswith("C"):
-                        try:
-                            nums.append(int(str(x).lstrip("C")))
-                        except Exception:
-                            continue
-                if nums:
-                    base_id = max(nums) + 1
-                else:
-                    base_id = base_id + len(_df) + 1
+            compactar_historial()
         except Exception:
-            base_id = base_id + 1
-        return f"C{base_id}"
-
-    for i in df.index:
-        cur = str(df.at[i, "id"]).strip()
-        if not cur or cur in usados:
-            # genera ID nuevo que no choque con usados ni con el df
-            nuevo = _nuevo_id_local(df)
-            while nuevo in usados or (df["id"] == nuevo).any():
-                try:
-                    num = int(nuevo[1:]) + 1
-                except Exception:
-                    num = 1000
-                nuevo = f"C{num}"
-            df.at[i, "id"] = nuevo
-            usados.add(nuevo)
-        else:
-            usados.add(cur)
-    return df
-
-# ---------- Historial y eliminación de clientes ----------
-HISTORIAL_CSV = DATA_DIR / "historial.csv"
+            pass
 
-def cargar_historial(force_reload: bool = False) -> pd.DataFrame:
+def _historial_desde_gsheet() -> pd.DataFrame:
     """
-    Lee el historial desde Google Sheets (prioritario) o CSV local como respaldo.
-    Usa caché inteligente para evitar cargas repetitivas.
-    Retorna DataFrame con columnas esperadas si no existe.
+    Lee el historial de Google Sheets (espejo del historial local) en el formato interno.
+    Retorna DataFrame vacío si no hay datos o falla la lectura.
     """
-    global _HISTORIAL_CACHE, _HISTORIAL_CACHE_TIME
-    
-    # Verificar caché (3-5 segundos de duración)
-    import time
-    now = time.time()
-    cache_duration = 4  # segundos
-    
-    if not force_reload and _HISTORIAL_CACHE is not None and (now - _HISTORIAL_CACHE_TIME) < cache_duration:
-        return _HISTORIAL_CACHE.copy()
-    
     # Columnas estándar del historial
-    cols = ["id", "nombre", "estatus_old", "estatus_new", "segundo_old", "segundo_new", "observaciones", "action", "actor", "ts"]
+    cols = HIST_COLUMNS
     
-    # Intentar cargar desde Google Sheets primero
     if USE_GSHEETS:
         try:
             ws = _gs_open_worksheet(GSHEET_HISTTAB)
             if ws:
                 # Obtener todos los datos de la hoja
-                data = ws.get_all_records()
+                data = _gs_call(ws.get_all_records)
                 if data:
                     dfh = pd.DataFrame(data).fillna("").astype(str)
                     
@@ -2968,112 +4782,166 @@ def cargar_historial(force_reload: bool = False) -> pd.DataFrame:
                         except Exception:
                             pass
                         
-                        # Actualizar caché
-                        result = dfh_formatted[cols].copy()
-                        _HISTORIAL_CACHE = result.copy()
-                        _HISTORIAL_CACHE_TIME = now
-                        return result
+                        return dfh_formatted[cols].copy()
         except Exception:
-            pass  # Si falla Google Sheets, usar CSV local
+            pass
+    return pd.DataFrame(columns=cols)
+
+def cargar_historial(force_reload: bool = False) -> pd.DataFrame:
+    """
+    Lee el historial local (compactado + diario) con caché compartido; Google Sheets sólo
+    se consulta cuando el historial local está vacío (primer arranque) y entonces lo hidrata.
+    force_reload: True para ignorar el caché y releer el historial local.
+    """
+    cache = _data_cache()
+    
+    # Verificar caché compartido (se invalida explícitamente en append_historial)
+    if not force_reload:
+        cached = cache.get("historial")
+        if cached is not None:
+            return cached.copy()
     
-    # Respaldo: cargar desde CSV local
+    # 1) Historial local (sistema de registro)
     try:
-        if HISTORIAL_CSV.exists():
-            dfh = pd.read_csv(HISTORIAL_CSV, dtype=str).fillna("")
-            for c in cols:
-                if c not in dfh.columns:
-                    dfh[c] = ""
-            result = dfh[cols].copy()
-            # Actualizar caché también para CSV
-            _HISTORIAL_CACHE = result.copy()
-            _HISTORIAL_CACHE_TIME = now
-            return result
+        result = leer_historial_local()[HIST_COLUMNS].copy()
     except Exception:
-        pass
+        result = pd.DataFrame(columns=HIST_COLUMNS)
+    
+    # 2) Primer arranque: hidratar el historial local desde Google Sheets
+    if result.empty:
+        remoto = _historial_desde_gsheet()
+        if not remoto.empty:
+            journal = _hist_journal()
+            with journal.lock:
+                # Otra sesión pudo registrar eventos mientras se leía la hoja
+                result = leer_historial_local()[HIST_COLUMNS].copy()
+                if result.empty:
+                    try:
+                        compactar_historial(remoto)
+                    except Exception:
+                        pass
+                    result = remoto
     
-    # Si todo falla, retornar DataFrame vacío
-    result = pd.DataFrame(columns=cols)
-    _HISTORIAL_CACHE = result.copy()
-    _HISTORIAL_CACHE_TIME = now
+    cache.put("historial", result.copy())
     return result
 
-def append_historial_gsheet(evento: dict):
+def append_historial_gsheet_many(eventos: list[dict]):
     """
-    Versión global para registrar historial en Google Sheets.
-    Se crea si no existe encabezado y luego se hace append.
+    Registra varios eventos en Google Sheets con una sola llamada append_rows.
+    El encabezado se verifica una vez y queda en caché junto con el worksheet.
     Silenciosa ante cualquier excepción.
     """
-    if not USE_GSHEETS:
+    if not USE_GSHEETS or not eventos:
         return
     try:
         ws = _gs_open_worksheet(GSHEET_HISTTAB)
+        if ws is None:
+            return
         headers = ["fecha","accion","id","nombre","detalle","usuario"]
-        try:
-            existing_header = ws.row_values(1)
-        except Exception:
-            existing_header = []
-        if not existing_header:
+        cache = _data_cache()
+        clave_encabezado = f"worksheet:{GSHEET_HISTTAB}:encabezado"
+        if cache.get(clave_encabezado) is None:
             try:
-                ws.update("A1", [headers])
+                existing_header = _gs_call(ws.row_values, 1)
             except Exception:
-                pass
-        fila = [str(evento.get(col, "")) for col in headers]
+                existing_header = []
+            if not existing_header:
+                try:
+                    _gs_call(ws.update, "A1", [headers])
+                except Exception:
+                    pass
+            cache.put(clave_encabezado, True)
+        filas = [[str(evento.get(col, "")) for col in headers] for evento in eventos]
         try:
-            ws.append_rows([fila], value_input_option="RAW")
+            _gs_call(ws.append_rows, filas, value_input_option="RAW")
         except Exception:
             pass
     except Exception:
         pass
 
-def append_historial(cid: str, nombre: str, estatus_old: str, estatus_new: str, seg_old: str, seg_new: str, observaciones: str = "", action: str = "ESTATUS MODIFICADO", actor: str | None = None):
+def append_historial_gsheet(evento: dict):
     """
-    Agrega una fila al historial de estatus (archivo CSV).
-    action: 'crear'|'modificar'|'eliminar'|'importar' u otro texto libre.
-    actor: nombre de usuario que realizó la acción; si no se pasa, se toma el usuario actual.
+    Versión global para registrar historial en Google Sheets.
+    Se crea si no existe encabezado y luego se hace append.
+    Silenciosa ante cualquier excepción.
+    """
+    append_historial_gsheet_many([evento])
+
+def evento_historial(cid: str, nombre: str, estatus_old: str = "", estatus_new: str = "", seg_old: str = "", seg_new: str = "", observaciones: str = "", action: str = "ESTATUS MODIFICADO", actor: str | None = None) -> dict:
+    """Arma un evento de historial (mismos argumentos que append_historial) para append_historial_many."""
+    return {
+        "id": cid,
+        "nombre": nombre,
+        "estatus_old": estatus_old,
+        "estatus_new": estatus_new,
+        "segundo_old": seg_old,
+        "segundo_new": seg_new,
+        "observaciones": observaciones,
+        "action": action,
+        "actor": actor,
+    }
+
+def append_historial_many(eventos: list[dict]):
+    """
+    Registra todos los eventos de una misma acción del usuario (guardado masivo, importación,
+    alta con documentos): un solo append al diario local y una sola llamada a Google Sheets.
+    eventos: dicts armados con evento_historial(); actor None = usuario actual.
     """
     try:
-        if actor is None:
-            cu = current_user() or {}
-            actor = cu.get("user") or cu.get("email") or "(sistema)"
-
-        registro = {
-            "id": cid,
-            "nombre": nombre or "",
-            "estatus_old": estatus_old or "",
-            "estatus_new": estatus_new or "",
-            "segundo_old": seg_old or "",
-            "segundo_new": seg_new or "",
-            "observaciones": observaciones or "",
-            "action": action or "",
-            "actor": actor or "",
-            "ts": pd.Timestamp.now().isoformat()
-        }
-        if HISTORIAL_CSV.exists():
-            dfh = cargar_historial()
-            dfh = pd.concat([dfh, pd.DataFrame([registro])], ignore_index=True)
-        else:
-            dfh = pd.DataFrame([registro])
-        dfh.to_csv(HISTORIAL_CSV, index=False, encoding="utf-8")
-        # También intentar escribir en Google Sheets (modo append) si está habilitado
+        eventos = [e for e in (eventos or []) if e]
+        if not eventos:
+            return
+        ts = pd.Timestamp.now().isoformat()
+        actor_actual = None
+        registros = []
+        for e in eventos:
+            actor = e.get("actor")
+            if actor is None:
+                if actor_actual is None:
+                    cu = current_user() or {}
+                    actor_actual = cu.get("user") or cu.get("email") or "(sistema)"
+                actor = actor_actual
+            registros.append({
+                "id": e.get("id", "") or "",
+                "nombre": e.get("nombre", "") or "",
+                "estatus_old": e.get("estatus_old", "") or "",
+                "estatus_new": e.get("estatus_new", "") or "",
+                "segundo_old": e.get("segundo_old", "") or "",
+                "segundo_new": e.get("segundo_new", "") or "",
+                "observaciones": e.get("observaciones", "") or "",
+                "action": e.get("action", "") or "",
+                "actor": actor or "",
+                "ts": e.get("ts") or ts,
+            })
+        # Append O(eventos) al diario local (sin releer ni reescribir el historial)
+        append_historial_local(registros)
+        # También escribir en Google Sheets (una sola llamada) si está habilitado
         if USE_GSHEETS:
             try:
-                evento = {
-                    "fecha": registro.get("ts", ""),
-                    "accion": registro.get("action", ""),
-                    "id": registro.get("id", ""),
-                    "nombre": registro.get("nombre", ""),
-                    "detalle": registro.get("observaciones", ""),
-                    "usuario": registro.get("actor", "")
-                }
-                try:
-                    append_historial_gsheet(evento)
-                except Exception:
-                    pass
+                append_historial_gsheet_many([{
+                    "fecha": r["ts"],
+                    "accion": r["action"],
+                    "id": r["id"],
+                    "nombre": r["nombre"],
+                    "detalle": r["observaciones"],
+                    "usuario": r["actor"],
+                } for r in registros])
             except Exception:
                 pass
     except Exception:
         # no bloquear la app por errores de historial
         pass
+    finally:
+        # La siguiente lectura debe ver los nuevos eventos
+        _data_cache().invalidate("historial")
+
+def append_historial(cid: str, nombre: str, estatus_old: str, estatus_new: str, seg_old: str, seg_new: str, observaciones: str = "", action: str = "ESTATUS MODIFICADO", actor: str | None = None):
+    """
+    Agrega una fila al historial de estatus (diario local append-only + Google Sheets).
+    action: 'crear'|'modificar'|'eliminar'|'importar' u otro texto libre.
+    actor: nombre de usuario que realizó la acción; si no se pasa, se toma el usuario actual.
+    """
+    append_historial_many([evento_historial(cid, nombre, estatus_old, estatus_new, seg_old, seg_new, observaciones, action, actor)])
 
 def eliminar_cliente(cid: str, df: pd.DataFrame, borrar_historial: bool = False) -> pd.DataFrame:
     """
@@ -3093,55 +4961,15 @@ def eliminar_cliente(cid: str, df: pd.DataFrame, borrar_historial: bool = False)
 
         # Eliminar de df
         df_new = df[df["id"] != cid].reset_index(drop=True)
-        guardar_clientes(df_new)
+        guardar_clientes(df_new, base=df)
 
-        # --- NUEVO: eliminar también de la hoja de Google Sheets (si está habilitado) ---
-        if USE_GSHEETS:
-            try:
-                ws = _gs_open_worksheet(GSHEET_TAB)
-                vals = ws.get_all_values()
-                if vals and len(vals) > 0:
-                    header = [str(h).strip() for h in vals[0]]
-                    # buscar índice de la columna 'id' (case/acentos tolerantemente)
-                    id_col = None
-                    for idx, h in enumerate(header):
-                        if _norm_key(h) == _norm_key("id"):
-                            id_col = idx
-                            break
-                    if id_col is not None:
-                        rows_to_delete = []
-                        # recorrer filas de datos (vals[1:] corresponde a filas físicas a partir de la 2)
-                        for i in range(1, len(vals)):
-                            try:
-                                cell = vals[i][id_col] if id_col < len(vals[i]) else ""
-                            except Exception:
-                                cell = ""
-                            if str(cell).strip() == str(cid):
-                                # i -> índice en vals; la fila en la hoja es i+1 (1-based)
-                                rows_to_delete.append(i + 1)
-                        # borrar de abajo hacia arriba para no invalidar índices
-                        for rownum in sorted(rows_to_delete, reverse=True):
-                            try:
-                                ws.delete_rows(rownum)
-                            except Exception:
-                                # fallback no crítico: intentar limpiar la fila en lugar de borrarla
-                                try:
-                                    # limpiar un rango amplio (A..Z) para evitar errores si delete_rows falla
-                                    ws.update(f"A{rownum}:Z{rownum}", [[""] * 26])
-                                except Exception:
-                                    pass
-            except Exception:
-                # silenciar cualquier error de GSheets para no romper la app
-                pass
-        # -------------------------------------------------------
+        # La hoja de Google Sheets se actualiza desde la cola (guardar_clientes encola el borrado)
 
         # Borrar historial asociado si se solicita
         if borrar_historial:
             try:
-                if HISTORIAL_CSV.exists():
-                    dfh = cargar_historial()
-                    dfh = dfh[dfh["id"] != cid].reset_index(drop=True)
-                    dfh.to_csv(HISTORIAL_CSV, index=False, encoding="utf-8")
+                dfh = leer_historial_local()
+                compactar_historial(dfh[dfh["id"] != cid].reset_index(drop=True))
             except Exception:
                 pass
 
@@ -3154,8 +4982,6 @@ import secrets
 import base64
 
 USERS_FILE = DATA_DIR / "users.json"   # { "users":[{"user": "...", "role":"admin|member", "salt":"...", "hash":"..."}] }
-# Google Sheets tab name for users
-GSHEET_USERSTAB = "users"
 
 PERMISSIONS = {
     "admin":  {"manage_users": True,  "delete_client": True},
@@ -3202,16 +5028,13 @@ def cargar_usuarios_gsheet(force_reload: bool = False) -> dict:
     Carga usuarios desde Google Sheets con caché inteligente
     force_reload: True para forzar recarga desde Google Sheets
     """
-    global _USUARIOS_CACHE, _USUARIOS_CACHE_TIME
-    
-    import time
-    now = time.time()
-    cache_duration = 300  # 5 minutos (los usuarios no cambian frecuentemente)
+    cache = _data_cache()
     
-    # Usar caché si es reciente y no se fuerza recarga
-    if not force_reload and _USUARIOS_CACHE is not None:
-        if (now - _USUARIOS_CACHE_TIME) < cache_duration:
-            return _USUARIOS_CACHE.copy()
+    # Usar caché si es reciente y no se fuerza recarga (TTL en CACHE_TTL["usuarios"])
+    if not force_reload:
+        cached = cache.get("usuarios")
+        if cached is not None:
+            return cached.copy()
     
     if not USE_GSHEETS:
         return {"users": []}
@@ -3221,33 +5044,18 @@ def cargar_usuarios_gsheet(force_reload: bool = False) -> dict:
         if ws is None:
             return {"users": []}
             
-        df = get_as_dataframe(ws, evaluate_formulas=True, dtype=str, header=0).dropna(how="all")
-        if df is None or df.empty:
-            result = {"users": []}
-        else:
-            users = []
-            for _, row in df.iterrows():
-                user_data = {
-                    "user": row.get("user", ""),
-                    "role": row.get("role", "member"),
-                    "salt": row.get("salt", ""),
-                    "hash": row.get("hash", "")
-                }
-                # Solo agregar usuarios válidos
-                if user_data["user"] and user_data["salt"] and user_data["hash"]:
-                    users.append(user_data)
-            result = {"users": users}
+        df = _gs_call(get_as_dataframe, ws, evaluate_formulas=True, dtype=str, header=0).dropna(how="all")
+        result = _usuarios_desde_df(df)
         
         # Actualizar caché
-        _USUARIOS_CACHE = result.copy()
-        _USUARIOS_CACHE_TIME = now
+        cache.put("usuarios", result.copy())
         return result
         
     except Exception as e:
         # Si hay error de API (quota exceeded), usar caché antiguo si existe
-        if _USUARIOS_CACHE is not None:
+        if cache.peek("usuarios") is not None:
             st.warning(f"⚠️ Usando caché de usuarios (API temporalmente no disponible)")
-            return _USUARIOS_CACHE.copy()
+            return cache.peek("usuarios").copy()
         st.error(f"Error cargando usuarios desde Google Sheets: {e}")
         return {"users": []}
 
@@ -3269,7 +5077,7 @@ def guardar_usuarios_gsheet(users_data: dict):
         if not users_list:
             # Limpiar la hoja si no hay usuarios
             try:
-                ws.clear()
+                _gs_call(ws.clear)
             except Exception:
                 pass
             return
@@ -3286,7 +5094,7 @@ def guardar_usuarios_gsheet(users_data: dict):
         df = df[column_order]
         
         # Guardar en Google Sheets
-        set_with_dataframe(ws, df, include_index=False, include_column_header=True, resize=True)
+        _gs_call(set_with_dataframe, ws, df, include_index=False, include_column_header=True, resize=True, costo=GS_COSTO_SET_DATAFRAME)
         
     except Exception as e:
         st.error(f"Error guardando usuarios en Google Sheets: {e}")
@@ -3323,6 +5131,9 @@ def save_users(obj: dict):
         USERS_FILE.write_text(json.dumps(obj, indent=2, ensure_ascii=False), encoding="utf-8")
     except Exception as e:
         st.error(f"Error guardando usuarios localmente: {e}")
+    
+    # 3) Invalidar la instantánea compartida de usuarios
+    limpiar_cache_usuarios()
 
 def sync_usuarios_local_to_gsheet():
     """
@@ -3837,6 +5648,63 @@ if is_admin():
                                 st.toast(f"✅ 2° Estatus '{seg_est}' eliminado")
                                 st.rerun()
 
+    # -- Exportación de la base local (bajo demanda) --
+    with st.sidebar.expander("💾 Respaldo local", expanded=False):
+        st.caption("La base local vive en SQLite; CSV/XLSX se generan sólo al pedirlos")
+        if st.button("Generar respaldo", key="btn_respaldo_local"):
+            with st.spinner("Exportando base local..."):
+                st.session_state["respaldo_csv"] = exportar_clientes_csv()
+                st.session_state["respaldo_xlsx"] = exportar_clientes_xlsx()
+        if st.session_state.get("respaldo_csv"):
+            st.download_button("⬇️ clientes.csv", data=st.session_state["respaldo_csv"], file_name="clientes.csv", mime="text/csv", key="dl_respaldo_csv")
+        if st.session_state.get("respaldo_xlsx"):
+            st.download_button("⬇️ clientes.xlsx", data=st.session_state["respaldo_xlsx"], file_name="clientes.xlsx",
+                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", key="dl_respaldo_xlsx")
+
+    # -- Diagnóstico de caché y datos (solo admin) --
+    with st.sidebar.expander("🩺 Diagnóstico", expanded=False):
+        st.caption("Caché compartido por conjunto de datos (todas las sesiones)")
+        _stats = _data_cache().stats()
+        if _stats:
+            st.dataframe(pd.DataFrame(_stats), use_container_width=True, hide_index=True)
+        else:
+            st.caption("Sin lecturas registradas todavía")
+        _vistas = _vistas_filtradas().stats()
+        st.caption(f"Vistas filtradas en memoria: {_vistas['vistas']} · aciertos {_vistas['aciertos']} · "
+                   f"fallos {_vistas['fallos']} · tasa {_vistas['tasa_acierto']}%")
+        _libros = _exportaciones_excel().stats()
+        st.caption(f"Libros Excel en memoria: {_libros['vistas']} · aciertos {_libros['aciertos']} · "
+                   f"fallos {_libros['fallos']}")
+        if USE_GSHEETS:
+            st.caption("Llamadas a Google por minuto (cuota compartida)")
+            _uso = [dict(api=api, **m) for api in GS_CUOTA_MINUTO for m in _gs_limiter(api).metricas()]
+            if _uso:
+                st.dataframe(pd.DataFrame(_uso), use_container_width=True, hide_index=True)
+            else:
+                st.caption("Sin llamadas registradas todavía")
+            st.caption("Cola de sincronización con Google Sheets")
+            try:
+                _sync = sync_estado()
+                st.write({k: v for k, v in _sync.items() if k != "ultimo_vaciado"})
+                if _sync["ultimo_vaciado"]:
+                    st.caption(f"Último lote subido hace {int(time.time() - _sync['ultimo_vaciado'])}s")
+                if st.button("☁️ Sincronizar ahora", key="btn_diag_sync_now"):
+                    with st.spinner("Subiendo cambios pendientes..."):
+                        sync_vaciar_ahora()
+                    st.rerun()
+                st.caption(f"Filas marcadas como eliminadas en la hoja: {_marcas_pendientes()}")
+                if st.button("🧽 Compactar hoja", key="btn_diag_compactar"):
+                    with st.spinner("Quitando filas eliminadas de la hoja..."):
+                        n = compactar_clientes_gsheet()
+                    st.toast(f"✅ {n} filas quitadas")
+                    st.rerun()
+            except Exception as e:
+                st.caption(f"Cola no disponible: {e}")
+        if st.button("🧹 Vaciar caché", key="btn_diag_clear_cache"):
+            limpiar_cache_gsheets()
+            st.toast("✅ Caché vaciado")
+            st.rerun()
+
 # ---------- Sidebar (filtros + acciones) ----------
 st.sidebar.title("👤 CRM")
 st.sidebar.caption("Filtros")
@@ -3844,35 +5712,22 @@ st.sidebar.caption("Filtros")
 # Cargar datos frescos para el sidebar
 df_cli = cargar_y_corregir_clientes()
 
+# Índice de filtros (se reconstruye sólo cuando cambian los datos)
+indice_filtro = indice_filtros()
+if not indice_filtro.corresponde(df_cli):
+    indice_filtro = indice_filtros(df_cli)
+
 # Opciones base
 SUC_LABEL_EMPTY = "(Sin sucursal)"
-# CORREGIR: Manejar tanto valores vacíos ("") como None/NaN
-sucursal_for_filter = df_cli["sucursal"].fillna("").replace({"": SUC_LABEL_EMPTY})
 SUC_ALL  = sorted(set(SUCURSALES + [SUC_LABEL_EMPTY]))
 
-# Recalcular campos derivados para filtros (asegurar que reflejen la versión en disco)
-asesor_for_filter = df_cli["asesor"].fillna("").replace({"": "(Sin asesor)"})
-# Normalizar variantes de la etiqueta "(Sin asesor)" (mayúsculas/minúsculas/espacios)
-def _norm_sin_asesor_label(x: str) -> str:
-    try:
-        s = (x or "").strip()
-    except Exception:
-        s = ""
-    if s.casefold() == "(sin asesor)":
-        return "(Sin asesor)"
-    return s
-
-# Aplicar normalización y asegurar unicidad
-ASES_ALL = sorted(list(dict.fromkeys([_norm_sin_asesor_label(x) for x in asesor_for_filter.unique().tolist()])))
-
-# IMPORTANTE: Aplicar la misma normalización a asesor_for_filter para que coincida con ASES_ALL
-asesor_for_filter_normalized = asesor_for_filter.apply(_norm_sin_asesor_label)
+# Asesores con la etiqueta "(Sin asesor)" ya normalizada (mayúsculas/minúsculas/espacios)
+ASES_ALL = sorted(indice_filtro.valores("asesor"))
 
 EST_ALL = ESTATUS_OPCIONES.copy()
 
 # --- NEW: Fuentes para filtro (se generan dinámicamente desde la base para que nuevas fuentes aparezcan automáticamente)
-fuente_for_filter = df_cli["fuente"].fillna("").replace({"": "(Sin fuente)"})
-FUENTE_ALL = sorted(list(dict.fromkeys([ (str(x).strip() if str(x).strip() else "(Sin fuente)") for x in fuente_for_filter.unique().tolist() ])))
+FUENTE_ALL = sorted(indice_filtro.valores("fuente"))
 
 # Controles “tipo selectbox” pero multi
 f_suc  = selectbox_multi("Sucursales", SUC_ALL,  "f_suc")
@@ -3913,13 +5768,11 @@ def _reset_filters():
 
 def _force_refresh():
     """Fuerza actualización de caché y filtros para mostrar nuevos datos"""
-    global _CLIENTES_CACHE, _CLIENTES_CACHE_TIME, _HISTORIAL_CACHE, _HISTORIAL_CACHE_TIME
     try:
         # Limpiar caché de clientes y historial
-        _CLIENTES_CACHE = None
-        _CLIENTES_CACHE_TIME = 0
-        _HISTORIAL_CACHE = None
-        _HISTORIAL_CACHE_TIME = 0
+        _data_cache().invalidate("clientes", "historial")
+        # Releer la hoja e hidratar la base local (respetando lo que sigue en cola)
+        cargar_clientes(force_reload=True)
         # Reset filtros también
         _reset_filters()
         # Marcar que se necesita actualizar (sin llamar st.rerun() en callback)
@@ -3934,11 +5787,24 @@ col_refresh1, col_refresh2 = st.sidebar.columns([3, 1])
 with col_refresh1:
     # Calcular tiempo desde última actualización
     import time
-    cache_age = int(time.time() - _CLIENTES_CACHE_TIME) if _CLIENTES_CACHE_TIME > 0 else 0
+    cache_age = int(_data_cache().age("clientes") or 0)
     if cache_age < 60:
         st.sidebar.caption(f"Última actualización: hace {cache_age}s")
     else:
         st.sidebar.caption(f"Última actualización: hace {cache_age//60}m")
+    # Profundidad de la cola de sincronización (el worker arranca aquí una vez por proceso)
+    if USE_GSHEETS:
+        try:
+            _sync = sync_estado()
+            if _sync["pendientes"]:
+                _sync_txt = f"☁️ Pendientes de sincronizar: {_sync['pendientes']}"
+                if _sync["con_error"]:
+                    _sync_txt += f" ({_sync['con_error']} reintentando)"
+                st.sidebar.caption(_sync_txt)
+            else:
+                st.sidebar.caption("☁️ Google Sheets al día")
+        except Exception:
+            pass
 with col_refresh2:
     if st.sidebar.button("🔄", key="btn_force_refresh", help="Recargar todo desde Google Sheets"):
         with st.spinner("Recargando datos..."):
@@ -3952,58 +5818,27 @@ if st.session_state.get("_force_refresh_requested", False):
     st.rerun()
 
 # Aplicar filtros: si no hay selección o está vacía, NO filtrar (mostrar todo)
-try:
-    # Debug info comentado para optimización
-    # st.sidebar.write(f"**Debug Info:**")
-    # st.sidebar.write(f"- Total clientes en base: {len(df_cli)}")
-    # st.sidebar.write(f"- Asesores disponibles: {len(ASES_ALL)}")
-    # st.sidebar.write(f"- Asesores filtrados: {len(f_ases) if f_ases else 0}")
-    # if f_ases and len(f_ases) < len(ASES_ALL):
-    #     st.sidebar.write(f"- Asesores seleccionados: {f_ases[:3]}{'...' if len(f_ases) > 3 else ''}")
-    
-    # Sucursal: si está vacío o tiene todos, no filtrar
-    if not f_suc or len(f_suc) == 0 or set(f_suc) == set(SUC_ALL):
-        suc_mask = pd.Series(True, index=df_cli.index)
-    else:
-        # Regenerar sucursal_for_filter con datos actuales para evitar desincronización  
-        current_sucursal_for_filter = df_cli["sucursal"].fillna("").replace({"": SUC_LABEL_EMPTY})
-        suc_mask = current_sucursal_for_filter.isin(f_suc)
-
-    # Asesor: si está vacío o tiene todos, no filtrar
-    if not f_ases or len(f_ases) == 0 or set(f_ases) == set(ASES_ALL):
-        asesor_mask = pd.Series(True, index=df_cli.index)
-    else:
-        # Regenerar asesor_for_filter_normalized con datos actuales para evitar desincronización
-        current_asesor_for_filter = df_cli["asesor"].fillna("").replace({"": "(Sin asesor)"})
-        current_asesor_normalized = current_asesor_for_filter.apply(_norm_sin_asesor_label)
-        asesor_mask = current_asesor_normalized.isin(f_ases)
-
-    # Estatus: si está vacío o tiene todos, no filtrar
-    if not f_est or len(f_est) == 0 or set(f_est) == set(EST_ALL):
-        est_mask = pd.Series(True, index=df_cli.index)
-    else:
-        est_mask = df_cli["estatus"].isin(f_est)
-
-    # Fuente: si está vacío o tiene todos, no filtrar
-    try:
-        if not f_fuente or len(f_fuente) == 0 or set(f_fuente) == set(FUENTE_ALL):
-            fuente_mask = pd.Series(True, index=df_cli.index)
-        else:
-            # Regenerar fuente_for_filter con datos actuales para evitar desincronización
-            current_fuente_for_filter = df_cli["fuente"].fillna("").apply(lambda x: str(x).strip() if str(x).strip() else "(Sin fuente)")
-            fuente_mask = current_fuente_for_filter.isin(f_fuente)
-    except Exception:
-        fuente_mask = pd.Series(True, index=df_cli.index)
+def _seleccion_filtro(elegidos, todos):
+    """None (no filtrar) si no hay selección o están todas las opciones."""
+    if not elegidos or set(elegidos) == set(todos):
+        return None
+    return elegidos
 
+try:
+    seleccion_ver = {
+        "sucursal": _seleccion_filtro(f_suc, SUC_ALL),
+        "asesor": _seleccion_filtro(f_ases, ASES_ALL),
+        "estatus": _seleccion_filtro(f_est, EST_ALL),
+        "fuente": _seleccion_filtro(f_fuente, FUENTE_ALL),
+    }
+    # Vista memorizada por versión de datos + selección (compartida: copiar antes de modificar)
+    clave_vista_ver = _VistasFiltradas.clave(indice_filtro.clave, seleccion_ver)
+    df_ver = _vistas_filtradas().obtener(clave_vista_ver, lambda: df_cli[indice_filtro.mascara(seleccion_ver)])
 except Exception as e:
     # Fallback seguro: no filtrar si algo falla
     st.sidebar.error(f"Error en filtros: {e}")
-    suc_mask = pd.Series(True, index=df_cli.index)
-    asesor_mask = pd.Series(True, index=df_cli.index)
-    est_mask = pd.Series(True, index=df_cli.index)
-    fuente_mask = pd.Series(True, index=df_cli.index)
-
-df_ver = df_cli[suc_mask & est_mask & asesor_mask & fuente_mask].copy()
+    clave_vista_ver = None
+    df_ver = df_cli.copy()
 
 # Resumen
 st.sidebar.markdown("---")
@@ -4011,109 +5846,63 @@ st.sidebar.subheader("📊 Resumen filtrado")
 st.sidebar.metric("Clientes visibles", len(df_ver))
 st.sidebar.metric("Total en base", len(df_cli))
 
-# Añadir botón para descargar Excel del resumen filtrado (df_ver)
+# Descargas Excel del resumen filtrado (df_ver): los libros se generan sólo al pedirlos
+# y se memorizan por versión de datos + filtros
 try:
-    bio = io.BytesIO()
-    engine = None
-    try:
-        import xlsxwriter  # type: ignore
-        engine = "xlsxwriter"
-    except Exception:
-        try:
-            import openpyxl  # type: ignore
-            engine = "openpyxl"
-        except Exception:
-            engine = None
-
-    if engine is None:
+    if _motor_excel() is None:
         st.sidebar.info("Instala 'openpyxl' o 'xlsxwriter' para habilitar descarga XLSX.")
     else:
-        # Preparar DataFrame a exportar (ordenado por fechas si procede)
-        try:
-            df_export = sort_df_by_dates(df_ver) if (isinstance(df_ver, pd.DataFrame) and not df_ver.empty) else df_ver.copy()
-        except Exception:
-            df_export = df_ver.copy() if isinstance(df_ver, pd.DataFrame) else pd.DataFrame()
-
-        with pd.ExcelWriter(bio, engine=engine) as writer:
-            try:
-                df_export.to_excel(writer, index=False, sheet_name="Filtrados")
-            except Exception:
-                # fallback: intentar convertir todo a strings y volver a escribir
+        col_xlsx1, col_xlsx2 = st.sidebar.columns(2)
+        with col_xlsx1:
+            if st.button("📄 Excel filtrados", key="btn_xlsx_filtrados", help="Generar Excel de los clientes visibles"):
+                with st.spinner("Generando Excel..."):
+                    st.session_state["xlsx_filtrados"] = (clave_vista_ver, exportacion_excel("filtrados", df_ver, clave_vista_ver))
+        with col_xlsx2:
+            if st.button("📊 Por asesores", key="btn_xlsx_asesores", help="Generar Excel con una pestaña por cada asesor"):
+                with st.spinner("Generando Excel..."):
+                    st.session_state["xlsx_asesores"] = (clave_vista_ver, exportacion_excel("asesores", df_ver, clave_vista_ver))
+        
+        # Sólo se ofrece la descarga si el libro corresponde a los filtros actuales
+        _xlsx = st.session_state.get("xlsx_filtrados")
+        if _xlsx and _xlsx[1] and _xlsx[0] is not None and _xlsx[0] == clave_vista_ver:
+            if st.sidebar.download_button(
+                "⬇️ Descargar Excel (filtrados)",
+                data=_xlsx[1],
+                file_name="clientes_filtrados.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key="dl_filtrados_sidebar"
+            ):
                 try:
-                    df_export.astype(str).to_excel(writer, index=False, sheet_name="Filtrados")
+                    actor = (current_user() or {}).get("user") or (current_user() or {}).get("email")
+                    append_historial(
+                    "", "", "", "", "", "",
+                    "Descarga de Excel filtrados",
+                    action="DESCARGA ZIP",  # o "DOCUMENTOS", según quieras categorizarlo
+                    actor=actor
+                    )
                 except Exception:
-                    pass
-        bio.seek(0)
-        if st.sidebar.download_button(
-            "⬇️ Descargar Excel (filtrados)",
-            data=bio.getvalue(),
-            file_name="clientes_filtrados.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            key="dl_filtrados_sidebar"
-        ):
-            try:
-                actor = (current_user() or {}).get("user") or (current_user() or {}).get("email")
-                append_historial(
-                "", "", "", "", "", "",
-                "Descarga de Excel filtrados",
-                action="DESCARGA ZIP",  # o "DOCUMENTOS", según quieras categorizarlo
-                actor=actor
-                )
-            except Exception:
-                    pass
+                        pass
         
-        # NUEVO: Descarga Excel por pestañas de asesores
-        bio_asesores = io.BytesIO()
-        try:
-            # Preparar datos por asesor
-            df_for_asesores = df_export.copy()
-            if not df_for_asesores.empty and 'asesor' in df_for_asesores.columns:
-                # Normalizar asesores vacíos
-                df_for_asesores['asesor'] = df_for_asesores['asesor'].fillna("(Sin asesor)").replace({"": "(Sin asesor)"})
-                
-                # Obtener lista de asesores únicos
-                asesores_unicos = sorted(df_for_asesores['asesor'].unique().tolist())
-                
-                if len(asesores_unicos) > 0:
-                    with pd.ExcelWriter(bio_asesores, engine=engine) as writer:
-                        # Crear una pestaña por cada asesor
-                        for asesor in asesores_unicos:
-                            try:
-                                # Filtrar datos por asesor
-                                df_asesor = df_for_asesores[df_for_asesores['asesor'] == asesor].copy()
-                                if not df_asesor.empty:
-                                    # Limpiar nombre del asesor para usar como nombre de pestaña (máximo 31 caracteres)
-                                    sheet_name = str(asesor)[:31] if asesor else "Sin_asesor"
-                                    # Reemplazar caracteres problemáticos para nombres de pestaña
-                                    sheet_name = sheet_name.replace("/", "_").replace("\\", "_").replace("*", "_").replace("?", "_").replace(":", "_").replace("[", "_").replace("]", "_")
-                                    
-                                    df_asesor.to_excel(writer, index=False, sheet_name=sheet_name)
-                            except Exception:
-                                # Si falla crear la pestaña, continúa con el siguiente asesor
-                                continue
-                    
-                    bio_asesores.seek(0)
-                    if st.sidebar.download_button(
-                        "📊 Descargar Excel (por asesores)",
-                        data=bio_asesores.getvalue(),
-                        file_name="clientes_por_asesores.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        key="dl_asesores_sidebar",
-                        help="Descarga Excel con una pestaña por cada asesor"
-                    ):
-                        try:
-                            actor = (current_user() or {}).get("user") or (current_user() or {}).get("email")
-                            append_historial(
-                            "", "", "", "", "", "",
-                            "Descarga de Excel por asesores",
-                            action="DESCARGA ZIP ASESOR",
-                            actor=actor
-                            )
-                        except Exception:
-                            pass
-        except Exception:
-            # Si algo falla en la creación del Excel por asesores, no mostrar el botón
-            pass
+        _xlsx = st.session_state.get("xlsx_asesores")
+        if _xlsx and _xlsx[1] and _xlsx[0] is not None and _xlsx[0] == clave_vista_ver:
+            if st.sidebar.download_button(
+                "📊 Descargar Excel (por asesores)",
+                data=_xlsx[1],
+                file_name="clientes_por_asesores.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key="dl_asesores_sidebar",
+                help="Descarga Excel con una pestaña por cada asesor"
+            ):
+                try:
+                    actor = (current_user() or {}).get("user") or (current_user() or {}).get("email")
+                    append_historial(
+                    "", "", "", "", "", "",
+                    "Descarga de Excel por asesores",
+                    action="DESCARGA ZIP ASESOR",
+                    actor=actor
+                    )
+                except Exception:
+                    pass
 except Exception:
     # no bloquear la UI si algo falla
     pass
@@ -4139,19 +5928,36 @@ with tab_dash:
         with col_titulo:
             st.subheader("📊 KPIs Principales")
         with col_pptx:
-            # Generar PowerPoint del dashboard
-            pptx_data = generar_presentacion_dashboard(df_cli)
-            st.download_button(
-                label="📊 Descargar",
-                data=pptx_data,
-                file_name=f"dashboard_kapitaliza_{datetime.now().strftime('%Y%m%d_%H%M')}.pptx",
-                mime="application/vnd.openxmlformats-officedocument.presentationml.presentation",
-                help="Descargar presentación completa con gráficas"
-            )
+            # PowerPoint del dashboard: se genera sólo a pedido y en segundo plano
+            _gen_pptx = _generador_presentaciones()
+            _pptx_nativas = st.checkbox("Gráficas editables", value=True, key="pptx_nativas",
+                                        help="Gráficas nativas de PowerPoint (archivo más ligero); desmarcar para imágenes")
+            _clave_pptx = _gen_pptx.clave(None, _pptx_nativas)   # df_cli es la carga en caché
+            _estado_pptx, _pptx_data = _gen_pptx.estado(_clave_pptx)
+            if _estado_pptx == "listo":
+                st.download_button(
+                    label="📊 Descargar",
+                    data=_pptx_data,
+                    file_name=f"dashboard_kapitaliza_{datetime.now().strftime('%Y%m%d_%H%M')}.pptx",
+                    mime="application/vnd.openxmlformats-officedocument.presentationml.presentation",
+                    help="Descargar presentación completa con gráficas"
+                )
+            elif _estado_pptx == "generando":
+                if st.button("⏳ Generando...", help="Clic para revisar si ya está lista", key="btn_pptx_estado"):
+                    st.rerun()
+            else:
+                if _estado_pptx == "error":
+                    st.caption(f"⚠️ {_pptx_data}")
+                if st.button("📊 Presentación", help="Generar presentación completa con gráficas", key="btn_pptx_generar"):
+                    _gen_pptx.solicitar(df_cli, _pptx_nativas, _clave_pptx)
+                    st.rerun()
+        
+        # Todas las vistas del dashboard leen del cubo de agregados (se calcula una vez por carga)
+        cubo = cubo_clientes()
         
         # Preparar datos para KPIs
         total_clientes = len(df_cli)
-        estatus_counts = df_cli["estatus"].fillna("").value_counts()
+        estatus_counts = cubo_conteo(cubo, "estatus")
         
         # Calcular KPIs principales con lógica corregida
         dispersados = estatus_counts.get("DISPERSADO", 0)
@@ -4205,31 +6011,25 @@ with tab_dash:
         # 💹 Top Estatus por Monto
         st.markdown("##### 💹 Top Estatus por Monto")
         
-        # Calcular métricas financieras para el ranking
-        analisis_financiero = calcular_analisis_financiero(df_cli)
-        
         # Mostrar total de presupuesto general
-        total_presupuesto = analisis_financiero['total_propuesto']
+        total_presupuesto = cubo["monto_propuesta"].sum()
         st.markdown(f"**Total Presupuesto General: {formatear_monto(total_presupuesto)}**")
         
-        if not analisis_financiero['montos_por_estatus'].empty:
-            # Filtrar solo estatus con monto > 0
-            estatus_con_monto = analisis_financiero['montos_por_estatus'][
-                analisis_financiero['montos_por_estatus'][('monto_propuesta_num', 'sum')] > 0
-            ]
-            
+        # Filtrar solo estatus con monto > 0
+        estatus_con_monto = cubo_por(cubo, "estatus")
+        estatus_con_monto = estatus_con_monto[estatus_con_monto["monto_propuesta"] > 0]
+        
+        if not estatus_con_monto.empty:
             # Obtener top estatus por monto propuesto
-            top_estatus = estatus_con_monto.sort_values(
-                ('monto_propuesta_num', 'sum'), ascending=False
-            ).head(5)
+            top_estatus = estatus_con_monto.sort_values("monto_propuesta", ascending=False).head(5)
             
             col1, col2 = st.columns(2)
             
             # Dividir en dos columnas para mostrar mejor con texto más pequeño
             for i, (estatus, data) in enumerate(top_estatus.iterrows()):
-                monto_total = data[('monto_propuesta_num', 'sum')]
-                cantidad = data[('monto_propuesta_num', 'count')]
-                promedio = data[('monto_propuesta_num', 'mean')]
+                monto_total = data["monto_propuesta"]
+                cantidad = data["clientes"]
+                promedio = monto_total / cantidad if cantidad else 0
                 
                 with col1 if i % 2 == 0 else col2:
                     # Usar markdown para texto más pequeño
@@ -4277,12 +6077,8 @@ with tab_dash:
             
             # Solo mostrar estatus con valores > 0 (más limpio)
             # Primero limpiar y normalizar estatus vacíos o nulos
-            df_temp = df_cli.copy()
-            df_temp["estatus_clean"] = df_temp["estatus"].fillna("(Sin estatus)").replace("", "(Sin estatus)")
-            df_temp["estatus_clean"] = df_temp["estatus_clean"].apply(lambda x: x.strip() if str(x).strip() else "(Sin estatus)")
-            
-            estatus_data = df_temp["estatus_clean"].value_counts()
-            estatus_data = estatus_data[estatus_data > 0]  # Filtrar solo valores > 0
+            estatus_clean = cubo["estatus"].str.strip().replace("", "(Sin estatus)")
+            estatus_data = cubo_conteo(cubo, "estatus", estatus_clean)  # sólo valores > 0
             
             if estatus_data.empty:
                 st.info("No hay datos de estatus para mostrar.")
@@ -4370,128 +6166,113 @@ with tab_dash:
                     index=0
                 )
             
-            # Determinar fechas según selección
-            date_col = None
-            for c in ("fecha_ingreso", "fecha_dispersion"):
-                if c in df_cli.columns:
-                    date_col = c
-                    break
+            # Fechas de ingreso ya parseadas (por día) en el cubo
+            date_col = "fecha"
+            df_temp = cubo.dropna(subset=[date_col])
             
-            if date_col is None:
-                st.warning("No se encontraron columnas de fecha válidas.")
+            if df_temp.empty:
+                st.warning("No hay datos con fechas válidas.")
             else:
-                df_temp = df_cli.copy()
-                # Aplicar el manejo flexible de fechas
-                try:
-                    df_temp[date_col] = parse_dates_flexible(df_temp[date_col])
-                except Exception:
-                    df_temp[date_col] = pd.to_datetime(df_temp[date_col], errors="coerce")
-                df_temp = df_temp.dropna(subset=[date_col])
+                today = pd.Timestamp.now()
                 
-                if df_temp.empty:
-                    st.warning("No hay datos con fechas válidas.")
+                if periodo_seleccionado == "Personalizado":
+                    with col_custom:
+                        fecha_min = df_temp[date_col].min().date()
+                        fecha_max = df_temp[date_col].max().date()
+                        
+                        rango_fechas = st.date_input(
+                            "Seleccionar rango:",
+                            value=(fecha_min, fecha_max),
+                            min_value=fecha_min,
+                            max_value=fecha_max
+                        )
+                        
+                        if isinstance(rango_fechas, tuple) and len(rango_fechas) == 2:
+                            fecha_inicio, fecha_fin = rango_fechas
+                        else:
+                            fecha_inicio = fecha_fin = rango_fechas
                 else:
-                    today = pd.Timestamp.now()
-                    
-                    if periodo_seleccionado == "Personalizado":
-                        with col_custom:
-                            fecha_min = df_temp[date_col].min().date()
-                            fecha_max = df_temp[date_col].max().date()
-                            
-                            rango_fechas = st.date_input(
-                                "Seleccionar rango:",
-                                value=(fecha_min, fecha_max),
-                                min_value=fecha_min,
-                                max_value=fecha_max
-                            )
-                            
-                            if isinstance(rango_fechas, tuple) and len(rango_fechas) == 2:
-                                fecha_inicio, fecha_fin = rango_fechas
-                            else:
-                                fecha_inicio = fecha_fin = rango_fechas
+                    dias = periodo_options[periodo_seleccionado]
+                    if dias is None:  # Todo el histórico
+                        fecha_inicio = df_temp[date_col].min().date()
+                        fecha_fin = df_temp[date_col].max().date()
                     else:
-                        dias = periodo_options[periodo_seleccionado]
-                        if dias is None:  # Todo el histórico
-                            fecha_inicio = df_temp[date_col].min().date()
-                            fecha_fin = df_temp[date_col].max().date()
-                        else:
-                            fecha_fin = today.date()
-                            fecha_inicio = (today - pd.Timedelta(days=dias)).date()
+                        fecha_fin = today.date()
+                        fecha_inicio = (today - pd.Timedelta(days=dias)).date()
+                
+                # Filtrar datos por período
+                mask = (df_temp[date_col].dt.date >= fecha_inicio) & (df_temp[date_col].dt.date <= fecha_fin)
+                df_periodo = df_temp[mask]
+                
+                if df_periodo.empty:
+                    st.info("No hay datos en el período seleccionado.")
+                else:
+                    # KPIs del período
+                    st.markdown("**KPIs del período seleccionado:**")
                     
-                    # Filtrar datos por período
-                    mask = (df_temp[date_col].dt.date >= fecha_inicio) & (df_temp[date_col].dt.date <= fecha_fin)
-                    df_periodo = df_temp[mask].copy()
+                    total_periodo = int(df_periodo["clientes"].sum())
+                    dispersados_periodo = int(df_periodo.loc[df_periodo["estatus"] == "DISPERSADO", "clientes"].sum())
+                    tasa_conversion = (dispersados_periodo / total_periodo * 100) if total_periodo > 0 else 0
                     
-                    if df_periodo.empty:
-                        st.info("No hay datos en el período seleccionado.")
-                    else:
-                        # KPIs del período
-                        st.markdown("**KPIs del período seleccionado:**")
-                        
-                        total_periodo = len(df_periodo)
-                        dispersados_periodo = len(df_periodo[df_periodo["estatus"] == "DISPERSADO"])
-                        tasa_conversion = (dispersados_periodo / total_periodo * 100) if total_periodo > 0 else 0
-                        
-                        kpi_col1, kpi_col2, kpi_col3 = st.columns(3)
-                        
-                        with kpi_col1:
-                            st.metric("Total en período", total_periodo)
-                        with kpi_col2:
-                            st.metric("Dispersados", dispersados_periodo)
-                        with kpi_col3:
-                            st.metric("Tasa de conversión", f"{tasa_conversion:.1f}%")
-                        
-                        st.markdown("---")
-                        
-                        # Gráfico de evolución temporal (por mes)
-                        st.markdown("**Evolución mensual:**")
-                        
-                        df_mensual = df_periodo.copy()
-                        df_mensual["año_mes"] = df_mensual[date_col].dt.to_period("M")
-                        evolucion = df_mensual.groupby("año_mes").size().reset_index(name="cantidad")
-                        evolucion["fecha"] = evolucion["año_mes"].astype(str)
-                        
-                        if len(evolucion) > 0:
-                            line_chart = alt.Chart(evolucion).mark_line(
-                                point=True,
-                                strokeWidth=3
-                            ).encode(
-                                x=alt.X("fecha:O", axis=alt.Axis(title="Mes", labelAngle=-45)),
-                                y=alt.Y("cantidad:Q", axis=alt.Axis(title="Número de Clientes")),
-                                tooltip=["fecha:O", "cantidad:Q"]
-                            ).properties(
-                                height=300,
-                                title="Evolución de Clientes por Mes"
-                            )
-                            
-                            st.altair_chart(line_chart, use_container_width=True)
-                        
-                        # Gráfico de dona: Distribución por estatus en el período
-                        st.markdown("**Distribución por estatus en el período:**")
-                        
-                        estatus_periodo = df_periodo["estatus"].fillna("(Sin estatus)").value_counts()
-                        estatus_periodo_df = estatus_periodo.reset_index()
-                        estatus_periodo_df.columns = ["estatus", "cantidad"]
-                        # Agregar porcentaje como columna calculada
-                        estatus_periodo_df["porcentaje"] = (estatus_periodo_df["cantidad"] / total_periodo * 100).round(1)
-                        
-                        dona_chart = alt.Chart(estatus_periodo_df).mark_arc(
-                            innerRadius=50,
-                            outerRadius=120
+                    kpi_col1, kpi_col2, kpi_col3 = st.columns(3)
+                    
+                    with kpi_col1:
+                        st.metric("Total en período", total_periodo)
+                    with kpi_col2:
+                        st.metric("Dispersados", dispersados_periodo)
+                    with kpi_col3:
+                        st.metric("Tasa de conversión", f"{tasa_conversion:.1f}%")
+                    
+                    st.markdown("---")
+                    
+                    # Gráfico de evolución temporal (por mes)
+                    st.markdown("**Evolución mensual:**")
+                    
+                    df_mensual = df_periodo.assign(año_mes=df_periodo[date_col].dt.to_period("M"))
+                    evolucion = df_mensual.groupby("año_mes")["clientes"].sum().reset_index(name="cantidad")
+                    evolucion["fecha"] = evolucion["año_mes"].astype(str)
+                    
+                    if len(evolucion) > 0:
+                        line_chart = alt.Chart(evolucion).mark_line(
+                            point=True,
+                            strokeWidth=3
                         ).encode(
-                            theta=alt.Theta("cantidad:Q"),
-                            color=alt.Color("estatus:N", scale=alt.Scale(scheme="category20")),
-                            tooltip=[
-                                alt.Tooltip("estatus:N", title="Estatus"),
-                                alt.Tooltip("cantidad:Q", title="Cantidad"),
-                                alt.Tooltip("porcentaje:Q", title="Porcentaje (%)", format=".1f")
-                            ]
+                            x=alt.X("fecha:O", axis=alt.Axis(title="Mes", labelAngle=-45)),
+                            y=alt.Y("cantidad:Q", axis=alt.Axis(title="Número de Clientes")),
+                            tooltip=["fecha:O", "cantidad:Q"]
                         ).properties(
                             height=300,
-                            title="Distribución por Estatus"
+                            title="Evolución de Clientes por Mes"
                         )
                         
-                        st.altair_chart(dona_chart, use_container_width=True)
+                        st.altair_chart(line_chart, use_container_width=True)
+                    
+                    # Gráfico de dona: Distribución por estatus en el período
+                    st.markdown("**Distribución por estatus en el período:**")
+                    
+                    estatus_periodo = cubo_conteo(df_periodo, "estatus")
+                    estatus_periodo_df = estatus_periodo.reset_index()
+                    estatus_periodo_df.columns = ["estatus", "cantidad"]
+                    # Agregar porcentaje como columna calculada
+                    estatus_periodo_df["porcentaje"] = (estatus_periodo_df["cantidad"] / total_periodo * 100).round(1)
+                    
+                    dona_chart = alt.Chart(estatus_periodo_df).mark_arc(
+                        innerRadius=50,
+                        outerRadius=120
+                    ).encode(
+                        theta=alt.Theta("cantidad:Q"),
+                        color=alt.Color("estatus:N", scale=alt.Scale(scheme="category20")),
+                        tooltip=[
+                            alt.Tooltip("estatus:N", title="Estatus"),
+                            alt.Tooltip("cantidad:Q", title="Cantidad"),
+                            alt.Tooltip("porcentaje:Q", title="Porcentaje (%)", format=".1f")
+                        ]
+                    ).properties(
+                        height=300,
+                        title="Distribución por Estatus"
+                    )
+                    
+                    st.altair_chart(dona_chart, use_container_width=True)
         
         # 🏢 TAB 3: POR SUCURSAL/ASESOR
         with dash_tab3:
@@ -4502,8 +6283,7 @@ with tab_dash:
             
             # SUB-TAB: SUCURSALES
             with sub_tab1:
-                sucursal_counts = df_cli["sucursal"].fillna("(Sin sucursal)").value_counts()
-                sucursal_counts = sucursal_counts[sucursal_counts > 0]
+                sucursal_counts = cubo_conteo(cubo, "sucursal")
                 
                 if sucursal_counts.empty:
                     st.info("No hay datos de sucursales para mostrar.")
@@ -4549,33 +6329,32 @@ with tab_dash:
                 # para mostrar todos los asesores (misma lógica que en tab_asesores)
                 try:
                     # Aplicar filtros SIN incluir el filtro de asesor
-                    sucursal_for_filter = df_cli["sucursal"].fillna("").replace({"": "(Sin sucursal)"})
-                    fuente_for_filter = df_cli["fuente"].fillna("").replace({"": "(Sin fuente)"})
+                    sucursal_for_filter = cubo["sucursal"].replace({"": "(Sin sucursal)"})
+                    fuente_for_filter = cubo["fuente"].replace({"": "(Sin fuente)"})
                     
                     # Aplicar solo filtros de sucursal, estatus y fuente (NO asesor)
                     if not f_suc or len(f_suc) == 0 or set(f_suc) == set(SUC_ALL):
-                        suc_mask_dash = pd.Series(True, index=df_cli.index)
+                        suc_mask_dash = pd.Series(True, index=cubo.index)
                     else:
                         suc_mask_dash = sucursal_for_filter.isin(f_suc)
 
                     if not f_est or len(f_est) == 0 or set(f_est) == set(EST_ALL):
-                        est_mask_dash = pd.Series(True, index=df_cli.index)
+                        est_mask_dash = pd.Series(True, index=cubo.index)
                     else:
-                        est_mask_dash = df_cli["estatus"].isin(f_est)
+                        est_mask_dash = cubo["estatus"].isin(f_est)
 
                     if not f_fuente or len(f_fuente) == 0 or set(f_fuente) == set(FUENTE_ALL):
-                        fuente_mask_dash = pd.Series(True, index=df_cli.index)
+                        fuente_mask_dash = pd.Series(True, index=cubo.index)
                     else:
                         fuente_mask_dash = fuente_for_filter.isin(f_fuente)
                     
-                    # Datos filtrados para asesores (sin filtro de asesor)
-                    df_asesor_dash = df_cli[suc_mask_dash & est_mask_dash & fuente_mask_dash]
+                    # Celdas del cubo filtradas para asesores (sin filtro de asesor)
+                    cubo_asesor_dash = cubo[suc_mask_dash & est_mask_dash & fuente_mask_dash]
                 except Exception:
                     # Fallback: usar todos los datos
-                    df_asesor_dash = df_cli
+                    cubo_asesor_dash = cubo
                 
-                asesor_counts = df_asesor_dash["asesor"].fillna("(Sin asesor)").value_counts()
-                asesor_counts = asesor_counts[asesor_counts > 0]
+                asesor_counts = cubo_conteo(cubo_asesor_dash, "asesor")
                 
                 if asesor_counts.empty:
                     st.info("No hay datos de asesores para mostrar.")
@@ -4586,7 +6365,7 @@ with tab_dash:
                     asesor_df = asesor_final.reset_index()
                     asesor_df.columns = ["asesor", "cantidad"]
                     # Usar el total de clientes filtrados para calcular porcentajes
-                    total_filtrados = len(df_asesor_dash)
+                    total_filtrados = int(cubo_asesor_dash["clientes"].sum())
                     asesor_df["porcentaje"] = (asesor_df["cantidad"] / total_filtrados * 100).round(1) if total_filtrados > 0 else 0
                     
                     col1, col2 = st.columns([1, 2])
@@ -4624,8 +6403,7 @@ with tab_dash:
             
             # SUB-TAB: FUENTES
             with sub_tab3:
-                fuente_counts = df_cli["fuente"].fillna("(Sin fuente)").value_counts()
-                fuente_counts = fuente_counts[fuente_counts > 0]
+                fuente_counts = cubo_conteo(cubo, "fuente")
                 
                 if fuente_counts.empty:
                     st.info("No hay datos de fuentes para mostrar.")
@@ -4670,96 +6448,25 @@ with tab_dash:
         st.markdown("---")
         st.subheader(" Análisis Financiero — Cartera Kapitaliza")
         
-        # Preparar datos con limpieza
-        df_temp = df_cli.copy()
-        
-        def limpiar_monto_simple(monto_str):
-            if pd.isna(monto_str) or str(monto_str).strip() == "":
-                return 0.0
-            try:
-                import re
-                clean = re.sub(r'[,$\s]', '', str(monto_str))
-                return float(clean)
-            except:
-                return 0.0
-        
-        # Usar monto_final para dispersados, monto_propuesta para el resto
-        df_temp['monto_analisis'] = df_temp.apply(
-            lambda row: limpiar_monto_simple(row['monto_final']) if row['estatus'] == 'DISPERSADO' 
-            else limpiar_monto_simple(row['monto_propuesta']), axis=1
+        # Modelo financiero por estatus (monto final si está dispersado, propuesta en otro caso)
+        # leído del cubo: sólo clientes con monto > 0
+        escenario_fin = st.selectbox(
+            "Escenario", list(ESCENARIOS_FINANCIEROS), index=0, key="escenario_financiero",
+            format_func=str.capitalize,
+            help="Ajusta conversión, retorno y riesgo de los clientes no dispersados"
         )
+        resumen_fin = resumen_financiero_por_estatus(cubo, escenario_fin)
+        totales_fin = totales_financieros(resumen_fin)
         
-        # Filtrar solo clientes con monto > 0
-        df_analisis = df_temp[df_temp['monto_analisis'] > 0].copy()
-        
-        if df_analisis.empty:
+        if totales_fin is None:
             st.info("No hay datos con montos registrados para análisis.")
         else:
-            # === MODELO FINANCIERO REFINADO ===
-            # Tres componentes: Probabilidad de Conversión, Factor de Retorno, Riesgo
-            prob_conversion = {
-                "DISPERSADO": 1.00,
-                "APROB. CON PROPUESTA": 0.75,
-                "PROPUESTA": 0.75,  # Alias para propuesta
-                "PEND. ACEPT. CLIENTE": 0.65,
-                "PENDIENTE CLIENTE": 0.65,  # Alias
-                "PEND. DOC. PARA EVALUACION": 0.45,
-                "PENDIENTE DOC": 0.45,  # Alias
-                "EN ONBOARDING": 0.55,
-                "RECH. CLIENTE CANCELA": 0.10,
-                "RECH. SOBREENDEUDAMIENTO": 0.05,
-            }
-            
-            factor_retorno = {
-                "DISPERSADO": 1.00,
-                "APROB. CON PROPUESTA": 0.85,
-                "PROPUESTA": 0.85,
-                "PEND. ACEPT. CLIENTE": 0.80,
-                "PENDIENTE CLIENTE": 0.80,
-                "PEND. DOC. PARA EVALUACION": 0.70,
-                "PENDIENTE DOC": 0.70,
-                "EN ONBOARDING": 0.75,
-                "RECH. CLIENTE CANCELA": 0.00,
-                "RECH. SOBREENDEUDAMIENTO": 0.00,
-            }
-            
-            riesgo_pct = {
-                "DISPERSADO": 5,
-                "APROB. CON PROPUESTA": 20,
-                "PROPUESTA": 20,
-                "PEND. ACEPT. CLIENTE": 30,
-                "PENDIENTE CLIENTE": 30,
-                "PEND. DOC. PARA EVALUACION": 45,
-                "PENDIENTE DOC": 45,
-                "EN ONBOARDING": 40,
-                "RECH. CLIENTE CANCELA": 90,
-                "RECH. SOBREENDEUDAMIENTO": 95,
-            }
-            
-            # Para otros estatus de rechazo, aplicar valores altos
-            for estatus in df_analisis['estatus'].unique():
-                if estatus and (estatus.startswith("RECH") or estatus.startswith("REC")):
-                    if estatus not in prob_conversion:
-                        prob_conversion[estatus] = 0.05
-                        factor_retorno[estatus] = 0.00
-                        riesgo_pct[estatus] = 95
-            
-            # Aplicar modelo refinado
-            df_analisis["Probabilidad de Conversión"] = df_analisis["estatus"].map(prob_conversion).fillna(0.5)
-            df_analisis["Factor Retorno"] = df_analisis["estatus"].map(factor_retorno).fillna(0.5)
-            df_analisis["Riesgo (%)"] = df_analisis["estatus"].map(riesgo_pct).fillna(50)
-            
-            # Cálculos financieros
-            df_analisis["Monto Esperado"] = df_analisis["monto_analisis"] * df_analisis["Probabilidad de Conversión"]
-            df_analisis["Retorno Esperado"] = df_analisis["monto_analisis"] * df_analisis["Factor Retorno"]
-            df_analisis["Riesgo Estimado (%)"] = df_analisis["Riesgo (%)"]  # Para compatibilidad
-            
             # === MÉTRICAS GLOBALES REFINADAS ===
-            total_cartera = df_analisis["monto_analisis"].sum()
-            total_monto_esperado = df_analisis["Monto Esperado"].sum()
-            total_retorno = df_analisis["Retorno Esperado"].sum()
-            prom_riesgo = df_analisis["Riesgo (%)"].mean()
-            prom_conversion = df_analisis["Probabilidad de Conversión"].mean() * 100
+            total_cartera = totales_fin["total_cartera"]
+            total_monto_esperado = totales_fin["total_monto_esperado"]
+            total_retorno = totales_fin["total_retorno"]
+            prom_riesgo = totales_fin["prom_riesgo"]
+            prom_conversion = totales_fin["prom_conversion"]
             
             # === DIAGNÓSTICO EJECUTIVO AUTOMATIZADO ===
             st.markdown("##### 🧠 Diagnóstico Financiero")
@@ -4786,23 +6493,19 @@ with tab_dash:
             
             # Análisis específico de oportunidades (incluir todos los pendientes)
             # Definir estatus que se consideran "pendientes" o en proceso
-            estatus_pendientes = df_analisis[~df_analisis['estatus'].str.contains('DISPERSADO|RECHAZADO', na=False, case=False)]
+            breakdown_pendientes = resumen_fin[
+                ~resumen_fin.index.to_series().str.contains('DISPERSADO|RECHAZADO', na=False, case=False)
+            ]
             
-            if not estatus_pendientes.empty:
-                total_pendientes = len(estatus_pendientes)
-                monto_pendientes = estatus_pendientes['monto_analisis'].sum()
-                pct_pendientes = (total_pendientes / len(df_analisis) * 100)
-                
-                # Obtener breakdown por estatus pendiente
-                breakdown_pendientes = estatus_pendientes.groupby('estatus').agg({
-                    'nombre': 'count',
-                    'monto_analisis': 'sum'
-                }).rename(columns={'nombre': 'cantidad'})
+            if not breakdown_pendientes.empty:
+                total_pendientes = int(breakdown_pendientes['clientes'].sum())
+                monto_pendientes = breakdown_pendientes['monto'].sum()
+                pct_pendientes = (total_pendientes / resumen_fin['clientes'].sum() * 100)
                 
                 # Crear texto detallado con los estatus pendientes
                 detalle_estatus = []
                 for estatus, row in breakdown_pendientes.iterrows():
-                    detalle_estatus.append(f"{row['cantidad']} {estatus}")
+                    detalle_estatus.append(f"{int(row['clientes'])} {estatus}")
                 
                 detalle_texto = ", ".join(detalle_estatus[:3])  # Mostrar los primeros 3
                 if len(detalle_estatus) > 3:
@@ -4815,18 +6518,12 @@ with tab_dash:
             
             with col_tabla:
                 st.markdown("##### 🔍 Distribución por Estatus")
-                resumen = df_analisis.groupby("estatus").agg({
-                    "monto_analisis": "sum",
-                    "Retorno Esperado": "sum",
-                    "Riesgo Estimado (%)": "mean",
-                    "nombre": "count"  # Contar clientes
-                }).rename(columns={"nombre": "Clientes"}).reset_index()
+                resumen_display = resumen_fin.reset_index().rename(columns={"clientes": "Clientes"})
                 
                 # Formatear para mostrar
-                resumen_display = resumen.copy()
-                resumen_display["Monto Total"] = resumen_display["monto_analisis"].apply(lambda x: f"${x:,.0f}")
-                resumen_display["Retorno Esperado"] = resumen_display["Retorno Esperado"].apply(lambda x: f"${x:,.0f}")
-                resumen_display["Riesgo (%)"] = resumen_display["Riesgo Estimado (%)"].apply(lambda x: f"{x:.1f}%")
+                resumen_display["Monto Total"] = resumen_display["monto"].map("${:,.0f}".format)
+                resumen_display["Retorno Esperado"] = resumen_display["retorno_esperado"].map("${:,.0f}".format)
+                resumen_display["Riesgo (%)"] = resumen_display["riesgo"].map("{:.1f}%".format)
                 
                 st.dataframe(
                     resumen_display[["estatus", "Clientes", "Monto Total", "Retorno Esperado", "Riesgo (%)"]],
@@ -4837,6 +6534,24 @@ with tab_dash:
             with col_grafico:
                 pass  # Columna vacía
             
+            # === SIMULACIÓN MONTE CARLO ===
+            with st.expander("🎲 Simulación de volumen dispersado (Monte Carlo)", expanded=False):
+                st.caption(f"{MC_SIMULACIONES:,} escenarios sorteados con las probabilidades de conversión del escenario seleccionado.")
+                if st.checkbox("Ejecutar simulación", key="mc_ejecutar"):
+                    sim = simulacion_cartera(escenario_fin)
+                    mc1, mc2, mc3 = st.columns(3)
+                    mc1.metric("P10 (pesimista)", formatear_monto(sim["total"]["p10"]))
+                    mc2.metric("P50 (mediana)", formatear_monto(sim["total"]["p50"]))
+                    mc3.metric("P90 (optimista)", formatear_monto(sim["total"]["p90"]))
+                    for dim, titulo in (("sucursal", "Por sucursal"), ("asesor", "Por asesor")):
+                        st.markdown(f"**{titulo}**")
+                        tabla_mc = sim[dim].reset_index()
+                        tabla_mc[dim] = tabla_mc[dim].replace("", "(Sin dato)")
+                        for c in ("p10", "p50", "p90", "esperado"):
+                            tabla_mc[c] = tabla_mc[c].map("${:,.0f}".format)
+                        st.dataframe(tabla_mc.rename(columns={"p10": "P10", "p50": "P50", "p90": "P90", "esperado": "Esperado"}),
+                                     use_container_width=True, hide_index=True)
+            
             st.markdown("---")
             st.caption("© CRM Kapitaliza ")
 
@@ -4864,8 +6579,7 @@ with tab_cli:
 
                 # REPLACED: permitir elegir un asesor existente dentro del form,
                 # o usar el "Nuevo asesor" si el checkbox (fuera del form) está marcado.
-                raw_ases = [a for a in df_cli["asesor"].fillna("").unique() if str(a).strip()]
-                asesores_exist = sorted(list(dict.fromkeys([_norm_sin_asesor_label(a) for a in raw_ases])))
+                asesores_exist = sorted(pd.unique(etiquetas_filtro(df_cli["asesor"], "asesor")))
                 # Construir opciones sin duplicados (asegurando la etiqueta estándar "(Sin asesor)")
                 asesores_choices = list(dict.fromkeys(["(Sin asesor)"] + asesores_exist))
                 asesor_select = st.selectbox("Asesor", asesores_choices, key="form_ases_select")
@@ -4954,10 +6668,10 @@ with tab_cli:
                             "fuente": fuente_n.strip(),
                         }
                         base = pd.concat([df_cli, pd.DataFrame([nuevo])], ignore_index=True)
-                        guardar_clientes(base)
+                        guardar_clientes(base, base=df_cli)
                         # registrar creación en historial
                         actor = (current_user() or {}).get("user") or (current_user() or {}).get("email")
-                        append_historial(cid, nuevo.get("nombre", ""), "", nuevo.get("estatus", ""), "", nuevo.get("segundo_estatus", ""), f"Creado por {actor}", action="CLIENTE AGREGADO", actor=actor)
+                        eventos_hist = [evento_historial(cid, nuevo.get("nombre", ""), "", nuevo.get("estatus", ""), "", nuevo.get("segundo_estatus", ""), f"Creado por {actor}", action="CLIENTE AGREGADO", actor=actor)]
 
                         # Guardar documentos (auto refresh al terminar) — acumular y registrar 1 sola entrada en historial
                         subidos_lote = []
@@ -4968,14 +6682,15 @@ with tab_cli:
                         if up_otros:    subidos_lote += subir_docs(cid, up_otros,    prefijo="otros_", usar_drive=usar_google_drive)
 
                         if subidos_lote:
-                            actor = (current_user() or {}).get("user") or (current_user() or {}).get("email")
-                            append_historial(
+                            eventos_hist.append(evento_historial(
                                 cid, nuevo.get("nombre",""),
                                 nuevo.get("estatus",""), nuevo.get("estatus",""),
                                 nuevo.get("segundo_estatus",""), nuevo.get("segundo_estatus",""),
                                 f"Subidos: {', '.join(subidos_lote)}",
                                 action="DOCUMENTOS", actor=actor
-                            )
+                            ))
+                        # alta + documentos en un solo registro en lote
+                        append_historial_many(eventos_hist)
 
                         st.success(f"Cliente {cid} creado ✅")
                         do_rerun()  # NEW: refresca todo
@@ -5010,14 +6725,16 @@ with tab_cli:
 
         df_clientes_mostrar["sucursal"] = df_clientes_mostrar["sucursal"].where(df_clientes_mostrar["sucursal"].isin(SUCURSALES), "")
         # antes de mostrar el editor, ordenar df_clientes_mostrar por fechas asc
-        df_clientes_mostrar = sort_df_by_dates(df_clientes_mostrar)  # apply ordering
+        df_clientes_mostrar = sort_df_by_dates(df_clientes_mostrar, snapshot_clientes())  # apply ordering
         # FIX: data_editor no acepta ColumnDataKind.DATETIME si la columna está configurada como TextColumn.
         # Convertir las columnas de fecha a strings 'YYYY-MM-DD' para mantener compatibilidad con column_config.
         for _dcol in ("fecha_ingreso", "fecha_dispersion"):
             if _dcol in df_clientes_mostrar.columns:
                 try:
-                    # Aplicar el manejo flexible de fechas
-                    df_temp_col = parse_dates_flexible(df_clientes_mostrar[_dcol])
+                    # sort_df_by_dates ya dejó la columna como datetime (desde la instantánea)
+                    df_temp_col = df_clientes_mostrar[_dcol]
+                    if not pd.api.types.is_datetime64_any_dtype(df_temp_col):
+                        df_temp_col = parse_dates_flexible(df_temp_col)
                     df_clientes_mostrar[_dcol] = df_temp_col.dt.date.astype(str).replace("NaT", "")
                 except Exception:
                     df_clientes_mostrar[_dcol] = df_clientes_mostrar[_dcol].astype(str).fillna("")
@@ -5057,8 +6774,9 @@ with tab_cli:
                     base = df_cli.set_index("id")
                     base.at[cid_quick, "estatus"] = nuevo_estatus
                     base.at[cid_quick, "segundo_estatus"] = nuevo_seg
-                    df_cli = base.reset_index()
-                    guardar_clientes(df_cli)
+                    df_nuevo = base.reset_index()
+                    guardar_clientes(df_nuevo, base=df_cli)
+                    df_cli = df_nuevo
                     # registrar en historial quién hizo el cambio (modificar)
                     actor = (current_user() or {}).get("user") or (current_user() or {}).get("email")
                     append_historial(cid_quick, nombre_q, estatus_actual, nuevo_estatus, seg_actual, nuevo_seg, obs_q, action="ESTATUS MODIFICADO", actor=actor)
@@ -5068,55 +6786,47 @@ with tab_cli:
         col_save, col_del = st.columns([1,1])
         with col_save:
             if st.button("💾 Guardar cambios"):
-                # conservar copia original para detectar cambios y registrar historial
+                # Sólo el conjunto de cambios del editor (filas editadas / agregadas / eliminadas)
                 original_df = df_cli.copy()
-                base = df_cli.set_index("id")
-                for _, row in ed.iterrows():
-                    cid = row["id"]
-                    for k in COLUMNS:
-                        if k == "id":
-                            continue
-                        base.at[cid, k] = str(row.get(k, ""))
-                # NORMALIZAR/UNIFICAR asesores en el dataframe antes de guardar
-                for idx in base.index:
-                    base.at[idx, "asesor"] = find_matching_asesor(base.at[idx, "asesor"], base.reset_index())
-                df_cli = base.reset_index()
-                # registrar en historial los cambios por fila (si hay diferencias relevantes)
+                df_cli, campos_cambiados, ids_agregados, ids_eliminados = aplicar_cambios_editor(
+                    original_df, df_clientes_mostrar, st.session_state.get("editor_clientes")
+                )
+                # registrar en historial sólo las filas que cambiaron
+                eventos_hist = []
                 try:
                     actor = (current_user() or {}).get("user") or (current_user() or {}).get("email")
-                    for idx in df_cli.index:
-                        cid = df_cli.at[idx, "id"]
-                        old_row = original_df[original_df["id"] == cid]
-                        if not old_row.empty:
-                            old_row = old_row.iloc[0]
-                            # comparar estatus y segundo estatus y también detectar cambios en otras columnas
-                            diffs = []
-                            for c in COLUMNS:
-                                if c == "id":
-                                    continue
-                                oldv = str(old_row.get(c, ""))
-                                newv = str(df_cli.at[idx, c])
-                                if oldv != newv:
-                                    diffs.append(c)
-                            if diffs:
-                                est_old = old_row.get("estatus", "")
-                                est_new = df_cli.at[idx, "estatus"] if "estatus" in df_cli.columns else ""
-                                seg_old = old_row.get("segundo_estatus", "")
-                                seg_new = df_cli.at[idx, "segundo_estatus"] if "segundo_estatus" in df_cli.columns else ""
-                                obs = "Campos cambiados: " + ",".join(diffs)
-                                append_historial(cid, df_cli.at[idx, "nombre"], est_old, est_new, seg_old, seg_new, obs, action="ESTATUS MODIFICADO", actor=actor)
+                    antes = original_df.drop_duplicates("id").set_index("id")
+                    despues = df_cli.drop_duplicates("id").set_index("id")
+                    for cid, diffs in campos_cambiados.items():
+                        obs = "Campos cambiados: " + ",".join(diffs)
+                        eventos_hist.append(evento_historial(
+                            cid, despues.at[cid, "nombre"],
+                            antes.at[cid, "estatus"], despues.at[cid, "estatus"],
+                            antes.at[cid, "segundo_estatus"], despues.at[cid, "segundo_estatus"],
+                            obs, action="ESTATUS MODIFICADO", actor=actor
+                        ))
+                    for cid in ids_agregados:
+                        eventos_hist.append(evento_historial(cid, despues.at[cid, "nombre"], "", despues.at[cid, "estatus"], "", despues.at[cid, "segundo_estatus"], "Alta desde la tabla", action="CLIENTE AGREGADO", actor=actor))
+                    for cid in ids_eliminados:
+                        eventos_hist.append(evento_historial(cid, antes.at[cid, "nombre"], "", "", "", "", f"Eliminado por {actor}", action="CLIENTE ELIMINADO", actor=actor))
                 except Exception:
                     pass
 
-                guardar_clientes(df_cli)
-                st.success("Cambios guardados ✅")
+                if campos_cambiados or ids_agregados or ids_eliminados:
+                    guardar_clientes(df_cli, base=original_df)
+                    # Un solo registro en lote para todo el guardado
+                    append_historial_many(eventos_hist)
+                    st.success("Cambios guardados ✅")
+                else:
+                    st.info("No hay cambios por guardar.")
                 # Forzar reconstrucción de filtros de asesores en el sidebar
-                try:
-                    for _k in ("f_ases", "f_ases_ms", "f_ases_all"):
-                        st.session_state.pop(_k, None)
-                    st.session_state["_filters_token"] = st.session_state.get("_filters_token", 0) + 1
-                except Exception:
-                    pass
+                if any("asesor" in d for d in campos_cambiados.values()) or ids_agregados or ids_eliminados:
+                    try:
+                        for _k in ("f_ases", "f_ases_ms", "f_ases_all"):
+                            st.session_state.pop(_k, None)
+                        st.session_state["_filters_token"] = st.session_state.get("_filters_token", 0) + 1
+                    except Exception:
+                        pass
                 do_rerun()
 
         with col_del:
@@ -5125,7 +6835,8 @@ with tab_cli:
             if can("delete_client"):
                     if ids_quick:
                         # mostrar opciones con 'ID - Nombre' para permitir borrar por nombre visualmente
-                        opts = [""] + [f"{cid} - {get_nombre_by_id(cid)}" if get_nombre_by_id(cid) else str(cid) for cid in ids_quick]
+                        nombres_del = get_fields(ids_quick, ["nombre"])["nombre"].tolist()
+                        opts = [""] + [f"{cid} - {nom}" if nom else str(cid) for cid, nom in zip(ids_quick, nombres_del)]
                         sel = st.selectbox("Cliente a eliminar (ID - Nombre)", opts)
                         # extraer id del texto seleccionado
                         cid_del = ""
@@ -5510,70 +7221,22 @@ with tab_import:
 
         if st.button("🚀 Importar ahora", type="primary", key="btn_importar_2"):
             base = df_cli.copy()
-
-            def _nuevo_id_local(df):
-                base_id = 1000
-                try:
-                    if not df.empty and "id" in df.columns:
-                        nums = []
-                        for x in df["id"].astype(str):
-                            if str(x).startswith("C"):
-                                try:
-                                    nums.append(int(str(x).lstrip("C")))
-                                except Exception:
-                                    continue
-                        if nums:
-                            base_id = max(nums) + 1
-                        else:
-                            base_id = base_id + len(df) + 1
-                except Exception:
-                    base_id = base_id + 1
-                return f"C{base_id}"
+            eventos_hist = []
+            actor = (current_user() or {}).get("user") or (current_user() or {}).get("email")
 
             actualizados = 0
             agregados = 0
 
             df_norm_obj = locals().get('df_norm', None)
             if df_norm_obj is not None and (not getattr(df_norm_obj, 'empty', True)):
-                for _, r in df_norm_obj.iterrows():
-                    r = r.fillna("")
-                    rid = str(r.get("id", "")).strip()
-                    rnombre = str(r.get("nombre", "")).strip()
-                    rtel = str(r.get("telefono", "")).strip()
-
-                    idx = None
-                    if modo == "Actualizar por ID (si coincide)" and rid:
-                        hit = base.index[base["id"] == rid].tolist()
-                        idx = hit[0] if hit else None
-                    elif modo == "Upsert por Nombre+Teléfono" and rnombre and rtel:
-                        hits = base.index[(base["nombre"] == rnombre) & (base["telefono"] == rtel)].tolist()
-                        idx = hits[0] if hits else None
-
-                    # construir registro y mapear asesor contra el base actual
-                    registro = {k: str(r.get(k, "")) for k in COLUMNS if k != "id"}
-                    registro["asesor"] = find_matching_asesor(registro.get("asesor", ""), base)
-
-                    if idx is not None:
-                        for k, v in registro.items():
-                            base.at[idx, k] = v
-                        actualizados += 1
-                        try:
-                            actor = (current_user() or {}).get("user") or (current_user() or {}).get("email")
-                            cid_up = base.at[idx, "id"] if "id" in base.columns else (registro.get("id","") or "")
-                            append_historial(cid_up, registro.get("nombre",""), "", registro.get("estatus",""), "", registro.get("segundo_estatus",""), f"Importación - actualizado", action="ESTATUS MODIFICADO", actor=actor)
-                        except Exception:
-                            pass
-                    else:
-                        if modo == "Agregar (solo nuevos)":
-                            if rnombre and rtel and not base[(base["nombre"] == rnombre) & (base["telefono"] == rtel)].empty:
-                                continue
-                        new_id = rid if rid and (base["id"] != rid).all() else _nuevo_id_local(base)
-                        nuevo = {"id": new_id, **registro}
-                        base = pd.concat([base, pd.DataFrame([nuevo])], ignore_index=True)
-                        agregados += 1
+                # un solo join por la llave del modo; nuevos en un concat y sus ids en un bloque
+                base, df_actualizados, df_agregados = importar_clientes(base, df_norm_obj, modo)
+                actualizados, agregados = len(df_actualizados), len(df_agregados)
+                for registros, nota, accion in ((df_actualizados, "Importación - actualizado", "ESTATUS MODIFICADO"),
+                                                (df_agregados, "Importación - creado", "CLIENTE AGREGADO")):
+                    for cid, nombre_ev, estatus_ev, seg_ev in registros[["id", "nombre", "estatus", "segundo_estatus"]].itertuples(index=False):
                         try:
-                            actor = (current_user() or {}).get("user") or (current_user() or {}).get("email")
-                            append_historial(new_id, nuevo.get("nombre",""), "", nuevo.get("estatus",""), "", nuevo.get("segundo_estatus",""), f"Importación - creado", action="CLIENTE AGREGADO", actor=actor)
+                            eventos_hist.append(evento_historial(cid, nombre_ev, "", estatus_ev, "", seg_ev, nota, action=accion, actor=actor))
                         except Exception:
                             pass
 
@@ -5581,7 +7244,8 @@ with tab_import:
                 base = _fix_missing_or_duplicate_ids(base)
             except Exception:
                 pass
-            guardar_clientes(base)
+            guardar_clientes(base, base=df_cli)
+            append_historial_many(eventos_hist)
             st.success(f"Importación completada ✅  |  Agregados: {agregados}  ·  Actualizados: {actualizados}")
 
             # Limpieza del estado del mapeo para que no “se quede” la UI
@@ -5603,7 +7267,7 @@ with tab_hist:
         # Lazy loading: solo cargar cuando el usuario lo solicite
         col1, col2 = st.columns([2, 1])
         with col1:
-            if st.button("📂 Cargar Historial", key="load_hist", help="Cargar historial desde Google Sheets"):
+            if st.button("📂 Cargar Historial", key="load_hist", help="Cargar historial de movimientos"):
                 st.session_state["hist_loaded"] = True
         with col2:
             if st.session_state.get("hist_loaded", False):
@@ -5619,7 +7283,7 @@ with tab_hist:
                 if force_reload:
                     st.session_state["force_historial_reload"] = False
                 
-                with st.spinner("Cargando historial desde Google Sheets..."):
+                with st.spinner("Cargando historial..."):
                     dfh = cargar_historial(force_reload=force_reload)
             except Exception:
                 dfh = pd.DataFrame()
@@ -5648,7 +7312,7 @@ with tab_hist:
                 with cols_top[3]:
                     # Botón más pequeño y compacto para refrescar historial
                     st.markdown('<div class="small-refresh-button">', unsafe_allow_html=True)
-                    if st.button("🔄 Refrescar", key="refresh_historial", use_container_width=False, help="Actualizar historial desde Google Sheets"):
+                    if st.button("🔄 Refrescar", key="refresh_historial", use_container_width=False, help="Actualizar historial"):
                         # Forzar recarga del historial usando force_reload
                         st.session_state["force_historial_reload"] = True
                         st.rerun()
@@ -5707,9 +7371,8 @@ with tab_hist:
                     pass
                 if st.button("🗑️ Borrar historial"):
                     try:
-                        # Crear un CSV vacío con las columnas correctas
-                        cols = ["id","nombre","estatus_old","estatus_new","segundo_old","segundo_new","observaciones","action","actor","ts"]
-                        pd.DataFrame(columns=cols).to_csv(HISTORIAL_CSV, index=False, encoding="utf-8")
+                        # Compactado vacío + diario vacío
+                        compactar_historial(pd.DataFrame(columns=HIST_COLUMNS))
                         st.success("Historial eliminado correctamente.")
                         do_rerun()
                     except Exception as e:
@@ -0,0 +1,68 @@
+# Render de gráficas para la presentación del dashboard
+# - Cada gráfica se describe como datos puros (un dict "spec") armado en crm.py
+# - render_png() se ejecuta en procesos aparte (ProcessPoolExecutor) con backend Agg,
+#   por eso vive en un módulo importable y no depende de Streamlit ni del estado global de pyplot
+
+import io
+
+import matplotlib
+matplotlib.use("Agg")  # Backend sin GUI (también en los procesos hijos)
+from matplotlib.figure import Figure
+
+DPI = 150
+
+
+def render_png(spec: dict) -> bytes:
+    """
+    Dibuja una gráfica a partir de su spec y la regresa como PNG.
+    Campos: tipo (pie|barh|bar|line), categorias, series [{nombre, valores, color}],
+    colores (por categoría), titulo, xlabel, ylabel, figsize, invertir_y, anotaciones, leyenda.
+    """
+    fig = Figure(figsize=tuple(spec.get("figsize", (8, 5))))
+    ax = fig.subplots()
+    tipo = spec.get("tipo", "bar")
+    categorias = list(spec.get("categorias", []))
+    series = spec.get("series", [])
+    anotaciones = spec.get("anotaciones") or []
+
+    if tipo == "pie":
+        valores = series[0]["valores"] if series else []
+        if sum(valores) > 0:
+            ax.pie(valores, labels=categorias, autopct="%1.1f%%", colors=spec.get("colores"), startangle=90)
+            ax.axis("equal")
+    elif tipo == "barh":
+        valores = series[0]["valores"] if series else []
+        bars = ax.barh(categorias, valores, color=series[0].get("color") if series else None)
+        for bar, texto in zip(bars, anotaciones):
+            ax.text(bar.get_width(), bar.get_y() + bar.get_height() / 2, f" {texto}",
+                    va="center", fontsize=10, fontweight="bold")
+    elif tipo == "bar":
+        valores = series[0]["valores"] if series else []
+        bars = ax.bar(categorias, valores, color=spec.get("colores") or (series[0].get("color") if series else None),
+                      alpha=spec.get("alpha", 1.0), edgecolor=spec.get("edgecolor"))
+        for bar, texto in zip(bars, anotaciones):
+            ax.text(bar.get_x() + bar.get_width() / 2., bar.get_height(), texto,
+                    ha="center", va="bottom", fontsize=11, fontweight="bold")
+    elif tipo == "line":
+        for serie in series:
+            ax.plot(categorias, serie["valores"], marker="o", label=serie.get("nombre"), color=serie.get("color"))
+        if spec.get("leyenda", len(series) > 1):
+            ax.legend()
+        ax.grid(alpha=0.3)
+        for etiqueta in ax.get_xticklabels():
+            etiqueta.set_rotation(45)
+            etiqueta.set_ha("right")
+
+    if spec.get("xlabel"):
+        ax.set_xlabel(spec["xlabel"], fontsize=11)
+    if spec.get("ylabel"):
+        ax.set_ylabel(spec["ylabel"], fontsize=11)
+    if spec.get("titulo"):
+        ax.set_title(spec["titulo"], fontsize=13, fontweight="bold")
+    if spec.get("invertir_y"):
+        ax.invert_yaxis()
+
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=spec.get("dpi", DPI), bbox_inches="tight")
+    return buf.getvalue()
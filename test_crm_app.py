@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de renderizado del CRM con streamlit.testing (AppTest).
+
+Ejecutan crm.py completo, como lo haría `streamlit run`, sobre un directorio
+de datos temporal con un usuario ya autenticado.
+
+Ejecutar con: python test_crm_app.py
+"""
+
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from streamlit.testing.v1 import AppTest
+
+CRM_PY = str(Path(__file__).resolve().parent / "crm.py")
+
+COLUMNAS_CSV = [
+    "id", "nombre", "sucursal", "asesor", "fecha_ingreso", "fecha_dispersion",
+    "estatus", "monto_propuesta", "monto_final", "segundo_estatus",
+    "observaciones", "score", "telefono", "correo", "analista", "fuente",
+]
+
+
+class TestAppCRM(unittest.TestCase):
+    """Renderiza la app con datos locales y revisa los widgets"""
+
+    def setUp(self):
+        """Directorio de trabajo temporal: DATA_DIR es relativo al cwd"""
+        self.cwd_original = os.getcwd()
+        self.test_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.test_dir, "data"))
+        os.chdir(self.test_dir)
+
+    def tearDown(self):
+        """Restaurar el cwd y limpiar"""
+        os.chdir(self.cwd_original)
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def _escribir_clientes(self, filas):
+        with open(os.path.join("data", "clientes.csv"), "w", newline="", encoding="utf-8") as f:
+            w = csv.DictWriter(f, fieldnames=COLUMNAS_CSV)
+            w.writeheader()
+            for fila in filas:
+                w.writerow({c: fila.get(c, "") for c in COLUMNAS_CSV})
+
+    def _correr_app(self) -> AppTest:
+        at = AppTest.from_file(CRM_PY, default_timeout=120)
+        at.secrets["GOOGLE_CLIENT_ID"] = "test"
+        at.secrets["GOOGLE_CLIENT_SECRET"] = "test"
+        at.secrets["REDIRECT_URI"] = "http://localhost"
+        at.session_state["auth_user"] = {"user": "admin", "role": "admin"}
+        at.run()
+        return at
+
+    def test_alta_cliente_con_asesores(self):
+        """El formulario de alta lista los asesores existentes"""
+        print("\n🖥️ Formulario de alta con asesores")
+        self._escribir_clientes([
+            {"id": "C1000", "nombre": "Ana Cliente", "sucursal": "TOXQUI",
+             "asesor": "Juan Pérez", "fecha_ingreso": "2025-01-02", "estatus": "PROPUESTA"},
+            {"id": "C1001", "nombre": "Luis Cliente", "sucursal": "TOXQUI",
+             "asesor": " ", "fecha_ingreso": "2025-01-03", "estatus": "PROPUESTA"},
+        ])
+
+        at = self._correr_app()
+        self.assertEqual([e.message for e in at.exception], [])
+
+        select = [s for s in at.selectbox if s.key == "form_ases_select"]
+        self.assertEqual(len(select), 1)
+        self.assertEqual(select[0].options, ["(Sin asesor)", "Juan Pérez"])
+        print("   ✅ Asesores en el formulario: " + ", ".join(select[0].options))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
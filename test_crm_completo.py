@@ -30,51 +30,23 @@ try:
         safe_name, find_matching_asesor, canonicalize_from_catalog,
         subir_docs, listar_docs_cliente, carpeta_docs_cliente,
         load_sucursales, save_sucursales, load_estatus, save_estatus,
-        cargar_historial, append_historial,
+        cargar_historial, append_historial, compactar_historial,
+        append_historial_many, evento_historial,
+        db_contar_clientes, db_leer_clientes, exportar_clientes_csv,
         DATA_DIR, CLIENTES_CSV, DOCS_DIR, HISTORIAL_CSV,
         COLUMNS, ESTATUS_OPCIONES, SEGUNDO_ESTATUS_OPCIONES, SUCURSALES
     )
+    from base_pruebas_crm import PruebaCRMBase
     print("✅ Importación del módulo CRM exitosa")
 except ImportError as e:
     print(f"❌ Error al importar el módulo CRM: {e}")
     sys.exit(1)
 
-class TestCRMCompleto(unittest.TestCase):
+# Módulos de tests por área (se ejecutan junto con este archivo desde main())
+MODULOS_TESTS = ["test_crm_datos", "test_crm_dashboard", "test_crm_sheets", "test_crm_app"]
+
+class TestCRMCompleto(PruebaCRMBase):
     """Clase de pruebas para el sistema CRM completo"""
-    
-    def setUp(self):
-        """Configuración inicial para cada test"""
-        # Crear directorio temporal para pruebas
-        self.test_dir = tempfile.mkdtemp()
-        self.original_data_dir = DATA_DIR
-        
-        # Redirigir DATA_DIR a directorio temporal
-        import crm
-        crm.DATA_DIR = Path(self.test_dir)
-        crm.CLIENTES_CSV = crm.DATA_DIR / "clientes.csv"
-        crm.DOCS_DIR = crm.DATA_DIR / "docs"
-        crm.HISTORIAL_CSV = crm.DATA_DIR / "historial.csv"
-        
-        # Crear directorios necesarios
-        crm.DATA_DIR.mkdir(exist_ok=True)
-        crm.DOCS_DIR.mkdir(exist_ok=True)
-        
-        print(f"🔧 Configurando test en directorio temporal: {self.test_dir}")
-    
-    def tearDown(self):
-        """Limpieza después de cada test"""
-        # Limpiar directorio temporal
-        if os.path.exists(self.test_dir):
-            shutil.rmtree(self.test_dir)
-        
-        # Restaurar DATA_DIR original
-        import crm
-        crm.DATA_DIR = self.original_data_dir
-        crm.CLIENTES_CSV = crm.DATA_DIR / "clientes.csv"
-        crm.DOCS_DIR = crm.DATA_DIR / "docs"
-        crm.HISTORIAL_CSV = crm.DATA_DIR / "historial.csv"
-        
-        print(f"🧹 Limpieza del test completada")
 
     def test_01_funciones_auxiliares(self):
         """Test 1: Verificar funciones auxiliares"""
@@ -144,9 +116,20 @@ class TestCRMCompleto(unittest.TestCase):
         
         # Guardar clientes
         guardar_clientes(clientes_test)
-        self.assertTrue(Path(self.test_dir, "clientes.csv").exists())
+        self.assertTrue(Path(self.test_dir, "clientes.db").exists())
+        self.assertEqual(db_contar_clientes(), 2)
         print("   ✅ Guardado de clientes exitoso")
         
+        # Un cambio de estatus sólo reescribe esa fila; CSV/XLSX son exportaciones bajo demanda
+        modificados = clientes_test.copy()
+        modificados.loc[1, "estatus"] = "DISPERSADO"
+        guardar_clientes(modificados, base=clientes_test)
+        self.assertEqual(db_leer_clientes().iloc[1]["estatus"], "DISPERSADO")
+        self.assertFalse(Path(self.test_dir, "clientes.csv").exists())
+        exportar_clientes_csv()
+        self.assertTrue(Path(self.test_dir, "clientes.csv").exists())
+        print("   ✅ Upsert por fila y exportación CSV bajo demanda")
+        
         # Cargar clientes
         clientes_cargados = cargar_clientes()
         self.assertEqual(len(clientes_cargados), 2)
@@ -286,9 +269,9 @@ class TestCRMCompleto(unittest.TestCase):
             actor="test_user"
         )
         
-        # Verificar que se creó el archivo de historial
-        self.assertTrue(Path(self.test_dir, "historial.csv").exists())
-        print("   ✅ Archivo de historial creado")
+        # Verificar que se creó el diario de historial (append-only)
+        self.assertTrue(Path(self.test_dir, "historial.jsonl").exists())
+        print("   ✅ Diario de historial creado")
         
         # Test cargar_historial
         historial = cargar_historial()
@@ -314,6 +297,22 @@ class TestCRMCompleto(unittest.TestCase):
         historial_actualizado = cargar_historial()
         self.assertEqual(len(historial_actualizado), 2)
         print(f"   ✅ Historial actualizado: {len(historial_actualizado)} registros")
+        
+        # Registro en lote: una sola escritura para varios eventos
+        append_historial_many([
+            evento_historial(f"C10{i}", f"Cliente {i}", "", "PROPUESTA", action="CLIENTE AGREGADO", actor="test_user")
+            for i in range(3)
+        ])
+        historial_lote = cargar_historial()
+        self.assertEqual(len(historial_lote), 5)
+        self.assertEqual(historial_lote["ts"].tail(3).nunique(), 1)
+        print(f"   ✅ Historial en lote: {len(historial_lote)} registros")
+        
+        # Compactar: el diario se vacía y la lectura conserva los eventos
+        compactar_historial()
+        self.assertEqual(Path(self.test_dir, "historial.jsonl").stat().st_size, 0)
+        self.assertEqual(len(cargar_historial()), 5)
+        print("   ✅ Compactación del historial")
 
     def test_07_catalogos_configuracion(self):
         """Test 7: Catálogos y configuración"""
@@ -479,8 +478,11 @@ def main():
     print("\n🧪 EJECUTANDO TESTS UNITARIOS")
     print("=" * 60)
     
-    # Ejecutar tests unitarios
-    unittest.main(argv=[''], exit=False, verbosity=2)
+    # Ejecutar tests unitarios (este archivo y los módulos por área)
+    cargador = unittest.defaultTestLoader
+    suite = cargador.loadTestsFromModule(sys.modules[__name__])
+    suite.addTests(cargador.loadTestsFromNames(MODULOS_TESTS))
+    unittest.TextTestRunner(verbosity=2).run(suite)
     
     print("\n🎉 TESTS COMPLETADOS")
     print("=" * 60)
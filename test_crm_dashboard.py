@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests del dashboard del CRM: instantánea tipada, cubo de agregados, modelo financiero,
+simulación Monte Carlo, índice de filtros y presentación.
+
+Ejecutar con: python test_crm_dashboard.py
+"""
+
+import io
+import json
+import time
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from crm import (
+    datos_presentacion, graficas_presentacion, generar_presentacion_dashboard,
+    snapshot_clientes, sort_df_by_dates, cubo_clientes, cubo_conteo,
+    resumen_financiero_por_estatus, totales_financieros, proyeccion_financiera,
+    tabla_modelo_financiero, simular_cartera, indice_filtros,
+)
+from base_pruebas_crm import PruebaCRMBase
+
+
+class TestDashboardCRM(PruebaCRMBase):
+    """Agregados, modelo financiero, filtros y presentación del dashboard"""
+
+    def test_graficas_presentacion(self):
+        """Specs de gráficas como datos puros y render a PNG"""
+        print("\n🖼️ Gráficas de la presentación")
+        
+        df = self._df_clientes(
+            id=["C1", "C2", "C3", "C4"],
+            estatus=["DISPERSADO", "PROPUESTA", "RECH. CLIENTE CANCELA", "DISPERSADO"],
+            monto_propuesta=["10000", "$20,000", "", "5000"],
+            fecha_ingreso=["2025-01-05", "2025-02-10", "2025-02-11", "2025-03-01"],
+        )
+        
+        specs = graficas_presentacion(datos_presentacion(df))
+        self.assertIn("mensual", specs)
+        self.assertEqual(specs["kpis"]["series"][0]["valores"], [2, 1, 1])
+        json.dumps(specs)  # sólo datos serializables (viajan a otros procesos)
+        
+        from reporte_graficas import render_png
+        self.assertTrue(render_png(specs["estatus"]).startswith(b"\x89PNG"))
+        
+        from pptx import Presentation
+        prs = Presentation(io.BytesIO(generar_presentacion_dashboard(df, graficas_nativas=True)))
+        graficas = [sh for slide in prs.slides for sh in slide.shapes if sh.has_chart]
+        self.assertEqual(len(graficas), len(specs))
+        print("   ✅ Specs serializables, PNG y gráficas nativas generadas")
+
+    def test_cubo_agregados(self):
+        """Cubo de agregados equivalente a los value_counts/groupby originales"""
+        print("\n🧊 Cubo de agregados")
+        
+        df = self._df_clientes(
+            id=[f"C{i}" for i in range(6)],
+            estatus=["DISPERSADO", "PROPUESTA", "PROPUESTA", "REC EDAD", "", "DISPERSADO"],
+            sucursal=["TOXQUI", "TOXQUI", "COLOKTE", "", "TOXQUI", "COLOKTE"],
+            monto_propuesta=["1000", "$2,000", "3000", "500", "", "x"],
+            monto_final=["900", "", "", "", "", "4000"],
+            fecha_ingreso=["2025-01-05", "2025-01-20", "2025-02-01", "", "2025-02-03", "2025-03-01"],
+        )
+        
+        cubo = cubo_clientes(df)
+        self.assertIs(cubo_clientes(df.copy()), cubo)  # memorizado por contenido
+        self.assertEqual(cubo_conteo(cubo, "sucursal").to_dict(), df["sucursal"].value_counts().to_dict())
+        self.assertEqual(cubo["monto_propuesta"].sum(), 6500)
+        
+        resumen = resumen_financiero_por_estatus(cubo)
+        self.assertEqual(resumen.loc["DISPERSADO", "monto"], 4900)
+        self.assertEqual(resumen.loc["REC EDAD", "prob"], 0.05)
+        self.assertEqual(totales_financieros(resumen)["total_cartera"], 10400)
+        print("   ✅ Conteos, montos y modelo financiero desde el cubo")
+
+    def test_snapshot_tipado(self):
+        """Instantánea tipada (montos, score, fechas y categorías parseados una vez)"""
+        print("\n🧾 Instantánea tipada")
+        
+        df = self._df_clientes(
+            id=["C1", "C2", "C3"],
+            estatus=["DISPERSADO", "PROPUESTA", "DISPERSADO"],
+            monto_propuesta=["$1,500", "", "abc"],
+            score=["700", "", "x"],
+            fecha_ingreso=["03/15/2025", "2025-01-02", ""],
+        )
+        
+        snap = snapshot_clientes(df)
+        self.assertIs(snapshot_clientes(df.copy()), snap)
+        self.assertEqual(snap["monto_propuesta"].tolist(), [1500.0, 0.0, 0.0])
+        self.assertEqual(snap["score"].iloc[0], 700)
+        self.assertTrue(snap["score"].iloc[1:].isna().all())
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(snap["fecha_ingreso"]))
+        self.assertEqual(str(snap["estatus"].dtype), "category")
+        
+        # Ordenar reutilizando las fechas de la instantánea da lo mismo que parsear de nuevo
+        sub = df.iloc[[2, 0, 1]]
+        self.assertTrue(sort_df_by_dates(sub, snap).equals(sort_df_by_dates(sub)))
+        print("   ✅ Tipos y orden por fechas desde la instantánea")
+
+    def test_modelo_financiero_vectorizado(self):
+        """Modelo financiero por cliente y escenarios"""
+        print("\n📐 Modelo financiero vectorizado")
+        
+        df = self._df_clientes(
+            id=["C1", "C2", "C3", "C4"],
+            estatus=["DISPERSADO", "PROPUESTA", "REC EDAD", "PROPUESTA"],
+            monto_propuesta=["1000", "2000", "500", ""],
+            monto_final=["900", "", "", ""],
+        )
+        
+        proy = proyeccion_financiera(snapshot_clientes(df))
+        self.assertEqual(proy["monto"].tolist(), [900.0, 2000.0, 500.0, 0.0])
+        self.assertEqual(proy["prob"].tolist(), [1.0, 0.75, 0.05, 0.75])
+        self.assertAlmostEqual(proy["monto_esperado"].sum(), 900 + 1500 + 25)
+        # Igual que el resumen leído del cubo
+        resumen = resumen_financiero_por_estatus(cubo_clientes(df))
+        self.assertAlmostEqual(resumen["retorno_esperado"].sum(), proy["retorno_esperado"].sum())
+        
+        # Escenarios: DISPERSADO no cambia; el resto se ajusta y se topa en [0, 1]
+        tabla = tabla_modelo_financiero(["DISPERSADO", "PROPUESTA"], "conservador")
+        self.assertEqual(tabla.loc["DISPERSADO", "prob"], 1.0)
+        self.assertAlmostEqual(tabla.loc["PROPUESTA", "prob"], 0.6)
+        tabla = tabla_modelo_financiero(["PROPUESTA"], {"conversion": 2.0})
+        self.assertEqual(tabla.loc["PROPUESTA", "prob"], 1.0)
+        print("   ✅ Montos, probabilidades y escenarios")
+
+    def test_simulacion_monte_carlo(self):
+        """Simulación Monte Carlo reproducible y consistente con el modelo"""
+        print("\n🎲 Simulación Monte Carlo")
+        
+        df = self._df_clientes(
+            id=["C1", "C2", "C3", "C4"],
+            estatus=["DISPERSADO", "PROPUESTA", "PROPUESTA", "RECH. SOBREENDEUDAMIENTO"],
+            sucursal=["TOXQUI", "TOXQUI", "COLOKTE", "COLOKTE"],
+            monto_propuesta=["", "1000", "3000", "500"],
+            monto_final=["2000", "", "", ""],
+        )
+        proy = proyeccion_financiera(snapshot_clientes(df))
+        
+        sim = simular_cartera(proy, simulaciones=2000, semilla=7)
+        otra = simular_cartera(proy, simulaciones=2000, semilla=7)
+        self.assertEqual(sim["total"], otra["total"])
+        self.assertTrue(sim["sucursal"].equals(otra["sucursal"]))
+        # El dispersado es fijo: ninguna simulación queda por debajo
+        self.assertGreaterEqual(sim["total"]["p10"], 2000)
+        self.assertLessEqual(sim["total"]["p90"], 6500)
+        self.assertAlmostEqual(sim["total"]["esperado"], 2000 + 750 + 2250 + 25)
+        self.assertEqual(set(sim["sucursal"].index), {"TOXQUI", "COLOKTE"})
+        
+        # Tamaño realista: 10k clientes, 60 asesores, 8 sucursales, 10k simulaciones en menos de un segundo
+        rng = np.random.default_rng(0)
+        n = 10_000
+        grande = pd.DataFrame({
+            "con_monto": True,
+            "monto": rng.integers(1_000, 200_000, n).astype(float),
+            "prob": rng.choice([0.0, 0.1, 0.3, 0.5, 0.7, 0.9, 1.0], n),
+            "sucursal": rng.choice([f"S{i}" for i in range(8)], n),
+            "asesor": rng.choice([f"A{i}" for i in range(60)], n),
+        })
+        inicio = time.perf_counter()
+        sim = simular_cartera(grande, simulaciones=10_000)
+        self.assertLess(time.perf_counter() - inicio, 1.0)
+        self.assertEqual(len(sim["asesor"]), 60)
+        self.assertTrue(((sim["asesor"]["p10"] <= sim["asesor"]["esperado"]) & (sim["asesor"]["esperado"] <= sim["asesor"]["p90"])).all())
+        self.assertAlmostEqual(sim["sucursal"]["p50"].sum() / sim["total"]["p50"], 1.0, places=2)
+        print("   ✅ Percentiles por sucursal, reproducibilidad con semilla y tiempo a 10k clientes")
+
+    def test_indice_filtros(self):
+        """Índice de filtros por bitmaps equivalente a los isin originales"""
+        print("\n🧮 Índice de filtros")
+        
+        df = self._df_clientes(
+            id=[f"C{i}" for i in range(5)],
+            sucursal=["TOXQUI", "", "COLOKTE", "TOXQUI", "COLOKTE"],
+            asesor=["Ana", " (sin asesor) ", "", "Luis", "Ana"],
+            estatus=["DISPERSADO", "PROPUESTA", "PROPUESTA", "EN ONBOARDING", "DISPERSADO"],
+            fuente=["FB", " ", "", "FB ", "WEB"],
+        )
+        
+        indice = indice_filtros(df)
+        self.assertIs(indice_filtros(df.copy()), indice)
+        self.assertTrue(indice.corresponde(df))
+        self.assertEqual(sorted(indice.valores("asesor")), ["(Sin asesor)", "Ana", "Luis"])
+        self.assertEqual(sorted(indice.valores("fuente")), ["(Sin fuente)", "FB", "WEB"])
+        
+        mask = indice.mascara({"sucursal": ["TOXQUI", "(Sin sucursal)"], "asesor": None,
+                               "estatus": None, "fuente": ["FB", "(Sin fuente)"]})
+        self.assertEqual(mask.tolist(), [True, True, False, True, False])
+        mask = indice.mascara({"asesor": ["(Sin asesor)"], "estatus": ["PROPUESTA"]})
+        self.assertEqual(df.loc[mask, "id"].tolist(), ["C1", "C2"])
+        self.assertFalse(indice.mascara({"estatus": ["NO EXISTE"]}).any())
+        print("   ✅ Máscaras por OR/AND de bitmaps")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de la capa de datos del CRM: caché compartido, diferencias y limitador de Google Sheets,
+exportaciones, índices por id, guardado desde el editor, asesores, ids e importación.
+
+Ejecutar con: python test_crm_datos.py
+"""
+
+import io
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+from crm import (
+    COLUMNS, _DataCache, diff_clientes, _rangos_contiguos, _filtrar_eliminados,
+    _RateLimiter, _gs_codigo_error, _VistasFiltradas, excel_por_asesores, _motor_excel,
+    indice_clientes, get_nombre_by_id, get_fields, guardar_clientes, aplicar_cambios_editor, find_matching_asesor, match_asesores,
+    _CatalogoAsesores, reservar_ids, importar_clientes,
+    HIST_COLUMNS, cargar_historial, leer_historial_local, append_historial_many, evento_historial,
+)
+from base_pruebas_crm import PruebaCRMBase
+
+
+class TestDatosCRM(PruebaCRMBase):
+    """Caché, sincronización, exportaciones e importación de clientes"""
+
+    def test_cache_compartido(self):
+        """Caché compartido con TTL, invalidación y contadores"""
+        print("\n🗄️ Caché compartido")
+        
+        cache = _DataCache()
+        self.assertIsNone(cache.get("clientes"))
+        cache.put("clientes", pd.DataFrame({"id": ["C1000"]}))
+        self.assertEqual(len(cache.get("clientes")), 1)
+        self.assertEqual(cache.version("clientes"), 1)
+        
+        # TTL vencido: get() falla pero peek() conserva la última instantánea
+        self.assertIsNone(cache.get("clientes", ttl=0))
+        self.assertIsNotNone(cache.peek("clientes"))
+        
+        # Invalidación por prefijo
+        cache.put("catalogo:estatus", ["A"])
+        cache.put("catalogo:sucursales", ["B"])
+        cache.invalidate("catalogo:")
+        self.assertIsNone(cache.peek("catalogo:estatus"))
+        self.assertIsNone(cache.peek("catalogo:sucursales"))
+        
+        stats = {s["dataset"]: s for s in cache.stats()}
+        self.assertEqual(stats["clientes"]["aciertos"], 1)
+        self.assertEqual(stats["clientes"]["fallos"], 2)
+        print("   ✅ TTL, invalidación y contadores correctos")
+
+    def test_diff_clientes(self):
+        """Diferencia vectorizada y tramos contiguos"""
+        print("\n🧮 Diferencia de clientes")
+        
+        base = pd.DataFrame({c: [f"{c}{i}" for i in range(6)] for c in COLUMNS})
+        base["id"] = [f"C{1000 + i}" for i in range(6)]
+        nuevo = base.copy()
+        nuevo.loc[[1, 2], "estatus"] = "DISPERSADO"
+        nuevo = nuevo[nuevo["id"] != "C1005"]
+        nuevo = pd.concat([nuevo, base.iloc[[0]].assign(id="C2000")], ignore_index=True)
+        
+        dif = diff_clientes(base, nuevo)
+        self.assertEqual(dif["insertados"], ["C2000"])
+        self.assertEqual(sorted(dif["actualizados"]), ["C1001", "C1002"])
+        self.assertEqual(dif["eliminados"], ["C1005"])
+        self.assertEqual(_rangos_contiguos([9, 2, 3, 4, 12, 13]), [(2, 4), (9, 9), (12, 13)])
+        
+        hoja = base.assign(eliminado=["", "2025-01-01 10:00:00", "", "", " ", ""])
+        visibles = _filtrar_eliminados(hoja)
+        self.assertNotIn("C1001", visibles["id"].tolist())
+        self.assertEqual(list(visibles.columns), COLUMNS)
+        print("   ✅ Insertados, actualizados, eliminados y tramos correctos")
+
+    def test_limitador_google(self):
+        """Token bucket, carriles y códigos de reintento"""
+        print("\n🚦 Limitador de llamadas a Google")
+        
+        limiter = _RateLimiter(por_minuto=600, rafaga=3, reserva=1)
+        for _ in range(3):
+            self.assertLess(limiter.adquirir(), 0.05)
+        self.assertGreater(limiter.adquirir("fondo"), 0.1)
+        uso = limiter.metricas()[0]
+        self.assertEqual((uso["interactivo"], uso["fondo"]), (3, 1))
+        # Una llamada que hace varias peticiones cobra todas
+        compuesto = _RateLimiter(por_minuto=600, rafaga=3)
+        self.assertLess(compuesto.adquirir(costo=2), 0.05)
+        self.assertGreater(compuesto.adquirir(costo=2), 0.05)
+        self.assertEqual(compuesto.metricas()[0]["interactivo"], 4)
+        # Reintentos: los 429 vacían el bucket, los demás sólo se cuentan
+        compuesto.registrar_reintento()
+        compuesto.penalizar()
+        self.assertEqual(compuesto.metricas()[0]["reintentos"], 2)
+        
+        class _Error(Exception):
+            code = 429
+        self.assertEqual(_gs_codigo_error(_Error()), 429)
+        self.assertEqual(_gs_codigo_error(Exception("Quota exceeded for quota metric")), 429)
+        self.assertIsNone(_gs_codigo_error(ValueError("x")))
+        print("   ✅ Espera, carril de fondo y métricas correctas")
+
+    def test_vistas_filtradas(self):
+        """LRU de vistas filtradas por versión y selección"""
+        print("\n🗂️ Vistas filtradas memorizadas")
+        
+        df = pd.DataFrame({"id": ["C1", "C2", "C3"], "estatus": ["A", "B", "A"]})
+        vistas = _VistasFiltradas(maximo=2)
+        construidas = []
+        def construir(valor):
+            def _f():
+                construidas.append(valor)
+                return df[df["estatus"] == valor]
+            return _f
+        
+        k1 = _VistasFiltradas.clave("v1", {"estatus": ["A", "B"], "sucursal": None})
+        self.assertEqual(k1, _VistasFiltradas.clave("v1", {"sucursal": None, "estatus": ["B", "A"]}))
+        v = vistas.obtener(k1, construir("A"))
+        self.assertEqual(v["id"].tolist(), ["C1", "C3"])
+        vistas.obtener(k1, construir("A"))
+        self.assertEqual(construidas, ["A"])  # segunda vez desde el LRU
+        
+        # Escribir en la vista entregada no altera la guardada
+        v.loc[:, "estatus"] = "Z"
+        self.assertEqual(vistas.obtener(k1, construir("A"))["estatus"].tolist(), ["A", "A"])
+        
+        vistas.obtener(_VistasFiltradas.clave("v2", {}), construir("B"))
+        vistas.obtener(_VistasFiltradas.clave("v3", {}), construir("B"))
+        self.assertEqual(vistas.stats()["vistas"], 2)  # la más antigua salió
+        self.assertEqual(vistas.stats()["aciertos"], 2)
+        print("   ✅ Aciertos, desalojo LRU y copias superficiales")
+
+    def test_excel_por_asesores(self):
+        """Excel por asesores en un solo groupby (una pestaña por asesor)"""
+        print("\n📊 Excel por asesores")
+        if _motor_excel() is None:
+            self.skipTest("Sin motor Excel instalado")
+        import openpyxl
+        
+        df = self._df_clientes(
+            id=["C1", "C2", "C3", "C4"],
+            asesor=["Ana", "", "Luis", "Ana"],
+            fecha_ingreso=["2025-01-02", "", "2025-03-04", "2025-01-01"],
+        )
+        
+        libro = openpyxl.load_workbook(io.BytesIO(excel_por_asesores(df)))
+        self.assertEqual(sorted(libro.sheetnames), ["(Sin asesor)", "Ana", "Luis"])
+        hoja = libro["Ana"]
+        self.assertEqual(hoja.max_row, 3)  # encabezado + 2 clientes
+        self.assertEqual(hoja.cell(row=2, column=1).value, "C4")  # ordenado por fecha de ingreso
+        print("   ✅ Pestañas por asesor y orden por fechas")
+
+    def test_indice_clientes(self):
+        """Índice id -> fila con consultas individuales y por lote"""
+        print("\n🔎 Índice de clientes por id")
+        
+        df = pd.DataFrame({"id": ["C1", "C2", "C1"], "nombre": ["Ana", "Luis", "Repetido"],
+                           "estatus": ["PROPUESTA", "DISPERSADO", ""]})
+        indice = indice_clientes(df)
+        self.assertEqual(indice.get_field("C2", "nombre"), "Luis")
+        self.assertEqual(indice.get_field("C1", "nombre"), "Ana")  # primera aparición
+        self.assertEqual(indice.get_field("C9", "nombre"), "")
+        self.assertEqual(indice.get_field("C1", "no_existe"), "")
+        
+        lote = indice.get_fields(["C2", "C9", "C1"], ["nombre", "estatus"])
+        self.assertEqual(lote["nombre"].tolist(), ["Luis", "", "Ana"])
+        self.assertEqual(lote.loc["C2", "estatus"], "DISPERSADO")
+        
+        # Las consultas por id siguen la versión de la carga vigente
+        guardar_clientes(self._df_clientes(id=["C1", "C2"], nombre=["Ana", "Luis"]))
+        self.assertEqual(get_nombre_by_id("C2"), "Luis")
+        guardar_clientes(self._df_clientes(id=["C1", "C2"], nombre=["Ana", "Luisa"]))
+        self.assertEqual(get_nombre_by_id("C2"), "Luisa")
+        self.assertEqual(get_fields(["C1", "C9"], ["nombre"])["nombre"].tolist(), ["Ana", ""])
+        print("   ✅ Consultas O(1) y por lote")
+
+    def test_cambios_editor(self):
+        """Guardado por conjunto de cambios del data_editor"""
+        print("\n✏️ Cambios del editor")
+        
+        base = self._df_clientes(
+            id=["C1", "C2", "C3"],
+            nombre=["Ana", "Luis", "Eva"],
+            asesor=["Juan Pérez", "", "Juan Pérez"],
+            estatus=["PROPUESTA", "PROPUESTA", "DISPERSADO"],
+        )
+        editor = base.iloc[[2, 0, 1]].reset_index(drop=True)  # orden distinto al de la base
+        
+        cambios = {
+            "edited_rows": {1: {"estatus": "DISPERSADO"}, 2: {"asesor": "juan perez"}, 0: {"nombre": "Eva"}},
+            "added_rows": [], "deleted_rows": [],
+        }
+        nuevo, campos, agregados, eliminados = aplicar_cambios_editor(base, editor, cambios)
+        self.assertEqual(campos, {"C1": ["estatus"], "C2": ["asesor"]})  # C3 no cambió de valor
+        self.assertEqual(nuevo.set_index("id").at["C1", "estatus"], "DISPERSADO")
+        self.assertEqual(nuevo.set_index("id").at["C2", "asesor"], "Juan Pérez")  # forma registrada
+        self.assertEqual((agregados, eliminados), ([], []))
+        
+        nuevo, campos, agregados, eliminados = aplicar_cambios_editor(
+            base, editor, {"deleted_rows": [0], "added_rows": [{"nombre": "Nuevo"}]})
+        self.assertEqual(eliminados, ["C3"])
+        self.assertEqual(len(agregados), 1)
+        self.assertEqual(sorted(nuevo["id"]), sorted(["C1", "C2"] + agregados))
+        print("   ✅ Sólo se aplican y registran las filas tocadas")
+
+    def test_match_asesores(self):
+        """Unificación de asesores por columna completa"""
+        print("\n👥 match_asesores")
+        
+        referencia = pd.DataFrame({"asesor": ["José Pérez", "", "Ana López", "ana lopez"]})
+        entrada = pd.Series(["jose perez", " ANA LÓPEZ ", "nuevo  nombre", "NUEVO NOMBRE", "", None])
+        resultado = match_asesores(entrada, referencia)
+        self.assertEqual(resultado.tolist(), ["José Pérez", "Ana López", "Nuevo Nombre", "Nuevo Nombre", "", ""])
+        # Igual que find_matching_asesor valor por valor
+        for valor, esperado in zip(["jose perez", "Roberto Kim"], match_asesores(pd.Series(["jose perez", "Roberto Kim"]), referencia)):
+            self.assertEqual(find_matching_asesor(valor, referencia), esperado)
+        
+        # El catálogo compartido sigue a la base: un renombre reemplaza la forma anterior
+        catalogo = _CatalogoAsesores()
+        with patch("crm.cargar_clientes", return_value=pd.DataFrame({"asesor": ["JUAN PEREZ", "Ana López"]})), \
+                patch.object(_DataCache, "version", return_value=1):
+            catalogo.sincronizar()
+        self.assertIn("JUAN PEREZ", catalogo.diccionario().values())
+        with patch("crm.cargar_clientes", return_value=pd.DataFrame({"asesor": ["Juan Pérez", "Ana López"]})), \
+                patch.object(_DataCache, "version", return_value=2):
+            catalogo.sincronizar()
+        self.assertEqual(sorted(catalogo.diccionario().values()), ["Ana López", "Juan Pérez"])
+        print("   ✅ Coincidencias, nombres nuevos y vacíos")
+
+    def test_reservar_ids(self):
+        """Contador persistente de IDs y reserva por bloques"""
+        print("\n🔢 reservar_ids")
+        
+        primero = reservar_ids(1)
+        bloque = reservar_ids(5)
+        self.assertEqual(len(bloque), 5)
+        self.assertEqual(len(set(primero + bloque)), 6)
+        numeros = [int(x[1:]) for x in primero + bloque]
+        self.assertEqual(numeros, sorted(numeros))
+        print("   ✅ Bloques consecutivos sin repetir")
+        
+        # Los ids ya usados fuera de la base tampoco se entregan
+        siguiente = f"C{numeros[-1] + 1}"
+        self.assertNotIn(siguiente, reservar_ids(1, pd.Series([siguiente])))
+        self.assertEqual(reservar_ids(0), [])
+        print("   ✅ Evita ids existentes")
+
+    def test_importar_clientes(self):
+        """Importación por join (actualiza, agrega y respeta repetidos)"""
+        print("\n📥 importar_clientes")
+        
+        base = self._df_clientes(
+            id=["C1000", "C1001"],
+            nombre=["Ana", "Beto"],
+            telefono=["111", "222"],
+        )
+        entrada = pd.DataFrame({
+            "id": ["", "", "C1000"],
+            "nombre": ["Ana", "Caro", "Caro"],
+            "telefono": ["111", "333", "333"],
+            "estatus": ["DISPERSADO", "EN ONBOARDING", "PROPUESTA"],
+        })
+        
+        nuevo, actualizados, agregados = importar_clientes(base, entrada, "Upsert por Nombre+Teléfono")
+        self.assertEqual(len(nuevo), 3)
+        self.assertEqual(nuevo.loc[nuevo["nombre"] == "Ana", "estatus"].tolist(), ["DISPERSADO"])
+        # La segunda fila de Caro actualiza el registro que creó la primera
+        self.assertEqual(nuevo.loc[nuevo["nombre"] == "Caro", "estatus"].tolist(), ["PROPUESTA"])
+        self.assertEqual((len(actualizados), len(agregados)), (2, 1))
+        self.assertFalse(nuevo["id"].duplicated().any())
+        print("   ✅ Upsert por Nombre+Teléfono")
+        
+        nuevo, actualizados, agregados = importar_clientes(base, entrada, "Agregar (solo nuevos)")
+        self.assertEqual(len(nuevo), 3)
+        self.assertEqual(nuevo.loc[nuevo["nombre"] == "Caro", "estatus"].tolist(), ["EN ONBOARDING"])
+        self.assertEqual(base["estatus"].tolist(), ["", ""])
+        print("   ✅ Agregar solo nuevos sin modificar la base")
+
+
+    def test_historial_local_primero(self):
+        """El historial se lee del diario local; Sheets sólo hidrata el primer arranque"""
+        print("\n📜 Historial local con Google Sheets como espejo")
+        
+        remoto = pd.DataFrame([{c: "" for c in HIST_COLUMNS} | {"id": "C1", "action": "IMPORTADO", "ts": "2025-01-01"}])
+        with patch("crm._historial_desde_gsheet", return_value=remoto) as hoja:
+            # Primer arranque: sin historial local se hidrata desde la hoja
+            self.assertEqual(cargar_historial()["action"].tolist(), ["IMPORTADO"])
+            self.assertEqual(hoja.call_count, 1)
+            self.assertEqual(len(leer_historial_local()), 1)
+            
+            # Con historial local, ni los appends ni la recarga forzada vuelven a leer la hoja
+            append_historial_many([evento_historial("C2", "Luis", action="DOCUMENTOS", actor="test")])
+            self.assertEqual(cargar_historial()["id"].tolist(), ["C1", "C2"])
+            self.assertEqual(len(cargar_historial(force_reload=True)), 2)
+            self.assertEqual(hoja.call_count, 1)
+        print("   ✅ Lecturas locales sin descargar la hoja")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
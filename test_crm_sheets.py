@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests de la sincronización con Google Sheets sin red: cola write-behind (sync_queue)
+y mapa id -> fila de la hoja de clientes, contra una hoja falsa en memoria.
+
+Ejecutar con: python test_crm_sheets.py
+"""
+
+import re
+import time
+import unittest
+from unittest.mock import patch
+
+import crm
+from crm import (
+    COLUMNS, SHEET_COLUMNS, _RateLimiter, _SheetsSyncWorker, sync_encolar, sync_pendientes,
+    sync_vaciar_ahora, db_upsert_clientes, _gs_aplicar_clientes, _rowmap_leer,
+    _rowmap_reconstruir, _rowmap_verificar, _marcas_pendientes,
+)
+from base_pruebas_crm import PruebaCRMBase
+
+
+def _col(letras: str) -> int:
+    n = 0
+    for ch in letras:
+        n = n * 26 + ord(ch) - 64
+    return n
+
+
+class HojaFalsa:
+    """Worksheet en memoria con las llamadas de gspread que usa la sincronización."""
+
+    def __init__(self, filas=None):
+        self.filas = [list(f) for f in (filas or [SHEET_COLUMNS])]
+        self.llamadas = []
+
+    def _celda(self, fila: int, col: int) -> str:
+        if fila <= len(self.filas) and col <= len(self.filas[fila - 1]):
+            return self.filas[fila - 1][col - 1]
+        return ""
+
+    def _escribir(self, rango: str, valores):
+        m = re.match(r"([A-Z]+)(\d+)", rango)
+        col0, fila0 = _col(m.group(1)), int(m.group(2))
+        for i, valores_fila in enumerate(valores):
+            while len(self.filas) < fila0 + i:
+                self.filas.append([])
+            destino = self.filas[fila0 + i - 1]
+            for j, v in enumerate(valores_fila):
+                while len(destino) < col0 + j:
+                    destino.append("")
+                destino[col0 + j - 1] = v
+
+    def row_values(self, fila):
+        self.llamadas.append("row_values")
+        return list(self.filas[fila - 1]) if fila <= len(self.filas) else []
+
+    def update(self, rango, valores, **kwargs):
+        self.llamadas.append("update")
+        self._escribir(rango, valores)
+
+    def batch_update(self, datos, **kwargs):
+        self.llamadas.append("batch_update")
+        self.ultimos_rangos = [d["range"] for d in datos]
+        for d in datos:
+            self._escribir(d["range"], d["values"])
+
+    def append_rows(self, valores, **kwargs):
+        self.llamadas.append("append_rows")
+        while self.filas and not any(str(v).strip() for v in self.filas[-1]):
+            self.filas.pop()
+        inicio = len(self.filas) + 1
+        self.filas.extend(list(v) for v in valores)
+        return {"updates": {"updatedRange": f"clientes!A{inicio}:Q{inicio + len(valores) - 1}"}}
+
+    def batch_get(self, rangos, **kwargs):
+        self.llamadas.append("batch_get")
+        salida = []
+        for rango in rangos:
+            columna = re.fullmatch(r"([A-Z]+):\1", rango)
+            if columna:
+                col = _col(columna.group(1))
+                valores = [self._celda(f, col) for f in range(1, len(self.filas) + 1)]
+                while valores and valores[-1] == "":
+                    valores.pop()
+                salida.append([valores] if valores else [])
+                continue
+            m = re.match(r"([A-Z]+)(\d+)", rango)
+            v = self._celda(int(m.group(2)), _col(m.group(1)))
+            salida.append([[v]] if v != "" else [])
+        return salida
+
+
+class _BaseSheets(PruebaCRMBase):
+    """Hoja falsa y limitador sin esperas para cada test"""
+
+    def setUp(self):
+        super().setUp()
+        limitador = _RateLimiter(por_minuto=60_000, rafaga=1_000)
+        for p in (patch("crm.USE_GSHEETS", True), patch("crm._gs_limiter", return_value=limitador)):
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _fila_cliente(self, cid: str, nombre: str = "", marca: str = "") -> list:
+        fila = {c: "" for c in SHEET_COLUMNS} | {"id": cid, "nombre": nombre, crm.GSHEET_TOMBSTONE_COL: marca}
+        return [fila[c] for c in SHEET_COLUMNS]
+
+    def _hoja(self, *clientes) -> HojaFalsa:
+        """Hoja con encabezado y una fila por (id, nombre[, marca])."""
+        hoja = HojaFalsa([SHEET_COLUMNS] + [self._fila_cliente(*c) for c in clientes])
+        p = patch("crm._gs_open_worksheet", return_value=hoja)
+        p.start()
+        self.addCleanup(p.stop)
+        return hoja
+
+
+class TestColaSincronizacion(_BaseSheets):
+    """sync_queue: coalescencia por id, reintentos con backoff y retiro de lotes"""
+
+    def setUp(self):
+        super().setUp()
+        # Worker sin hilo de fondo: los tests llaman vaciar() directamente
+        with patch.object(_SheetsSyncWorker, "_loop", lambda self: None):
+            self.worker = _SheetsSyncWorker()
+        p = patch("crm._sync_worker", return_value=self.worker)
+        p.start()
+        self.addCleanup(p.stop)
+        db_upsert_clientes(self._df_clientes(id=["C1", "C2", "C3"], nombre=["Ana", "Luis", "Eva"]))
+
+    def _cola(self) -> dict:
+        conn, lock = crm._db()
+        with lock:
+            filas = conn.execute("SELECT id, op, intentos, proximo_intento, ultimo_error FROM sync_queue").fetchall()
+        return {cid: {"op": op, "intentos": n, "proximo_intento": prox, "ultimo_error": err}
+                for cid, op, n, prox, err in filas}
+
+    def test_lote_exitoso(self):
+        """Un lote subido sin error sale de la cola"""
+        print("\n📤 Lote de sincronización exitoso")
+
+        sync_encolar(["C1", "C2"])
+        with patch("crm._gs_aplicar_clientes") as aplicar:
+            self.assertEqual(self.worker.vaciar(), 2)
+        df_subido, ids_delete = aplicar.call_args.args
+        self.assertEqual(sorted(df_subido["id"]), ["C1", "C2"])
+        self.assertEqual(list(ids_delete), [])
+        self.assertEqual(self._cola(), {})
+        self.assertEqual(self.worker.subidos, 2)
+        print("   ✅ Lote retirado de la cola")
+
+    def test_lote_fallido(self):
+        """Un error de la API deja el lote con intentos y próximo intento diferido"""
+        print("\n⏳ Reintento con backoff")
+
+        sync_encolar(["C1"])
+        antes = time.time()
+        with patch("crm._gs_aplicar_clientes", side_effect=RuntimeError("cuota agotada")) as aplicar:
+            self.assertEqual(self.worker.vaciar(), 0)
+            cola = self._cola()["C1"]
+            self.assertEqual(cola["intentos"], 1)
+            self.assertGreaterEqual(cola["proximo_intento"], antes + crm.SYNC_BACKOFF_BASE)
+            self.assertIn("cuota agotada", cola["ultimo_error"])
+            # Dentro del backoff no se vuelve a intentar
+            self.assertEqual(self.worker.vaciar(), 0)
+            self.assertEqual(aplicar.call_count, 1)
+
+        # sync_vaciar_ahora ignora el backoff pendiente
+        with patch("crm._gs_aplicar_clientes") as aplicar:
+            self.assertEqual(sync_vaciar_ahora(), 1)
+        self.assertEqual(aplicar.call_count, 1)
+        self.assertEqual(self._cola(), {})
+        print("   ✅ Intentos, backoff y vaciado forzado")
+
+    def test_reencolado_durante_subida(self):
+        """Un id encolado de nuevo mientras se subía su lote se queda en la cola"""
+        print("\n🔁 Reencolado durante la subida")
+
+        sync_encolar(["C1", "C2"])
+
+        def _guardado_concurrente(df, ids_delete):
+            time.sleep(0.01)   # encolado posterior con otra marca de tiempo
+            sync_encolar(["C1"])
+
+        with patch("crm._gs_aplicar_clientes", side_effect=_guardado_concurrente):
+            self.assertEqual(self.worker.vaciar(), 2)
+        self.assertEqual(set(self._cola()), {"C1"})
+        print("   ✅ Sólo se retiran los ids no modificados")
+
+    def test_borrado_reemplaza_upsert(self):
+        """Un delete pendiente reemplaza al upsert encolado del mismo id"""
+        print("\n🗑️ Borrado sobre upsert pendiente")
+
+        sync_encolar(["C1", "C2"])
+        sync_encolar(["C1"], op="delete")
+        self.assertEqual(sync_pendientes(), {"upsert": {"C2"}, "delete": {"C1"}})
+
+        with patch("crm._gs_aplicar_clientes") as aplicar:
+            self.assertEqual(self.worker.vaciar(), 2)
+        df_subido, ids_delete = aplicar.call_args.args
+        self.assertEqual(df_subido["id"].tolist(), ["C2"])
+        self.assertEqual(list(ids_delete), ["C1"])
+        print("   ✅ Una sola operación por id")
+
+
+class TestMapaFilas(_BaseSheets):
+    """Mapa id -> fila: verificación, reconstrucción y escrituras por rango"""
+
+    def test_rangos_contiguos(self):
+        """Los upserts de filas contiguas se escriben en un solo rango"""
+        print("\n📏 Escritura por tramos contiguos")
+
+        hoja = self._hoja(("C1", "Ana"), ("C2", "Luis"), ("C3", "Eva"), ("C4", "Ceci"), ("C5", "Raúl"))
+        _rowmap_reconstruir(hoja)
+        hoja.llamadas.clear()
+
+        _gs_aplicar_clientes(self._df_clientes(id=["C4", "C1", "C2"], nombre=["Cecilia", "Ana María", "Luis"]))
+        self.assertEqual(hoja.ultimos_rangos, ["A2:Q3", "A5:Q5"])
+        self.assertEqual(hoja.filas[4][1], "Cecilia")
+        self.assertEqual(hoja.filas[1][1], "Ana María")
+        # Verificación barata (un batch_get) sin reconstruir ni agregar filas
+        self.assertEqual(hoja.llamadas, ["row_values", "batch_get", "batch_update"])
+        print("   ✅ Rangos A2:Q3 y A5:Q5 en un batch_update")
+
+    def test_reconstruye_si_hay_filas_nuevas(self):
+        """Datos después de la última fila conocida invalidan el mapa"""
+        print("\n🧭 Fila agregada por fuera del CRM")
+
+        hoja = self._hoja(("C1", "Ana"), ("C2", "Luis"))
+        filas, ultima = _rowmap_reconstruir(hoja)
+        hoja.filas.append(self._fila_cliente("C9", "Externo"))
+        self.assertFalse(_rowmap_verificar(hoja, filas, ultima, ["C1"]))
+
+        _gs_aplicar_clientes(self._df_clientes(id=["C9"], nombre=["Externo editado"]))
+        self.assertNotIn("append_rows", hoja.llamadas)
+        self.assertEqual(len(hoja.filas), 4)
+        self.assertEqual(hoja.filas[3][1], "Externo editado")
+        self.assertEqual(_rowmap_leer(), ({"C1": 2, "C2": 3, "C9": 4}, 4))
+        print("   ✅ Mapa reconstruido; el cliente se actualiza en su fila")
+
+    def test_reconstruye_si_no_coincide_la_fila(self):
+        """Una celda objetivo con otro id obliga a reconstruir antes de escribir"""
+        print("\n🔀 Hoja reordenada")
+
+        hoja = self._hoja(("C1", "Ana"), ("C2", "Luis"))
+        filas, ultima = _rowmap_reconstruir(hoja)
+        hoja.filas[1], hoja.filas[2] = hoja.filas[2], hoja.filas[1]
+        self.assertFalse(_rowmap_verificar(hoja, filas, ultima, ["C1"]))
+
+        _gs_aplicar_clientes(self._df_clientes(id=["C1"], nombre=["Ana María"]))
+        self.assertEqual(hoja.filas[2][:2], ["C1", "Ana María"])
+        self.assertEqual(hoja.filas[1][:2], ["C2", "Luis"])
+        print("   ✅ Escritura en la fila real del cliente")
+
+    def test_marcas_de_borrado(self):
+        """Las filas marcadas no entran al mapa y el borrado sólo escribe la marca"""
+        print("\n🪦 Filas con marca de borrado")
+
+        hoja = self._hoja(("C1", "Ana"), ("C2", "Luis", "2025-01-01 10:00:00"), ("C3", "Eva"))
+        filas, ultima = _rowmap_reconstruir(hoja)
+        self.assertEqual((filas, ultima), ({"C1": 2, "C3": 4}, 4))
+
+        _gs_aplicar_clientes(self._df_clientes(), ["C3"])
+        col_marca = len(COLUMNS)
+        self.assertNotEqual(hoja.filas[3][col_marca], "")
+        self.assertEqual(len(hoja.filas), 4)   # ninguna fila se mueve
+        self.assertEqual(_rowmap_leer(), ({"C1": 2}, 4))
+        self.assertEqual(_marcas_pendientes(), 1)
+        print("   ✅ Mapa sin marcadas y borrado lógico")
+
+    def test_append_extiende_mapa(self):
+        """Los clientes nuevos se agregan y el mapa sigue el rango que reporta la API"""
+        print("\n➕ Append con updatedRange")
+
+        hoja = self._hoja(("C1", "Ana"), ("C2", "Luis"))
+        _rowmap_reconstruir(hoja)
+
+        _gs_aplicar_clientes(self._df_clientes(id=["C7", "C8"], nombre=["Nuevo", "Otro"]))
+        self.assertEqual([f[0] for f in hoja.filas[1:]], ["C1", "C2", "C7", "C8"])
+        self.assertEqual(_rowmap_leer(), ({"C1": 2, "C2": 3, "C7": 4, "C8": 5}, 5))
+
+        # El mapa extendido pasa la verificación siguiente sin reconstruir
+        hoja.llamadas.clear()
+        _gs_aplicar_clientes(self._df_clientes(id=["C8"], nombre=["Otro editado"]))
+        self.assertEqual(hoja.llamadas, ["batch_get", "batch_update"])
+        self.assertEqual(hoja.filas[4][1], "Otro editado")
+        print("   ✅ Filas nuevas registradas sin releer la hoja")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)